@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark listing all open files, and the open files "px PID" needs
+
+Usage:
+  benchmark_file_get_all.py [BACKEND]
+
+BACKEND is "proc" or "lsof". If no BACKEND is given, all backends available on
+this system are benchmarked.
+
+Before benchmarking the live system, we also time parsing the lsof output
+fixtures in tests/lsof-test-output-linux-*.txt. That is the part of the lsof
+backend the proc backend doesn't need to do at all.
+"""
+
+import os
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+
+import sys
+sys.path.insert(0, os.path.join(MYDIR, ".."))
+
+import glob
+import time
+
+from px import px_file
+
+LAPS = 10
+
+
+def benchmark_fixtures():
+    fixtures = sorted(glob.glob(
+        os.path.join(MYDIR, "..", "tests", "lsof-test-output-linux-*.txt")))
+    for fixture in fixtures:
+        with open(fixture, "r") as lsof_output:
+            lsof = lsof_output.read()
+
+        t0 = time.time()
+        for iteration in range(LAPS):
+            files = px_file.lsof_to_files(lsof)
+        t1 = time.time()
+        dt_seconds = t1 - t0
+
+        print("Parsing {} ({} files) takes {:.0f}ms".format(
+            os.path.basename(fixture), len(files), 1000 * dt_seconds / LAPS))
+
+        t0 = time.time()
+        for iteration in range(LAPS):
+            fd = os.open(fixture, os.O_RDONLY)
+            try:
+                files = list(px_file.lsof_stream_to_files(fd))
+            finally:
+                os.close(fd)
+        t1 = time.time()
+        dt_seconds = t1 - t0
+
+        print("Stream parsing {} ({} files) takes {:.0f}ms".format(
+            os.path.basename(fixture), len(files), 1000 * dt_seconds / LAPS))
+
+
+def benchmark(backend):
+    for workers in sorted(set([1, px_file.get_default_worker_count()])):
+        t0 = time.time()
+        for iteration in range(LAPS):
+            files = px_file.get_all(backend, workers=workers)
+        t1 = time.time()
+        dt_seconds = t1 - t0
+
+        print("Getting all {} files using {} with {} workers takes {:.0f}ms".format(
+            len(files), backend, workers, 1000 * dt_seconds / LAPS))
+
+    pid = os.getpid()
+    t0 = time.time()
+    for iteration in range(LAPS):
+        files = px_file.get_for_process(pid, backend)
+    t1 = time.time()
+    dt_seconds = t1 - t0
+
+    print("Getting {} files for one process using {} takes {:.0f}ms".format(
+        len(files), backend, 1000 * dt_seconds / LAPS))
+
+
+def main(args):
+    if args:
+        benchmark(args[0])
+        return
+
+    benchmark_fixtures()
+
+    if px_file.get_default_backend() == px_file.BACKEND_PROC:
+        benchmark(px_file.BACKEND_PROC)
+    benchmark(px_file.BACKEND_LSOF)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
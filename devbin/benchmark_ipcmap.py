@@ -10,6 +10,10 @@ FILE is a file containing the output of "lsof -F fnaptd0i".
 
 This program will parse that output and make an IPC map of the process that has
 the highest number of entries in that file.
+
+Mapping is done in two phases, indexing all files into an IpcGraph and then
+querying that graph for the most popular PID. Timings and peak memory usage
+are reported for loading and for both mapping phases.
 """
 
 import os
@@ -18,13 +22,18 @@ MYDIR = os.path.dirname(os.path.abspath(__file__))
 import sys
 sys.path.insert(0, os.path.join(MYDIR, ".."))
 
+import gc
 import time
 
 from tests import testutils
 from px import px_file
+from px import px_process
+from px import px_ipc_map
 
 if sys.version_info.major >= 3:
     # For mypy PEP-484 static typing validation
+    from typing import List            # NOQA
+    from typing import Tuple           # NOQA
     from typing import MutableMapping  # NOQA
 
 
@@ -42,11 +51,18 @@ def get_most_common_pid(files):
     return sorted(counts.keys(), key=lambda pid: counts[pid])[-1]
 
 
-def get_timings(file, pid):
+def create_processes(files):
+    # type: (List[px_file.PxFile]) -> List[px_process.PxProcess]
+    pids = set(file.pid for file in files)
+    return [testutils.create_process(pid=pid) for pid in pids]
+
+
+def get_timings(file, pid, processes):
+    # type: (str, int, List[px_process.PxProcess]) -> Tuple[float, float, float]
     """
     Loads file and creates an IPC map for PID.
 
-    Returns timings in a tuple (load, mapping) in seconds.
+    Returns timings in a tuple (load, indexing, query) in seconds.
     """
     t0 = time.time()
     files = None
@@ -56,11 +72,54 @@ def get_timings(file, pid):
     dt_load = t1 - t0
 
     t0 = time.time()
-    testutils.create_ipc_map(pid, files)
+    ipc_graph = px_ipc_map.IpcGraph(files, processes)
+    t1 = time.time()
+    dt_indexing = t1 - t0
+
+    process = [p for p in processes if p.pid == pid][0]
+    t0 = time.time()
+    px_ipc_map.IpcMap(process, [], processes, False, ipc_graph=ipc_graph)
     t1 = time.time()
-    dt_mapping = t1 - t0
+    dt_query = t1 - t0
+
+    return (dt_load, dt_indexing, dt_query)
+
 
-    return (dt_load, dt_mapping)
+def print_peak_memory(file, pid, processes):
+    # type: (str, int, List[px_process.PxProcess]) -> None
+    """
+    Prints how much memory loading and both mapping phases need at most, on
+    top of what was already allocated before each phase.
+    """
+    if sys.version_info < (3, 9):
+        # tracemalloc.reset_peak() is new in Python 3.9
+        return
+
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+
+    with open(file, "r") as lsof_output:
+        files = px_file.lsof_to_files(lsof_output.read())
+    loaded, load_peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.reset_peak()
+    ipc_graph = px_ipc_map.IpcGraph(files, processes)
+    indexed, indexing_peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.reset_peak()
+    process = [p for p in processes if p.pid == pid][0]
+    px_ipc_map.IpcMap(process, [], processes, False, ipc_graph=ipc_graph)
+    queried, query_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("Loading peak memory is {:.1f}MB, {:.1f}MB retained".format(
+        load_peak / 1e6, loaded / 1e6))
+    print("Indexing peak memory is {:.1f}MB, {:.1f}MB retained".format(
+        (indexing_peak - loaded) / 1e6, (indexed - loaded) / 1e6))
+    print("   Query peak memory is {:.1f}MB, {:.1f}MB retained".format(
+        (query_peak - indexed) / 1e6, (queried - indexed) / 1e6))
 
 
 def print_statistics(name, values):
@@ -68,7 +127,7 @@ def print_statistics(name, values):
     highest = max(values)
     middle = (lowest + highest) / 2
     radius = (highest - lowest) / 2
-    print("{} is {:.2f}s±{:.2f}s".format(name, middle, radius))
+    print("{} is {:.1f}ms±{:.1f}ms".format(name, 1000 * middle, 1000 * radius))
 
 
 def main(lsof_file):
@@ -78,23 +137,29 @@ def main(lsof_file):
         files = px_file.lsof_to_files(lsof_output.read())
     pid = get_most_common_pid(files)
     print("Most popular PID: {}".format(pid))
+    processes = create_processes(files)
 
     end = time.time() + DURATION_S
     lap_number = 0
     load_times = []
-    mapping_times = []
+    indexing_times = []
+    query_times = []
     total_times = []
     while time.time() < end:
         lap_number += 1
         print("Lap {}, {:.0f}s left...".format(lap_number, end - time.time()))
-        load_time, mapping_time = get_timings(lsof_file, pid)
+        load_time, indexing_time, query_time = get_timings(lsof_file, pid, processes)
         load_times.append(load_time)
-        mapping_times.append(mapping_time)
-        total_times.append(load_time + mapping_time)
+        indexing_times.append(indexing_time)
+        query_times.append(query_time)
+        total_times.append(load_time + indexing_time + query_time)
+
+    print_statistics(" Loading time", load_times)
+    print_statistics("Indexing time", indexing_times)
+    print_statistics("   Query time", query_times)
+    print_statistics("   Total time", total_times)
 
-    print_statistics("Loading time", load_times)
-    print_statistics("Mapping time", mapping_times)
-    print_statistics("  Total time", total_times)
+    print_peak_memory(lsof_file, pid, processes)
 
 
 if __name__ == "__main__":
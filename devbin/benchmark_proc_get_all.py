@@ -4,7 +4,10 @@
 """Benchmark listing all processes
 
 Usage:
-  benchmark_proc_get_all.py
+  benchmark_proc_get_all.py [BACKEND]
+
+BACKEND is "proc" or "ps". If no BACKEND is given, all backends available on
+this system are benchmarked.
 """
 
 import os
@@ -19,15 +22,37 @@ from px import px_process
 
 LAPS=20
 
-def main():
+def benchmark(backend):
+    t0 = time.time()
+    for iteration in range(LAPS):
+        px_process.get_all(backend)
+    t1 = time.time()
+    dt_seconds = t1 - t0
+
+    print("Getting all processes using {} takes {:.0f}ms".format(
+        backend, 1000*dt_seconds/LAPS))
+
+    snapshotter = px_process.PxProcessSnapshotter(backend)
+    snapshotter.get_all()
     t0 = time.time()
     for iteration in range(LAPS):
-        px_process.get_all()
+        snapshotter.get_all()
     t1 = time.time()
     dt_seconds = t1 - t0
 
-    print("Getting all processes takes {:.0f}ms".format(1000*dt_seconds/LAPS))
+    print("Refreshing a snapshot using {} takes {:.0f}ms".format(
+        backend, 1000*dt_seconds/LAPS))
+
+
+def main(args):
+    if args:
+        benchmark(args[0])
+        return
+
+    if px_process.get_default_backend() == px_process.BACKEND_PROC:
+        benchmark(px_process.BACKEND_PROC)
+    benchmark(px_process.BACKEND_PS)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
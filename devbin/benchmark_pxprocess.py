@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark creating PxProcess objects
+
+Usage:
+  benchmark_pxprocess.py
+
+Creates a large number of PxProcess objects, and reports how long creating each
+one takes and how many bytes each one uses. Memory usage is only reported when
+running on Python 3.
+
+Both numbers are reported twice, once right after creating the processes, and
+once more after formatting all processes for display.
+"""
+
+import os
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+
+import sys
+sys.path.insert(0, os.path.join(MYDIR, ".."))
+
+import gc
+import time
+import datetime
+
+from px import px_process
+
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import List      # NOQA
+    from typing import Optional  # NOQA
+
+
+PROCESS_COUNT = 50000
+
+
+def create_builders():
+    # type: () -> List[px_process.PxProcessBuilder]
+    builders = []
+    for pid in range(1, PROCESS_COUNT + 1):
+        builder = px_process.PxProcessBuilder()
+        builder.pid = pid
+        builder.ppid = 1
+        builder.start_time_string = u"Mon Mar  7 09:33:11 2016"
+        builder.username = u"root"
+        builder.cpu_percent = 0.1 * (pid % 100)
+        builder.cpu_time = 1.5 * pid
+        builder.memory_percent = 0.01 * (pid % 1000)
+        builder.cmdline = u"/usr/libexec/daemon{} --flag={}".format(pid % 5000, pid)
+        builders.append(builder)
+    return builders
+
+
+def format_all(processes):
+    # type: (List[px_process.PxProcess]) -> None
+    for process in processes:
+        (process.command, process.lowercase_command, process.age_s,
+         process.cpu_time_s, process.cpu_percent_s, process.memory_percent_s)
+
+
+def measure_bytes_per_process(builders, now):
+    # type: (List[px_process.PxProcessBuilder], datetime.datetime) -> None
+    if sys.version_info < (3, 4):
+        return
+
+    import tracemalloc
+
+    px_process.get_command_cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    now_seconds = px_process._to_seconds(now)
+    processes = [builder.build(now, now_seconds) for builder in builders]
+    built = tracemalloc.get_traced_memory()[0]
+    format_all(processes)
+    formatted = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("Bytes per process after creation: {:.0f}".format(
+        (built - before) / float(PROCESS_COUNT)))
+    print("Bytes per process after formatting: {:.0f}".format(
+        (formatted - before) / float(PROCESS_COUNT)))
+
+
+def measure_time_per_process(builders, now):
+    # type: (List[px_process.PxProcessBuilder], datetime.datetime) -> None
+    px_process.get_command_cache.clear()
+    gc.collect()
+    t0 = time.time()
+    now_seconds = px_process._to_seconds(now)
+    processes = [builder.build(now, now_seconds) for builder in builders]
+    t1 = time.time()
+    format_all(processes)
+    t2 = time.time()
+
+    print("Creating a process takes {:.2f}us".format(
+        1000000 * (t1 - t0) / PROCESS_COUNT))
+    print("Creating and formatting a process takes {:.2f}us".format(
+        1000000 * (t2 - t0) / PROCESS_COUNT))
+
+
+def main():
+    builders = create_builders()
+    now = datetime.datetime.now().replace(tzinfo=px_process.TIMEZONE)
+
+    measure_time_per_process(builders, now)
+    measure_bytes_per_process(builders, now)
+
+
+if __name__ == "__main__":
+    main()
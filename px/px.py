@@ -7,6 +7,8 @@ Usage:
   px [--debug] [filter string]
   px [--debug] [--no-pager] [--color] <PID>
   px [--debug] --top [filter string]
+  px [--debug] --ipc-graph [--dot] [filter string]
+  px [--debug] --watch <PID>
   px --install
   px --help
   px --version
@@ -22,18 +24,39 @@ If the optional filter string parameter is specified, processes will be shown if
 If the optional PID parameter is specified, you'll get detailed information
 about that particular PID.
 
-In --top mode, a new process list is shown every second. The most CPU heavy
+In --top mode, a new process list is shown every second or so. The most CPU heavy
 processes are on top. In this mode, CPU times are counted from when you first
 invoked px, rather than from when each process started. This gives you a picture
-of which processes are most active right now.
+of which processes are most active right now. Press "m" to order by CPU usage
+since the last refresh instead, or by memory usage.
+
+With --ipc-graph, px prints which processes talk to which others through
+pipes, unix domain sockets and local network connections, as one JSON object
+per line. If a filter string is given, only connections from processes matching
+it are printed.
+
+With --watch, px shows a continuously refreshed view of the file
+descriptors, network connections and IPC peers of one process. New and
+changed fds are shown in green, closed ones in red.
 
 --top: Show a continuously refreshed process list
+--watch: Show a continuously refreshed view of one process' fds and IPC
+--ipc-graph: Print the inter process communication graph as JSON lines
+--dot: With --ipc-graph, print a Graphviz DOT graph rather than JSON
 --debug: Print debug logs (if any) after running
 --install: Install /usr/local/bin/px and /usr/local/bin/ptop
 --no-pager: Print PID info to stdout rather than to a pager
 --color: Force color output even when piping
 --help: Print this help
 --version: Print version information
+
+In --top mode, px polls less often when polling is expensive, to keep its own
+CPU usage below 2% of one core. Set PX_TOP_CPU_BUDGET to a different percentage
+to change that.
+
+Set PX_FILE_CACHE_TTL to a number of seconds to make "px PID" reuse its listing
+of all open files for that long. This speeds up looking at several PIDs in a
+row on systems where listing open files is slow.
 """
 
 import platform
@@ -168,6 +191,9 @@ def _main(argv):
     with_pager = None  # type: Optional[bool]
     with_color = None  # type: Optional[bool]
     top = False  # type: bool
+    ipc_graph = False  # type: bool
+    dot = False  # type: bool
+    watch = False  # type: bool
 
     while '--no-pager' in argv:
         with_pager = False
@@ -186,6 +212,18 @@ def _main(argv):
     while '--top' in argv:
         top = True
         argv.remove('--top')
+
+    while '--ipc-graph' in argv:
+        ipc_graph = True
+        argv.remove('--ipc-graph')
+
+    while '--dot' in argv:
+        dot = True
+        argv.remove('--dot')
+
+    while '--watch' in argv:
+        watch = True
+        argv.remove('--watch')
     if os.path.basename(argv[0]).endswith("top"):
         top = True
 
@@ -204,8 +242,20 @@ def _main(argv):
         px_top.top(search=search)
         return
 
+    if ipc_graph:
+        # Pulled in on demand for the same reason as px_top
+        from . import px_ipc_export
+        px_ipc_export.export(sys.stdout, search=search, dot=dot)
+        return
+
     try:
         pid = int(search)
+        if watch:
+            # Pulled in on demand for the same reason as px_top
+            from . import px_watch
+            px_watch.watch(pid)
+            return
+
         if not with_pager:
             px_processinfo.print_pid_info(sys.stdout.fileno(), pid)
             return
@@ -222,7 +272,14 @@ def _main(argv):
         # It's a search filter and not a PID, keep moving
         pass
 
-    procs = filter(lambda p: p.match(search), px_process.get_all())
+    if watch:
+        sys.stderr.write("ERROR: --watch needs a PID\n\n")
+        print(__doc__)
+        sys.exit(1)
+
+    # Filter while the process list is still being read, and before building
+    # any processes
+    procs = list(px_process.iter_all(search=search))
 
     columns = None  # type: Optional[int]
     try:
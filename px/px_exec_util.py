@@ -1,4 +1,5 @@
 import os
+import threading
 import subprocess
 
 import sys
@@ -7,6 +8,7 @@ if sys.version_info.major >= 3:
     from six import text_type  # NOQA
     from typing import List  # NOQA
     from typing import Dict  # NOQA
+    from typing import Set  # NOQA
 
 
 ENV = {}  # type: Dict[str, str]
@@ -30,3 +32,98 @@ def run(command, check_exitcode=False):
         raise subprocess.CalledProcessError(run.returncode, command)
 
     return stdout
+
+
+class KilledError(Exception):
+    """
+    A subprocess was killed by kill_all() before it was done.
+    """
+    pass
+
+
+# Subprocesses that kill_all() should kill, and the ones it has killed
+_lock = threading.Lock()
+_killable = set()  # type: Set[subprocess.Popen]
+_killed = set()    # type: Set[subprocess.Popen]
+
+# Set by kill_all(), cleared by reset_kill_all()
+_cancelled = False
+
+
+def register_killable(process):
+    # type: (subprocess.Popen) -> None
+    """
+    Make kill_all() kill process.
+
+    If kill_all() has been called since the last reset_kill_all(), process is
+    killed right away.
+
+    Call unregister_killable() after waiting for process to finish.
+    """
+    with _lock:
+        _killable.add(process)
+        if _cancelled:
+            _kill(process)
+
+
+def unregister_killable(process):
+    # type: (subprocess.Popen) -> bool
+    """
+    Returns True if process was killed by kill_all(), False otherwise.
+    """
+    with _lock:
+        _killable.discard(process)
+        if process in _killed:
+            _killed.remove(process)
+            return True
+        return False
+
+
+def was_killed(process):
+    # type: (subprocess.Popen) -> bool
+    with _lock:
+        return process in _killed
+
+
+def _kill(process):
+    # type: (subprocess.Popen) -> None
+    """
+    Must be called with _lock held.
+    """
+    if process in _killed:
+        return
+    try:
+        process.kill()
+    except OSError:
+        # Already gone
+        pass
+    _killed.add(process)
+
+
+def kill_all():
+    # type: () -> None
+    """
+    Kill all registered subprocesses, and any registered after this until
+    reset_kill_all() is called.
+
+    Use this when nobody is interested in their results any more, like when
+    the user has exited the pager showing them.
+    """
+    global _cancelled
+    with _lock:
+        _cancelled = True
+        for process in _killable:
+            _kill(process)
+
+
+def reset_kill_all():
+    # type: () -> None
+    """
+    Stop killing newly registered subprocesses after kill_all().
+
+    Call this before starting work whose subprocesses kill_all() should only
+    kill if it's called again.
+    """
+    global _cancelled
+    with _lock:
+        _cancelled = False
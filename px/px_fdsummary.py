@@ -0,0 +1,103 @@
+import os
+import sys
+import collections
+
+from . import px_file
+
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from . import px_ipc_map     # NOQA
+    from typing import List      # NOQA
+    from typing import Tuple     # NOQA
+    from typing import Counter   # NOQA
+    from typing import TypeVar   # NOQA
+    from typing import Optional  # NOQA
+    from six import text_type    # NOQA
+
+    T = TypeVar('T')
+
+SOCKET_TYPES = ['IPv4', 'IPv6', 'unix', 'sock']
+PIPE_TYPES = ['PIPE', 'FIFO']
+
+
+def _top(counter, count):
+    # type: (Counter[T], int) -> List[Tuple[T, int]]
+    """
+    The count most common entries, most common first. Ties are ordered by key
+    to make the output stable.
+    """
+    by_key = sorted(counter.items(), key=lambda entry: str(entry[0]))
+    return sorted(by_key, key=lambda entry: -entry[1])[:count]
+
+
+def _get_directory(file):
+    # type: (px_file.PxFile) -> Optional[text_type]
+    if not file.name or not file.name.startswith('/'):
+        return None
+
+    if file.type == 'DIR':
+        return file.name
+    if file.type == 'REG':
+        return os.path.dirname(file.name)
+    return None
+
+
+def _get_socket_key(file):
+    # type: (px_file.PxFile) -> text_type
+    """
+    Network sockets are grouped by where they go, or by where they listen if
+    they aren't connected. Other sockets are grouped by name.
+    """
+    if file.type == 'unix':
+        # Only bound sockets have paths, the rest are named after their
+        # kernel addresses which are unique per socket
+        if file.name and file.name.startswith('/'):
+            return "[unix] " + file.name.split(' ')[0]
+        return "[unix] <unbound>"
+
+    local, remote = file.get_endpoints()
+    if remote:
+        return "[" + file.type + "] ->" + px_file.resolve_endpoint(remote, 0)
+    if local:
+        return "[" + file.type + "] " + px_file.resolve_endpoint(local, 0) + " (LISTEN)"
+    return str(file)
+
+
+class PxFdSummary(object):
+    """
+    Summary of all fds a process has open.
+
+    Processes can have lots of fds, so rather than listing them all we count
+    them by type, and list the directories, sockets and pipe peers with the
+    most fds.
+
+    Everything is computed in one pass over the files in the IPC map.
+    """
+
+    def __init__(self, ipc_map, top_count=5):
+        # type: (px_ipc_map.IpcMap, int) -> None
+        type_counts = collections.Counter()       # type: Counter[text_type]
+        directory_counts = collections.Counter()  # type: Counter[text_type]
+        socket_counts = collections.Counter()     # type: Counter[text_type]
+        for file in ipc_map.own_files:
+            type_counts[file.type] += 1
+
+            if file.type in SOCKET_TYPES:
+                socket_counts[_get_socket_key(file)] += 1
+                continue
+
+            directory = _get_directory(file)
+            if directory is not None:
+                directory_counts[directory] += 1
+
+        pipe_counts = collections.Counter()  # type: Counter[text_type]
+        for peer in ipc_map.keys():
+            for file in ipc_map[peer]:
+                if file.type in PIPE_TYPES:
+                    pipe_counts[peer.name] += 1
+
+        self.fd_count = len(ipc_map.own_files)
+        self.type_counts = _top(type_counts, len(type_counts))
+        self.top_directories = _top(directory_counts, top_count)
+        self.top_sockets = _top(socket_counts, top_count)
+        self.pipe_peers = _top(pipe_counts, top_count)
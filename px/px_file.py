@@ -1,15 +1,67 @@
-import socket
+import os
+import stat
+import errno
+import operator
+import subprocess
 
+from . import px_cpuinfo
 from . import px_exec_util
+from . import px_resolver
+from . import px_socket_index
+
+from multiprocessing.pool import ThreadPool
 
 import sys
 if sys.version_info.major >= 3:
     # For mypy PEP-484 static typing validation
     from typing import Set       # NOQA
+    from typing import Dict      # NOQA
     from typing import List      # NOQA
     from typing import Tuple     # NOQA
     from typing import Iterable  # NOQA
     from typing import Optional  # NOQA
+    from typing import Iterator  # NOQA
+    from typing import Text      # NOQA
+    from typing import Callable  # NOQA
+
+BACKEND_PROC = "proc"
+BACKEND_LSOF = "lsof"
+
+# lsof file types for the st_mode file type bits
+_STAT_TYPES = [
+    (stat.S_ISREG, "REG"),
+    (stat.S_ISDIR, "DIR"),
+    (stat.S_ISCHR, "CHR"),
+    (stat.S_ISBLK, "BLK"),
+    (stat.S_ISFIFO, "FIFO"),
+    (stat.S_ISSOCK, "sock"),
+]
+
+# lsof fdtype names for the /proc/PID links that aren't file descriptors
+_SPECIAL_LINKS = [
+    ("cwd", "cwd"),
+    ("rtd", "root"),
+    ("txt", "exe"),
+]
+
+_CWD_LINKS = [("cwd", "cwd")]
+
+# File types that can have peers in a SocketIndex
+_SOCKET_TYPES = ["IPv4", "IPv6", "unix", "sock"]
+
+# Access modes from the flags field in /proc/PID/fdinfo/FD, lsof style
+_ACCESS_MODES = {
+    os.O_RDONLY: "r",
+    os.O_WRONLY: "w",
+    os.O_RDWR: "rw",
+}
+
+# How many distinct strings _shards_to_files() shares copies of at most
+_MAX_INTERNED_STRINGS = 4096
+
+# Linux limits each command line argument to 128kB (MAX_ARG_STRLEN), keep our
+# "lsof -p PID,PID,..." arguments well below that
+_MAX_LSOF_PIDS = 1000
 
 
 class PxFileBuilder():
@@ -45,6 +97,18 @@ class PxFileBuilder():
 
 
 class PxFile(object):
+    # There can be lots of files, slots save us a __dict__ per file
+    __slots__ = (
+        'fd',
+        'pid',
+        'type',
+        'name',
+        'inode',
+        'device',
+        'access',
+        'fdtype',
+    )
+
     def __init__(self, pid, filetype):
         # type: (int, str) -> None
         self.fd = None  # type: Optional[int]
@@ -64,7 +128,9 @@ class PxFile(object):
         return str(self.pid) + ":" + str(self)
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, PxFile):
+            return False
+        return _get_slots(self) == _get_slots(other)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -73,33 +139,44 @@ class PxFile(object):
         return hash((self.name, self.fd, self.fdtype, self.pid))
 
     def __str__(self):
-        if self.type == "REG":
-            return self.name
+        return self.describe()
+
+    def describe(self, resolve_timeout_seconds=px_resolver.DEFAULT_TIMEOUT_SECONDS):
+        # type: (float) -> str
+        """
+        Like str(), but with a configurable timeout for resolving the
+        addresses of network connections.
 
+        With a timeout of 0 we never wait, addresses whose names aren't known
+        yet are shown as they are.
+        """
         name = self.name
+        if self.type == "REG" and name is not None:
+            return name
+
         listen_suffix = ''
         if self.type in ['IPv4', 'IPv6']:
             local, remote_endpoint = self.get_endpoints()
             if not remote_endpoint:
                 listen_suffix = ' (LISTEN)'
 
-            name = self._resolve_name()
+            name = self._resolve_name(resolve_timeout_seconds)
 
         # Decorate non-regular files with their type
         if name:
             return "[" + self.type + "] " + name + listen_suffix
         return "[" + self.type + "] " + listen_suffix
 
-    def _resolve_name(self):
+    def _resolve_name(self, timeout_seconds):
         local, remote = self.get_endpoints()
         if not local:
             return self.name
 
-        local = resolve_endpoint(local)
+        local = resolve_endpoint(local, timeout_seconds)
         if not remote:
             return local
 
-        return local + "->" + resolve_endpoint(remote)
+        return local + "->" + resolve_endpoint(remote, timeout_seconds)
 
     def device_number(self):
         if self.device is None:
@@ -166,58 +243,197 @@ class PxFile(object):
         return (local, remote)
 
 
-def resolve_endpoint(endpoint):
-    # type: (str) -> str
+_get_slots = operator.attrgetter(*PxFile.__slots__)
+
+
+def _split_endpoint(endpoint):
+    # type: (str) -> Tuple[Optional[str], str]
     """
-    Resolves "127.0.0.1:portnumber" into "localhost:portnumber".
+    Splits "127.0.0.1:portnumber" into ("127.0.0.1", "portnumber").
+
+    The address is None if endpoint doesn't look like an address and a port.
     """
     # Find the rightmost :, necessary for IPv6 addresses
     splitindex = endpoint.rfind(':')
     if splitindex == -1:
-        return endpoint
+        return (None, endpoint)
 
     address = endpoint[0:splitindex]
     if address[0] == '[' and address[-1] == ']':
         # This is how lsof presents IPv6 addresses
         address = address[1:-1]
 
-    port = endpoint[splitindex + 1:]
-    host = None
+    return (address, endpoint[splitindex + 1:])
 
-    try:
-        host = socket.gethostbyaddr(address)[0]
-    except Exception:
-        # Lookup failed for whatever reason, give up
+
+def resolve_endpoint(endpoint, timeout_seconds=px_resolver.DEFAULT_TIMEOUT_SECONDS):
+    # type: (str, float) -> str
+    """
+    Resolves "127.0.0.1:portnumber" into "localhost:portnumber".
+
+    If the address can't be resolved within timeout_seconds, endpoint is
+    returned as is.
+    """
+    address, port = _split_endpoint(endpoint)
+    if not address:
         return endpoint
 
-    if host == "localhost.localdomain":
-        # "localdomain" is just a long word that doesn't add any information
-        host = "localhost"
+    host = px_resolver.get_resolver().resolve(address, timeout_seconds)
+    if host is None:
+        return endpoint
 
     return host + ":" + port
 
 
-def call_lsof():
+def prefetch_names(files, timeout_seconds=0.0):
+    # type: (Iterable[PxFile], float) -> None
     """
-    Call lsof and return the result as one big string
+    Start resolving the addresses of all network connections among files
+    concurrently, and wait at most timeout_seconds for all of them to finish.
+
+    After this, file.describe(resolve_timeout_seconds=0) will show the names
+    of all addresses that were resolved in time.
+    """
+    addresses = set()
+    for file in files:
+        for endpoint in file.get_endpoints():
+            if not endpoint:
+                continue
+            address = _split_endpoint(endpoint)[0]
+            if address:
+                addresses.add(address)
+
+    resolver = px_resolver.get_resolver()
+    if timeout_seconds > 0:
+        resolver.wait(addresses, timeout_seconds)
+    else:
+        resolver.prefetch(addresses)
+
+
+def _iter_lsof(selection=None):
+    # type: (Optional[List[str]]) -> Iterator[PxFile]
+    """
+    Run lsof and yield files while its output is still being read.
+
+    This way we never hold all of lsof's output in memory, and parsing
+    overlaps with lsof doing its thing.
+
+    selection is a list of extra lsof command line options, like ["-p", "1234"].
     """
     # See OUTPUT FOR OTHER PROGRAMS: http://linux.die.net/man/8/lsof
     # Output lines can be in one of two formats:
     # 1. "pPID@" (with @ meaning NUL)
     # 2. "fFD@aACCESSMODE@tTYPE@nNAME@"
-    return px_exec_util.run(["lsof", '-n', '-F', 'fnaptd0i'])
+    command = ["lsof", '-n', '-F', 'fnaptd0i'] + (selection or [])
+
+    with open(os.devnull, 'w') as DEVNULL:
+        lsof = subprocess.Popen(command,
+            stdin=DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=DEVNULL,
+            env=px_exec_util.ENV)
+
+        # lsof can run for a long time, make it possible for the pager to
+        # kill it if the user loses interest
+        px_exec_util.register_killable(lsof)
+
+        stdout = lsof.stdout
+        assert stdout
+        killed = False
+        try:
+            for file in lsof_stream_to_files(stdout.fileno()):
+                yield file
+        except Exception:
+            # Output from a killed lsof can end anywhere, don't complain about
+            # not being able to parse it
+            if not px_exec_util.was_killed(lsof):
+                raise
+        finally:
+            # If our consumer stopped early, closing the pipe makes lsof exit.
+            #
+            # Not checking the exit code, lsof exits with 1 when it wasn't
+            # allowed to look at everything, which is normal for non-root users.
+            stdout.close()
+            lsof.wait()
+            killed = px_exec_util.unregister_killable(lsof)
+
+        if killed:
+            raise px_exec_util.KilledError("Killed: " + " ".join(command))
+
+
+def _read_shards(fd):
+    # type: (int) -> Iterator[Text]
+    """
+    Yields UTF-8 decoded NUL separated shards from fd until EOF.
+
+    Like px_process._read_lines(), the input is read and decoded in big chunks.
+    Splitting before decoding is fine since NUL bytes can't be part of any
+    multi byte UTF-8 sequence.
+    """
+    partial_shard = b""
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+
+        complete_shards, _, partial_shard = (partial_shard + chunk).rpartition(b"\0")
+        if not complete_shards:
+            continue
+
+        for shard in complete_shards.decode('utf-8').split(u"\0"):
+            yield shard
+
+    if partial_shard:
+        yield partial_shard.decode('utf-8')
+
+
+def lsof_stream_to_files(fd):
+    # type: (int) -> Iterator[PxFile]
+    """
+    Parse lsof output read from fd, yielding files as we go.
+    """
+    return _shards_to_files(_read_shards(fd))
 
 
 def lsof_to_files(lsof):
-    # type: (str) -> List[PxFile]
+    # type: (Text) -> List[PxFile]
     """
     Convert lsof output into a files array.
     """
+    return list(_shards_to_files(lsof.split('\0')))
+
 
+def _shards_to_files(shards):
+    # type: (Iterable[Text]) -> Iterator[PxFile]
+    """
+    Convert NUL separated lsof output shards into files.
+    """
     pid = None
     file_builder = None  # type: Optional[PxFileBuilder]
-    files = []  # type: List[PxFile]
-    for shard in lsof.split('\0'):
+
+    # On Linux, lsof lists the same open file once per thread of a process.
+    # Skipping duplicates here means they get freed right away instead of
+    # piling up until somebody puts them in a set. Duplicates are always from
+    # the same process, so we only need to remember one process' files.
+    seen = set()  # type: Set[PxFile]
+    seen_pid = None  # type: Optional[int]
+
+    # Lots of files share the same types and devices. Having only one copy of
+    # each string saves memory on systems with lots of open files. Names and
+    # inodes are mostly unique, so those aren't worth remembering.
+    strings = {}  # type: Dict[Text, Text]
+
+    def intern(value):
+        # type: (Text) -> Text
+        interned = strings.get(value)
+        if interned is not None:
+            return interned
+        if len(strings) < _MAX_INTERNED_STRINGS:
+            # Devices can be unique as well, don't let those grow without bound
+            strings[value] = value
+        return value
+
+    for shard in shards:
         if shard[0] == "\n":
             # Some shards start with newlines. Looks pretty when viewing the
             # lsof output in moar, but makes the parsing code have to deal with
@@ -235,7 +451,13 @@ def lsof_to_files(lsof):
             pid = int(value)
         elif infotype == 'f':
             if file_builder:
-                files.append(file_builder.build())
+                file = file_builder.build()
+                if file.pid != seen_pid:
+                    seen.clear()
+                    seen_pid = file.pid
+                if file not in seen:
+                    seen.add(file)
+                    yield file
             else:
                 file_builder = PxFileBuilder()
 
@@ -247,7 +469,7 @@ def lsof_to_files(lsof):
                 file_builder.fd = int(value)
             else:
                 # Words like "cwd", "txt" and probably others as well
-                file_builder.fdtype = value
+                file_builder.fdtype = intern(value)
             assert pid is not None
             file_builder.pid = pid
             file_builder.type = "??"
@@ -261,10 +483,10 @@ def lsof_to_files(lsof):
             file_builder.access = access
         elif infotype == 't':
             assert file_builder is not None
-            file_builder.type = value
+            file_builder.type = intern(value)
         elif infotype == 'd':
             assert file_builder is not None
-            file_builder.device = value
+            file_builder.device = intern(value)
         elif infotype == 'n':
             assert file_builder is not None
             file_builder.name = value
@@ -277,17 +499,522 @@ def lsof_to_files(lsof):
 
     if file_builder:
         # Don't forget the last file
-        files.append(file_builder.build())
+        file = file_builder.build()
+        if file.pid != seen_pid or file not in seen:
+            yield file
+
+
+def _get_type_and_inode(path):
+    # type: (str) -> Tuple[str, Optional[str]]
+    """
+    Returns an lsof style file type and the inode for a path.
+    """
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        # Deleted, or we can't see it for some other reason. Calling it a
+        # regular file is what makes the most sense in most cases.
+        return ("REG", None)
+
+    inode = str(stat_result.st_ino)
+    for is_type, filetype in _STAT_TYPES:
+        if is_type(stat_result.st_mode):
+            return (filetype, inode)
+    return ("unknown", inode)
+
+
+def _get_access(fdinfo_path):
+    # type: (str) -> Optional[str]
+    """
+    Returns "r", "w" or "rw" based on the flags in /proc/PID/fdinfo/FD.
+    """
+    try:
+        with open(fdinfo_path, "r") as fdinfo:
+            for line in fdinfo:
+                if line.startswith("flags:"):
+                    # The flags are in octal
+                    flags = int(line[6:].strip(), 8)
+                    return _ACCESS_MODES.get(flags & os.O_ACCMODE)
+    except (IOError, OSError):
+        # The fd is gone or we can't look at it
+        pass
+    return None
+
+
+def _describe_socket(builder, info):
+    # type: (PxFileBuilder, Optional[px_socket_index.SocketInfo]) -> None
+    """
+    Set type and name of a socket file builder the way lsof would.
+    """
+    if info is None:
+        # Some protocol we don't index, or a socket that was created after we
+        # made the index
+        builder.type = "sock"
+        return
+
+    if info.protocol == "unix":
+        builder.type = "unix"
+        builder.name = "type=" + str(info.state)
+        if info.local:
+            builder.name = info.local + " " + builder.name
+        return
+
+    builder.type = "IPv6" if info.protocol.endswith("6") else "IPv4"
+    builder.name = info.local or "*:*"
+    if info.remote:
+        builder.name += "->" + info.remote
+
+
+def _link_to_builder(link, fd_path, fdinfo_path, socket_index):
+    # type: (str, str, str, px_socket_index.SocketIndex) -> PxFileBuilder
+    """
+    Turn the target of a /proc/PID/fd/FD symlink into a file builder.
+
+    The builder's pid and fd fields are left for the caller to fill in.
 
-    return files
+    Link targets look like "/some/path", "pipe:[10508]", "socket:[10498]" or
+    "anon_inode:[eventpoll]".
+    """
+    builder = PxFileBuilder()
+    builder.access = _get_access(fdinfo_path)
+    if link.startswith("/"):
+        # Stat through the fd link rather than the path, since the path might
+        # have been replaced by something else after it was opened
+        builder.type, builder.inode = _get_type_and_inode(fd_path)
+        builder.name = link
+        return builder
+
+    kind, _, rest = link.partition(":")
+    if kind == "pipe":
+        # Same as what lsof says, the inode is what identifies the pipe
+        builder.type = "FIFO"
+        builder.name = "pipe"
+        builder.inode = rest.strip("[]")
+    elif kind == "socket":
+        builder.inode = rest.strip("[]")
+        _describe_socket(builder, socket_index.get(builder.inode))
+    elif kind == "anon_inode":
+        builder.type = "a_inode"
+        builder.name = rest
+    else:
+        builder.type = "unknown"
+        builder.name = link
+    return builder
+
+
+def _get_files_from_proc_pid(proc,           # type: str
+                             pid,            # type: int
+                             socket_index,   # type: px_socket_index.SocketIndex
+                             special_links=_SPECIAL_LINKS,  # type: List[Tuple[str, str]]
+                             wanted_links=None  # type: Optional[Set[str]]
+                             ):
+    # type: (...) -> Iterator[PxFile]
+    """
+    Get the files of one process by reading /proc/PID/{cwd,root,exe,fd,fdinfo}.
 
+    special_links is a list of (fdtype, link name) tuples saying which of the
+    non-fd links to look at.
 
-def get_all():
-    # type: () -> Set[PxFile]
+    If wanted_links is set, only fds with symlink targets in there are
+    returned. Since all other fds are skipped after just a readlink(), this is
+    a lot cheaper than getting them all.
+    """
+    pid_path = os.path.join(proc, str(pid))
+
+    for fdtype, link_name in special_links:
+        link_path = os.path.join(pid_path, link_name)
+        try:
+            link = os.readlink(link_path)
+        except OSError:
+            # Not allowed, kernel thread or gone
+            continue
+        builder = PxFileBuilder()
+        builder.pid = pid
+        builder.fdtype = fdtype
+        builder.type, builder.inode = _get_type_and_inode(link_path)
+        builder.name = link
+        yield builder.build()
+
+    fd_dir = os.path.join(pid_path, "fd")
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError as e:
+        if e.errno not in (errno.EACCES, errno.ENOENT, errno.ESRCH):
+            raise
+        return
+
+    fdinfo_dir = os.path.join(pid_path, "fdinfo")
+    for fd_string in fds:
+        fd_path = os.path.join(fd_dir, fd_string)
+        try:
+            link = os.readlink(fd_path)
+        except OSError:
+            # The fd was closed after we listed it
+            continue
+
+        if wanted_links is not None and link not in wanted_links:
+            continue
+
+        builder = _link_to_builder(
+            link, fd_path, os.path.join(fdinfo_dir, fd_string), socket_index)
+        builder.pid = pid
+        builder.fd = int(fd_string)
+        yield builder.build()
+
+
+def get_default_worker_count():
+    # type: () -> int
+    """
+    One worker per logical core.
+    """
+    try:
+        return max(1, px_cpuinfo.get_core_count()[1])
+    except IOError:
+        return 1
+
+
+def _collect_in_parallel(collect, pids, workers=None):
+    # type: (Callable[[List[int]], List[PxFile]], List[int], Optional[int]) -> Iterator[PxFile]
+    """
+    Split pids between workers threads, call collect() once per thread with
+    that thread's share of the pids, and yield all files collected.
+
+    Each thread gets every workers:th PID, so that the big processes, which
+    tend to have PIDs close to each other, get spread out between threads.
+
+    Listing files is mostly waiting for system calls or for lsof, and Python
+    lets other threads run meanwhile, so threads are good enough for this.
+
+    If workers isn't set we go with get_default_worker_count().
+    """
+    if workers is None:
+        workers = get_default_worker_count()
+    assert workers > 0
+
+    shards = [pids[i::workers] for i in range(workers)]
+    shards = [shard for shard in shards if shard]
+    if len(shards) <= 1:
+        for shard in shards:
+            for file in collect(shard):
+                yield file
+        return
+
+    pool = ThreadPool(len(shards))
+    try:
+        for files in pool.imap_unordered(collect, shards):
+            for file in files:
+                yield file
+    finally:
+        pool.terminate()
+
+
+def _get_pids_from_proc(proc):
+    # type: (str) -> Iterator[int]
+    for pid_string in os.listdir(proc):
+        if pid_string.isdigit():
+            yield int(pid_string)
+
+
+def _get_all_pids():
+    # type: () -> Set[int]
+    """
+    Cheaper than px_process.get_all() when all we want is the PIDs.
+    """
+    if os.path.isdir("/proc/self"):
+        return set(_get_pids_from_proc("/proc"))
+
+    pids = set()  # type: Set[int]
+    for line in px_exec_util.run(["ps", "-e", "-o", "pid="]).splitlines():
+        line = line.strip()
+        if line:
+            pids.add(int(line))
+    return pids
+
+
+def _get_all_from_lsof(workers=None):
+    # type: (Optional[int]) -> Iterator[PxFile]
+    """
+    Get all files by running "lsof -p PID,PID,..." in each worker, for at most
+    _MAX_LSOF_PIDS PIDs at a time.
+
+    Processes started while we were busy are picked up by one extra round at
+    the end.
+    """
+    def collect(pids):
+        # type: (List[int]) -> List[PxFile]
+        files = []  # type: List[PxFile]
+        for i in range(0, len(pids), _MAX_LSOF_PIDS):
+            chunk = pids[i:i + _MAX_LSOF_PIDS]
+            files.extend(_iter_lsof(["-p", ",".join(str(pid) for pid in chunk)]))
+        return files
+
+    pids = _get_all_pids()
+    for file in _collect_in_parallel(collect, sorted(pids), workers):
+        yield file
+
+    new_pids = _get_all_pids() - pids
+    for file in _collect_in_parallel(collect, sorted(new_pids), workers):
+        yield file
+
+
+def _get_all_from_proc(proc="/proc", socket_index=None, workers=None):
+    # type: (str, Optional[px_socket_index.SocketIndex], Optional[int]) -> Iterator[PxFile]
+    """
+    Get all files we can see by reading /proc/PID/{cwd,root,exe,fd,fdinfo}.
+
+    This is what lsof does on Linux as well, but doing it ourselves saves us
+    from forking lsof and from parsing its output.
+
+    Processes we aren't allowed to look at are silently skipped, just like lsof
+    does when not running as root.
+
+    Sockets are looked up in socket_index. If no socket_index is given, one is
+    loaded from proc.
+
+    The processes are split between workers threads, see _collect_in_parallel().
+    """
+    if socket_index is None:
+        socket_index = px_socket_index.SocketIndex(proc)
+    socket_index_ = socket_index
+
+    def collect(pids):
+        # type: (List[int]) -> List[PxFile]
+        files = []  # type: List[PxFile]
+        for pid in pids:
+            files.extend(_get_files_from_proc_pid(proc, pid, socket_index_))
+        return files
+
+    return _collect_in_parallel(collect, list(_get_pids_from_proc(proc)), workers)
+
+
+def _get_peer_links(files, socket_index):
+    # type: (Iterable[PxFile], px_socket_index.SocketIndex) -> Set[str]
+    """
+    Returns the /proc/PID/fd symlink targets the other ends of files' pipes
+    and sockets would have.
+    """
+    links = set()  # type: Set[str]
+    for file in files:
+        if file.inode is None:
+            continue
+
+        if file.type == "FIFO":
+            if file.name == "pipe":
+                links.add("pipe:[" + file.inode + "]")
+            elif file.name:
+                # Named pipe
+                links.add(file.name)
+            continue
+
+        if file.type not in _SOCKET_TYPES:
+            # Other inodes are from other file systems than the socket ones, a
+            # match in socket_index would be a coincidence
+            continue
+
+        peer_inode = socket_index.get_peer_inode(file.inode)
+        if peer_inode is not None:
+            links.add("socket:[" + peer_inode + "]")
+    return links
+
+
+def _get_peers_from_proc(pid,                # type: int
+                         own_files,          # type: Iterable[PxFile]
+                         proc,               # type: str
+                         socket_index,       # type: px_socket_index.SocketIndex
+                         workers=None,       # type: Optional[int]
+                         special_links=_CWD_LINKS  # type: List[Tuple[str, str]]
+                         ):
+    # type: (...) -> Iterator[PxFile]
+    """
+    Go through all processes except pid, but only pick up their special_links
+    and the other ends of own_files' pipes and sockets. This is split between
+    workers threads.
+    """
+    wanted_links = _get_peer_links(own_files, socket_index)
+    if not wanted_links and not special_links:
+        return
+
+    def collect(pids):
+        # type: (List[int]) -> List[PxFile]
+        files = []  # type: List[PxFile]
+        for other_pid in pids:
+            files.extend(_get_files_from_proc_pid(
+                proc, other_pid, socket_index,
+                special_links=special_links, wanted_links=wanted_links))
+        return files
+
+    other_pids = [other_pid for other_pid in _get_pids_from_proc(proc) if other_pid != pid]
+    for file in _collect_in_parallel(collect, other_pids, workers):
+        yield file
+
+
+def _get_for_process_from_proc(pid,                # type: int
+                               proc="/proc",       # type: str
+                               socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+                               workers=None        # type: Optional[int]
+                               ):
+    # type: (...) -> Iterator[PxFile]
+    """
+    Two phases: first we get all files of pid. Then we go through all other
+    processes, but only pick up their working directories and the other ends
+    of pid's pipes and sockets. The second phase is split between workers
+    threads.
+    """
+    if socket_index is None:
+        socket_index = px_socket_index.SocketIndex(proc)
+
+    own_files = list(_get_files_from_proc_pid(proc, pid, socket_index))
+    for file in own_files:
+        yield file
+
+    for file in _get_peers_from_proc(pid, own_files, proc, socket_index, workers):
+        yield file
+
+
+def _get_peers_from_lsof(pid, own_files, include_cwds=True):
+    # type: (int, Iterable[PxFile], bool) -> Iterator[PxFile]
+    """
+    lsof can't select files by inode, so we select by file type instead:
+    working directories if include_cwds is set, plus network and / or unix
+    domain sockets if pid has any. Pipes can only be found by listing
+    everything.
+    """
+    own_types = set(file.type for file in own_files)
+    selection = []  # type: List[str]
+    if not own_types.intersection(["FIFO", "PIPE"]):
+        if include_cwds:
+            selection += ["-d", "cwd"]
+        if own_types.intersection(["IPv4", "IPv6"]):
+            selection.append("-i")
+        if "unix" in own_types:
+            selection.append("-U")
+        if not selection:
+            return
+
+    for file in _iter_lsof(selection):
+        if file.pid != pid:
+            yield file
+
+
+def _get_for_process_from_lsof(pid):
+    # type: (int) -> Iterator[PxFile]
+    """
+    Two phases, just like _get_for_process_from_proc().
+    """
+    own_files = list(_iter_lsof(["-p", str(pid)]))
+    for file in own_files:
+        yield file
+
+    for file in _get_peers_from_lsof(pid, own_files):
+        yield file
+
+
+def get_default_backend():
+    # type: () -> str
+    if os.path.isdir("/proc/self/fd"):
+        return BACKEND_PROC
+    return BACKEND_LSOF
+
+
+def get_all(backend=None, socket_index=None, workers=None):
+    # type: (Optional[str], Optional[px_socket_index.SocketIndex], Optional[int]) -> Set[PxFile]
     """
     Get all files.
 
-    If a file_types array is specified, only files of the listed types will be
-    returned.
+    The backend parameter can be BACKEND_PROC or BACKEND_LSOF. If it isn't set
+    we go for /proc if that is available (Linux), and fall back to lsof
+    otherwise (macOS).
+
+    The proc backend describes sockets using socket_index. Pass one in if you
+    want to use the same index for finding the other ends of the sockets
+    later.
+
+    Processes are split between workers threads. If workers isn't set, we use
+    one thread per logical core.
+    """
+    if backend is None:
+        backend = get_default_backend()
+
+    if backend == BACKEND_PROC:
+        return set(_get_all_from_proc(socket_index=socket_index, workers=workers))
+    if backend == BACKEND_LSOF:
+        return set(_get_all_from_lsof(workers))
+
+    raise ValueError("Unknown file listing backend: " + str(backend))
+
+
+def get_for_process(pid,                # type: int
+                    backend=None,       # type: Optional[str]
+                    socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+                    workers=None        # type: Optional[int]
+                    ):
+    # type: (...) -> Set[PxFile]
+    """
+    Get the files "px PID" needs: all of pid's own files, the working
+    directories of all processes, and the files through which other processes
+    are connected to pid.
+
+    Other files of other processes may or may not be included.
+
+    This is a lot faster than get_all() on systems with lots of open files.
+    Backend, socket_index and workers work like for get_all().
+    """
+    if backend is None:
+        backend = get_default_backend()
+
+    if backend == BACKEND_PROC:
+        return set(_get_for_process_from_proc(
+            pid, socket_index=socket_index, workers=workers))
+    if backend == BACKEND_LSOF:
+        return set(_get_for_process_from_lsof(pid))
+
+    raise ValueError("Unknown file listing backend: " + str(backend))
+
+
+def get_own_files(pid, backend=None, socket_index=None):
+    # type: (int, Optional[str], Optional[px_socket_index.SocketIndex]) -> Set[PxFile]
+    """
+    Get all files of pid, and nothing else.
+
+    Backend and socket_index work like for get_all().
+    """
+    if backend is None:
+        backend = get_default_backend()
+
+    if backend == BACKEND_PROC:
+        if socket_index is None:
+            socket_index = px_socket_index.SocketIndex()
+        return set(_get_files_from_proc_pid("/proc", pid, socket_index))
+    if backend == BACKEND_LSOF:
+        return set(_iter_lsof(["-p", str(pid)]))
+
+    raise ValueError("Unknown file listing backend: " + str(backend))
+
+
+def get_peer_files(pid,                # type: int
+                   own_files,          # type: Iterable[PxFile]
+                   backend=None,       # type: Optional[str]
+                   socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+                   workers=None        # type: Optional[int]
+                   ):
+    # type: (...) -> Set[PxFile]
+    """
+    Get the files through which other processes are connected to own_files,
+    which are files of pid.
+
+    Other files of other processes may or may not be included.
+
+    Backend, socket_index and workers work like for get_all().
     """
-    return set(lsof_to_files(call_lsof()))
+    if backend is None:
+        backend = get_default_backend()
+
+    if backend == BACKEND_PROC:
+        if socket_index is None:
+            socket_index = px_socket_index.SocketIndex()
+        return set(_get_peers_from_proc(
+            pid, own_files, "/proc", socket_index, workers, special_links=[]))
+    if backend == BACKEND_LSOF:
+        return set(_get_peers_from_lsof(pid, own_files, include_cwds=False))
+
+    raise ValueError("Unknown file listing backend: " + str(backend))
@@ -0,0 +1,210 @@
+"""
+On-disk cache of the system wide file table.
+
+Listing all open files on a big system can take a long time, and when
+investigating something you'll likely run "px PID" for a number of related
+PIDs in a row. With this cache enabled, only the first of those runs has to
+list all files, the others will use the same listing.
+
+The cache is opt-in. Enable it by setting the PX_FILE_CACHE_TTL environment
+variable to the number of seconds a listing should be reused.
+
+The cache file holds the parsed files, one tuple of PxFile slot values per
+file, marshalled and zlib compressed. Refreshes are serialized using a lock
+file, so that concurrent px invocations share one refresh rather than all
+listing files at the same time.
+"""
+
+import os
+import time
+import zlib
+import errno
+import fcntl
+import marshal
+import logging
+import operator
+
+from . import px_file
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from . import px_socket_index  # NOQA
+    from typing import Set         # NOQA
+    from typing import Tuple       # NOQA
+    from typing import Optional    # NOQA
+
+LOG = logging.getLogger(__name__)
+
+TTL_ENVIRONMENT_VARIABLE = "PX_FILE_CACHE_TTL"
+
+# Bump this whenever the on-disk format or the PxFile slots change
+_FORMAT_VERSION = 1
+
+# marshal formats differ between Python versions, don't share caches between them
+_FORMAT = "px-file-cache-{}-py{}.{}".format(
+    _FORMAT_VERSION, sys.version_info.major, sys.version_info.minor)
+
+_get_slots = operator.attrgetter(*px_file.PxFile.__slots__)
+
+
+def get_ttl_seconds():
+    # type: () -> Optional[float]
+    """
+    Returns the configured cache TTL, or None if caching is disabled.
+    """
+    ttl_string = os.environ.get(TTL_ENVIRONMENT_VARIABLE)
+    if not ttl_string:
+        return None
+
+    try:
+        ttl = float(ttl_string)
+    except ValueError:
+        LOG.warning("Ignoring non-numeric %s=%s", TTL_ENVIRONMENT_VARIABLE, ttl_string)
+        return None
+
+    if ttl <= 0:
+        return None
+    return ttl
+
+
+def get_default_path():
+    # type: () -> str
+    """
+    Per-user cache location.
+
+    What lsof can see depends on who is asking, so different users must not
+    share caches.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "px", "files-{}.cache".format(os.getuid()))
+
+
+def _serialize(backend, timestamp, files):
+    # type: (str, float, Set[px_file.PxFile]) -> bytes
+    rows = [_get_slots(file) for file in files]
+    return zlib.compress(marshal.dumps((_FORMAT, backend, timestamp, rows)), 1)
+
+
+def _deserialize(data):
+    # type: (bytes) -> Tuple[str, float, Set[px_file.PxFile]]
+    """
+    Raises ValueError if data isn't something we wrote.
+    """
+    try:
+        format, backend, timestamp, rows = marshal.loads(zlib.decompress(data))
+    except (zlib.error, EOFError, TypeError, ValueError):
+        raise ValueError("Not a px file cache")
+    if format != _FORMAT:
+        raise ValueError("Unsupported px file cache format: " + repr(format))
+
+    files = set()  # type: Set[px_file.PxFile]
+    for row in rows:
+        file = px_file.PxFile(0, "")
+        for slot, value in zip(px_file.PxFile.__slots__, row):
+            setattr(file, slot, value)
+        files.add(file)
+
+    return (backend, timestamp, files)
+
+
+def _read(path, backend, ttl_seconds):
+    # type: (str, str, float) -> Optional[Tuple[float, Set[px_file.PxFile]]]
+    """
+    Returns (timestamp, files) from the cache file, or None if there is no
+    fresh listing from the given backend in there.
+    """
+    try:
+        with open(path, "rb") as cache_file:
+            data = cache_file.read()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            LOG.debug("Failed to read file cache %s", path, exc_info=True)
+        return None
+
+    try:
+        cached_backend, timestamp, files = _deserialize(data)
+    except ValueError:
+        LOG.debug("Ignoring broken file cache %s", path, exc_info=True)
+        return None
+
+    if cached_backend != backend:
+        return None
+
+    age_seconds = time.time() - timestamp
+    if age_seconds < 0 or age_seconds > ttl_seconds:
+        # Negative ages means the clock has been turned back, don't trust those
+        return None
+
+    return (timestamp, files)
+
+
+def _write(path, backend, timestamp, files):
+    # type: (str, str, float, Set[px_file.PxFile]) -> None
+    # Write to a temporary file and rename it into place, so that readers not
+    # taking the lock never see half written caches
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as cache_file:
+            cache_file.write(_serialize(backend, timestamp, files))
+        os.rename(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_all(ttl_seconds,        # type: float
+            backend=None,       # type: Optional[str]
+            socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+            path=None           # type: Optional[str]
+            ):
+    # type: (...) -> Tuple[float, Set[px_file.PxFile]]
+    """
+    Like px_file.get_all(), but reuses listings up to ttl_seconds old.
+
+    Returns a (timestamp, files) tuple, where timestamp is the time.time() at
+    which the files were listed.
+
+    If some other px is refreshing the cache when we get here, we wait for it
+    to finish and use its listing.
+    """
+    if backend is None:
+        backend = px_file.get_default_backend()
+    if path is None:
+        path = get_default_path()
+
+    cached = _read(path, backend, ttl_seconds)
+    if cached is not None:
+        return cached
+
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        lock_fd = os.open(path + ".lock", os.O_WRONLY | os.O_CREAT, 0o600)
+    except (IOError, OSError):
+        LOG.debug("File cache unusable, listing files without it", exc_info=True)
+        return (time.time(), px_file.get_all(backend, socket_index=socket_index))
+
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+
+        # Somebody else may have refreshed the cache while we were waiting for the lock
+        cached = _read(path, backend, ttl_seconds)
+        if cached is not None:
+            return cached
+
+        timestamp = time.time()
+        files = px_file.get_all(backend, socket_index=socket_index)
+        try:
+            _write(path, backend, timestamp, files)
+        except (IOError, OSError):
+            LOG.debug("Failed to write file cache %s", path, exc_info=True)
+        return (timestamp, files)
+    finally:
+        # Closing the file releases the lock
+        os.close(lock_fd)
@@ -0,0 +1,167 @@
+"""
+Export the system wide IPC graph, for "px --ipc-graph".
+
+Processes are nodes, and there is one edge per pair of connected processes
+and channel type. Channels are pipes, unix domain sockets and network
+connections between local processes. Network connections to other machines
+are not part of the graph.
+
+Output is either JSON lines or Graphviz DOT. Both are written while the graph
+is being traversed, so nothing but the IpcGraph itself needs to fit in memory.
+"""
+
+import json
+import collections
+
+from . import px_file
+from . import px_process
+from . import px_ipc_map
+from . import px_file_cache
+from . import px_socket_index
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import IO        # NOQA
+    from typing import Set       # NOQA
+    from typing import Dict      # NOQA
+    from typing import List      # NOQA
+    from typing import Tuple     # NOQA
+    from typing import Iterable  # NOQA
+    from typing import Iterator  # NOQA
+    from typing import Optional  # NOQA
+    from six import text_type    # NOQA
+
+
+def iter_edges(ipc_graph, pids):
+    # type: (px_ipc_map.IpcGraph, List[int]) -> Iterator[Tuple[int, int, str, int]]
+    """
+    Yields (pid, peer_pid, channel_type, channel_count) tuples for all
+    connections from any of the pids.
+
+    Connections between two of the pids are only reported once, from the
+    lower PID's end.
+    """
+    selected = set(pids)
+    for pid in pids:
+        for peer, channels in ipc_graph.get_peers(pid).items():
+            peer_pid = peer.pid
+            if peer_pid is None:
+                # Unknown destinations
+                continue
+            if peer_pid < pid and peer_pid in selected:
+                # Already reported from the other end
+                continue
+
+            channel_counts = collections.Counter(channel.type for channel in channels)
+            for channel_type in sorted(channel_counts.keys()):
+                yield (pid, peer_pid, channel_type, channel_counts[channel_type])
+
+
+def _iter_nodes_and_edges(ipc_graph, pids):
+    # type: (px_ipc_map.IpcGraph, List[int]) -> Iterator[Tuple[List[int], Tuple[int, int, str, int]]]
+    """
+    Like iter_edges(), but also says which PIDs are seen for the first time
+    with each edge.
+    """
+    seen = set()  # type: Set[int]
+    for edge in iter_edges(ipc_graph, pids):
+        new_pids = [pid for pid in edge[0:2] if pid not in seen]
+        seen.update(new_pids)
+        yield (new_pids, edge)
+
+
+def _get_label(ipc_graph, pid_to_process, pid):
+    # type: (px_ipc_map.IpcGraph, Dict[int, px_process.PxProcess], int) -> text_type
+    process = pid_to_process.get(pid)
+    if process is not None:
+        return str(process)
+    return ipc_graph.get_peer_process(pid).name
+
+
+def to_json_lines(ipc_graph, processes, pids):
+    # type: (px_ipc_map.IpcGraph, Iterable[px_process.PxProcess], List[int]) -> Iterator[str]
+    """
+    One JSON object per line. Each process is described once, before the
+    first edge it is part of.
+    """
+    pid_to_process = dict((process.pid, process) for process in processes)
+    for new_pids, edge in _iter_nodes_and_edges(ipc_graph, pids):
+        for pid in new_pids:
+            node = {
+                "kind": "process",
+                "pid": pid,
+                "label": _get_label(ipc_graph, pid_to_process, pid),
+            }  # type: Dict[str, object]
+            process = pid_to_process.get(pid)
+            if process is not None:
+                node["command"] = process.command
+                node["user"] = process.username
+            yield json.dumps(node, sort_keys=True)
+
+        pid, peer_pid, channel_type, channel_count = edge
+        yield json.dumps({
+            "kind": "edge",
+            "pids": [pid, peer_pid],
+            "channel": channel_type,
+            "count": channel_count,
+        }, sort_keys=True)
+
+
+def _dot_quote(string):
+    # type: (text_type) -> text_type
+    return '"' + string.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def to_dot_lines(ipc_graph, processes, pids):
+    # type: (px_ipc_map.IpcGraph, Iterable[px_process.PxProcess], List[int]) -> Iterator[str]
+    """
+    An undirected Graphviz graph, render it with "dot -Tsvg" for example.
+    """
+    pid_to_process = dict((process.pid, process) for process in processes)
+
+    yield "graph px {"
+    for new_pids, edge in _iter_nodes_and_edges(ipc_graph, pids):
+        for pid in new_pids:
+            yield "  {} [label={}];".format(
+                pid, _dot_quote(_get_label(ipc_graph, pid_to_process, pid)))
+
+        pid, peer_pid, channel_type, channel_count = edge
+        label = channel_type
+        if channel_count > 1:
+            label += " x{}".format(channel_count)
+        yield "  {} -- {} [label={}];".format(pid, peer_pid, _dot_quote(label))
+    yield "}"
+
+
+def export(output, search=None, dot=False):
+    # type: (IO[str], Optional[text_type], bool) -> None
+    """
+    List all processes and files, and write the IPC graph of the processes
+    matching search to output.
+
+    Connections from matching processes to non-matching ones are included.
+    """
+    processes = px_process.get_all()
+
+    backend = px_file.get_default_backend()
+    socket_index = None
+    if backend == px_file.BACKEND_PROC:
+        socket_index = px_socket_index.SocketIndex()
+
+    cache_ttl_seconds = px_file_cache.get_ttl_seconds()
+    if cache_ttl_seconds is None:
+        files = px_file.get_all(backend, socket_index)
+    else:
+        files = px_file_cache.get_all(cache_ttl_seconds, backend, socket_index)[1]
+
+    ipc_graph = px_ipc_map.IpcGraph(files, processes, socket_index)
+
+    if search:
+        pids = sorted(process.pid for process in processes if process.match(search))
+    else:
+        pids = sorted(ipc_graph.get_pids())
+
+    to_lines = to_dot_lines if dot else to_json_lines
+    for line in to_lines(ipc_graph, processes, pids):
+        output.write(line + "\n")
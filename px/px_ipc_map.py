@@ -1,17 +1,22 @@
 import sys
+import collections
 
+from . import px_file
+from . import px_resolver
 
 if sys.version_info.major >= 3:
     # For mypy PEP-484 static typing validation
-    from . import px_file              # NOQA
     from . import px_process           # NOQA
+    from . import px_socket_index      # NOQA
     from typing import Set             # NOQA
     from typing import List            # NOQA
     from typing import Dict            # NOQA
+    from typing import Tuple           # NOQA
     from typing import Text            # NOQA
     from typing import AbstractSet     # NOQA
     from typing import MutableMapping  # NOQA
     from typing import Iterable        # NOQA
+    from typing import Union           # NOQA
     from typing import TypeVar         # NOQA
     from typing import Optional        # NOQA
 
@@ -19,6 +24,7 @@ if sys.version_info.major >= 3:
     S = TypeVar('S')
 
 FILE_TYPES = ['PIPE', 'FIFO', 'unix', 'IPv4', 'IPv6']
+SOCKET_TYPES = ['unix', 'IPv4', 'IPv6']
 
 
 class IpcMap(object):
@@ -28,54 +34,58 @@ class IpcMap(object):
     have open to that process.
 
     After creating an IpcMap, you can access:
+    * ipc_map.own_files: All files with fds opened by this process
     * ipc_map.network_connections: This is a list of non-IPC network connections
     * ipc_map.keys(): A set of other px_processes this process is connected to
     * ipc_map[px_process]: A set of px_files through which we're connected to the
       px_process
+
+    If a socket_index is given, sockets found in there are connected to their
+    peers through their inodes. Other sockets are matched on their lsof names.
+
+    To map more than one process from the same files, build an IpcGraph once
+    and pass it in as ipc_graph. files and socket_index are then ignored.
     """
 
     def __init__(self,
                  process,    # type: px_process.PxProcess
                  files,      # type: Iterable[px_file.PxFile]
                  processes,  # type: Iterable[px_process.PxProcess]
-                 is_root     # type: bool
+                 is_root,    # type: bool
+                 socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+                 ipc_graph=None      # type: Optional[IpcGraph]
                  ):
         # type: (...) -> None
+        if ipc_graph is None:
+            ipc_graph = IpcGraph(files, processes, socket_index)
+        self._ipc_graph = ipc_graph
 
-        # On Linux, lsof reports the same open file once per thread of a
-        # process. Putting the files in a set gives us each file only once.
-        files = set(files)
-
-        self._own_files = list(filter(lambda f: f.pid == process.pid and f.fd is not None, files))
-
-        # Only deal with IPC related files
-        self.files = list(filter(lambda f: f.type in FILE_TYPES, files))
+        self.own_files = [f for f in ipc_graph.get_files(process.pid) if f.fd is not None]
 
         self.process = process
         self.processes = processes
-        self.ipc_files_for_process = list(filter(lambda f: f.pid == self.process.pid, self.files))
 
-        self._map = {}  # type: MutableMapping[PeerProcess, Set[px_file.PxFile]]
-        self._create_mapping()
+        self._map = ipc_graph.get_peers(process.pid)
+        self.network_connections = \
+            ipc_graph.get_network_connections(process.pid)  # type: Set[px_file.PxFile]
 
         self.fds = self._create_fds(is_root)
 
     def _create_fds(self, is_root):
         # type: (bool) -> Dict[int, str]
         """
-        Describe standard FDs open by this process; the mapping is from FD number to
+        Describe all FDs open by this process; the mapping is from FD number to
         FD description.
 
         The returned dict will always contain entries for 0, 1 and 2.
 
-        In theory this method could easily be modified to go through all fds, not
-        just the standard ones, but that can get us lots more DNS lookups, and
-        take a lot of time. If you do want to try it, just drop all the "if fd
-        not in [0, 1, 2]: continue"s and benchmark it on not-cached IP addresses.
+        Network addresses are resolved concurrently, and we wait at most
+        px_resolver.DEFAULT_TIMEOUT_SECONDS for all of them together. Addresses
+        that aren't resolved by then are described as they are.
         """
         fds = dict()
 
-        if not self._own_files:
+        if not self.own_files:
             for fd in [0, 1, 2]:
                 fds[fd] = "<unavailable, running px as root might help>"
             return fds
@@ -83,11 +93,11 @@ class IpcMap(object):
         for fd in [0, 1, 2]:
             fds[fd] = "<closed>"
 
-        for file in self._own_files:
-            if file.fd not in [0, 1, 2]:
-                continue
+        px_file.prefetch_names(self.own_files, px_resolver.DEFAULT_TIMEOUT_SECONDS)
 
-            fds[file.fd] = str(file)
+        for file in self.own_files:
+            assert file.fd is not None
+            fds[file.fd] = file.describe(resolve_timeout_seconds=0)
 
             if file.type in FILE_TYPES:
                 excuse = "destination not found, try running px as root"
@@ -108,9 +118,7 @@ class IpcMap(object):
         for network_connection in self.network_connections:
             if network_connection.fd is None:
                 continue
-            if network_connection.fd not in [0, 1, 2]:
-                continue
-            fds[network_connection.fd] = str(network_connection)
+            fds[network_connection.fd] = network_connection.describe(resolve_timeout_seconds=0)
 
         # Traverse our IPC structure and update FDs as required
         for target in self.keys():
@@ -118,8 +126,6 @@ class IpcMap(object):
                 if link.fd is None:
                     # No FD, never mind
                     continue
-                if link.fd not in [0, 1, 2]:
-                    continue
 
                 # FIXME: If this is a PIPE/FIFO leading to ourselves we should say that
                 # FIXME: If this is an unconnected PIPE/FIFO, we should say that
@@ -135,161 +141,388 @@ class IpcMap(object):
 
         return fds
 
-    def _create_mapping(self):
-        # type: () -> None
-        self._create_indices()
+    def _get_other_end_pids(self, file):
+        # type: (px_file.PxFile) -> Iterable[int]
+        return self._ipc_graph.get_other_end_pids(file)
 
-        unknown = PeerProcess(
+    def keys(self):
+        # type: () -> Iterable[PeerProcess]
+        """
+        Returns a set of other px_processes this process is connected to
+        """
+        return self._map.keys()
+
+    def __getitem__(self, process):
+        # type: (PeerProcess) -> Set[px_file.PxFile]
+        """
+        Returns a set of px_files through which we're connected to the px_process
+        """
+        return self._map.__getitem__(process)
+
+
+class IpcGraph(object):
+    """
+    Who talks to whom, for all processes in one file snapshot.
+
+    Indexing the files is done once when the graph is created. After that,
+    finding the peers of any process costs time proportional to the number of
+    IPC files that process has open. Results are remembered, so asking about
+    the same process again is free.
+
+    Processes are connected through channels, which are the pipes and sockets
+    they have open to each other. Channels leading to processes we can't find
+    are connected to a single UNKNOWN destinations peer, and network
+    connections to other machines are kept separately.
+    """
+
+    def __init__(self,
+                 files,      # type: Iterable[px_file.PxFile]
+                 processes,  # type: Iterable[px_process.PxProcess]
+                 socket_index=None  # type: Optional[px_socket_index.SocketIndex]
+                 ):
+        # type: (...) -> None
+        self._socket_index = socket_index
+
+        # On Linux, lsof reports the same open file once per thread of a
+        # process. Putting the files in a set gives us each file only once.
+        self._files_by_pid = {}  # type: MutableMapping[int, List[px_file.PxFile]]
+
+        # Only deal with IPC related files. Their keys for the indices are
+        # computed once here, and then used both for indexing and for lookups.
+        self._ipc_files_by_pid = \
+            {}  # type: MutableMapping[int, List[Tuple[px_file.PxFile, IpcKeys]]]
+        if not isinstance(files, (set, frozenset)):
+            files = set(files)
+        files_by_pid = self._files_by_pid
+        for file in files:
+            # This loop is run for every file on the system, so no function
+            # calls here unless we have to
+            pid_files = files_by_pid.get(file.pid)
+            if pid_files is None:
+                pid_files = []
+                files_by_pid[file.pid] = pid_files
+            pid_files.append(file)
+
+            if file.type in FILE_TYPES:
+                add_arraymapping(self._ipc_files_by_pid, file.pid, (file, get_ipc_keys(file)))
+
+        self._unknown = PeerProcess(
             name="UNKNOWN destinations: Running with sudo might help find out where these go")
 
-        network_connections = set()
-        for file in self.ipc_files_for_process:
-            if file.type in ['FIFO', 'PIPE'] and not file.fifo_id():
+        # PID to (peers, network connections), filled in on demand by _get_channels()
+        self._channels = \
+            {}  # type: Dict[int, Tuple[Dict[PeerProcess, Set[px_file.PxFile]], Set[px_file.PxFile]]]
+
+        self._create_indices(processes)
+
+    def get_files(self, pid):
+        # type: (int) -> List[px_file.PxFile]
+        """
+        All files opened by pid, IPC related or not.
+        """
+        return self._files_by_pid.get(pid, [])
+
+    def get_pids(self):
+        # type: () -> Iterable[int]
+        """
+        All PIDs with IPC related files open.
+        """
+        return self._ipc_files_by_pid.keys()
+
+    def get_peer_process(self, pid):
+        # type: (int) -> PeerProcess
+        peer = self._pid2process.get(pid)
+        if not peer:
+            peer = PeerProcess(pid=pid)
+            self._pid2process[pid] = peer
+        return peer
+
+    def get_peers(self, pid):
+        # type: (int) -> Dict[PeerProcess, Set[px_file.PxFile]]
+        """
+        Maps processes pid is connected to, to pid's channels to them.
+
+        Don't modify the returned dict, it's shared by everybody asking about
+        the same pid.
+        """
+        return self._get_channels(pid)[0]
+
+    def get_network_connections(self, pid):
+        # type: (int) -> Set[px_file.PxFile]
+        """
+        Network connections from pid going to other machines, or to processes
+        we can't find.
+        """
+        return self._get_channels(pid)[1]
+
+    def _get_channels(self, pid):
+        # type: (int) -> Tuple[Dict[PeerProcess, Set[px_file.PxFile]], Set[px_file.PxFile]]
+        channels = self._channels.get(pid)
+        if channels is not None:
+            return channels
+
+        peers = {}  # type: Dict[PeerProcess, Set[px_file.PxFile]]
+        network_connections = set()  # type: Set[px_file.PxFile]
+        for file, keys in self._ipc_files_by_pid.get(pid, []):
+            if file.type in ['FIFO', 'PIPE'] and keys.fifo_id is None:
                 # Unidentifiable FIFO, just ignore this
                 continue
 
-            other_end_pids = self._get_other_end_pids(file)
+            other_end_pids = self._get_other_end_pids(file, keys)
             if not other_end_pids:
                 if file.type in ['IPv4', 'IPv6']:
                     # This is a remote connection
                     network_connections.add(file)
                     continue
 
-                self.add_ipc_entry(unknown, file)
+                peers.setdefault(self._unknown, set()).add(file)
                 continue
 
             for other_end_pid in other_end_pids:
-                if other_end_pid == self.process.pid:
+                if other_end_pid == pid:
                     # Talking to ourselves, never mind
                     continue
 
-                other_end_process = self._pid2process.get(other_end_pid)
-                if not other_end_process:
-                    other_end_process = PeerProcess(pid=other_end_pid)
-                    self._pid2process[other_end_pid] = other_end_process
-                self.add_ipc_entry(other_end_process, file)
+                peers.setdefault(self.get_peer_process(other_end_pid), set()).add(file)
 
-        self.network_connections = network_connections  # type: Set[px_file.PxFile]
+        channels = (peers, network_connections)
+        self._channels[pid] = channels
+        return channels
 
-    def _create_indices(self):
-        # type: () -> None
+    def _create_indices(self, processes):
+        # type: (Iterable[px_process.PxProcess]) -> None
+        """
+        Creates indices used by get_other_end_pids()
+        """
+        self._pid2process = create_pid2process(processes)
+
+        self._device_number_to_pids = {}       # type: MutableMapping[int, List[int]]
+        self._peer_device_number_to_pids = {}  # type: MutableMapping[int, List[int]]
+        self._device_number_and_name_to_pids = \
+            {}  # type: MutableMapping[Tuple[int, Optional[Text]], List[int]]
+        self._fifo_id_and_access_to_pids = \
+            {}  # type: MutableMapping[Tuple[Union[int, Text], str], List[int]]
+        self._local_endpoint_to_pid = {}       # type: MutableMapping[str, int]
+        self._socket_inode_to_pids = {}        # type: MutableMapping[int, List[int]]
+        for pid, files_and_keys in self._ipc_files_by_pid.items():
+            for file, keys in files_and_keys:
+                self._index(pid, file, keys)
+
+    def _index(self, pid, file, keys):
+        # type: (int, px_file.PxFile, IpcKeys) -> None
+        if keys.inode is not None and file.type in SOCKET_TYPES:
+            add_arraymapping(self._socket_inode_to_pids, keys.inode, pid)
+
+        if keys.device_number is not None:
+            add_arraymapping(self._device_number_to_pids, keys.device_number, pid)
+            add_arraymapping(self._device_number_and_name_to_pids,
+                             (keys.device_number, file.name), pid)
+
+        if keys.peer_device_number is not None:
+            add_arraymapping(self._peer_device_number_to_pids, keys.peer_device_number, pid)
+
+        if keys.local_endpoint:
+            self._local_endpoint_to_pid[keys.local_endpoint] = pid
+
+        if file.access is not None and file.type == 'FIFO' and keys.fifo_id is not None:
+            add_arraymapping(self._fifo_id_and_access_to_pids, (keys.fifo_id, file.access), pid)
+
+    def _unindex(self, pid, file, keys):
+        # type: (int, px_file.PxFile, IpcKeys) -> None
         """
-        Creates indices used by _get_other_end_pids()
+        Undoes what _index() did for this file.
         """
-        self._pid2process = create_pid2process(self.processes)
-
-        self._device_to_pids = {}  # type: MutableMapping[str, List[int]]
-        self._name_to_pids = {}    # type: MutableMapping[str, List[int]]
-        self._name_to_files = {}   # type: MutableMapping[str, List[px_file.PxFile]]
-        self._device_number_to_files = {}  # type: MutableMapping[int, List[px_file.PxFile]]
-        self._fifo_id_and_access_to_pids = {}  # type: MutableMapping[str, List[int]]
-        self._local_endpoint_to_pid = {}   # type: MutableMapping[str, int]
-        for file in self.files:
-            if file.device is not None:
-                add_arraymapping(self._device_to_pids, file.device, file.pid)
-
-            if file.name:
-                add_arraymapping(self._name_to_pids, file.name, file.pid)
-                add_arraymapping(self._name_to_files, file.name, file)
-
-            local_endpoint, remote = file.get_endpoints()
-            if local_endpoint:
-                self._local_endpoint_to_pid[local_endpoint] = file.pid
-
-            device_number = file.device_number()
-            if device_number is not None:
-                add_arraymapping(self._device_number_to_files, device_number, file)
-
-            if file.access is not None and file.type == 'FIFO':
-                fifo_id = file.fifo_id()
-                if fifo_id:
-                    add_arraymapping(self._fifo_id_and_access_to_pids,
-                                     fifo_id + file.access, file.pid)
+        if keys.inode is not None and file.type in SOCKET_TYPES:
+            remove_arraymapping(self._socket_inode_to_pids, keys.inode, pid)
+
+        if keys.device_number is not None:
+            remove_arraymapping(self._device_number_to_pids, keys.device_number, pid)
+            remove_arraymapping(self._device_number_and_name_to_pids,
+                                (keys.device_number, file.name), pid)
+
+        if keys.peer_device_number is not None:
+            remove_arraymapping(self._peer_device_number_to_pids, keys.peer_device_number, pid)
+
+        if keys.local_endpoint and self._local_endpoint_to_pid.get(keys.local_endpoint) == pid:
+            del self._local_endpoint_to_pid[keys.local_endpoint]
+
+        if file.access is not None and file.type == 'FIFO' and keys.fifo_id is not None:
+            remove_arraymapping(self._fifo_id_and_access_to_pids,
+                                (keys.fifo_id, file.access), pid)
+
+    def update(self,
+               added,              # type: Iterable[px_file.PxFile]
+               removed,            # type: Iterable[px_file.PxFile]
+               socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+               processes=None      # type: Optional[Iterable[px_process.PxProcess]]
+               ):
+        # type: (...) -> None
+        """
+        Applies the difference between two file snapshots to this graph,
+        without re-indexing the files that are still there.
 
-    def _get_other_end_pids(self, file):
+        Removed files must have been part of the graph, and added files must
+        not already be.
+
+        Pass a new socket_index and / or processes listing if you have them,
+        they replace the ones this graph currently uses.
+        """
+        for file in removed:
+            pid_files = self._files_by_pid.get(file.pid)
+            if pid_files is None or file not in pid_files:
+                continue
+            pid_files.remove(file)
+            if not pid_files:
+                del self._files_by_pid[file.pid]
+
+            if file.type not in FILE_TYPES:
+                continue
+            ipc_files = self._ipc_files_by_pid[file.pid]
+            for index, file_and_keys in enumerate(ipc_files):
+                if file_and_keys[0] == file:
+                    del ipc_files[index]
+                    self._unindex(file.pid, file, file_and_keys[1])
+                    break
+            if not ipc_files:
+                del self._ipc_files_by_pid[file.pid]
+
+        for file in added:
+            add_arraymapping(self._files_by_pid, file.pid, file)
+            if file.type in FILE_TYPES:
+                keys = get_ipc_keys(file)
+                add_arraymapping(self._ipc_files_by_pid, file.pid, (file, keys))
+                self._index(file.pid, file, keys)
+
+        if socket_index is not None:
+            self._socket_index = socket_index
+
+        if processes is not None:
+            self._pid2process = create_pid2process(processes)
+
+        # Any process may have gained or lost peers. Figuring out which ones
+        # would cost about as much as starting over for the few we get asked
+        # about.
+        self._channels = {}
+
+    def get_other_end_pids(self, file):
         # type: (px_file.PxFile) -> Iterable[int]
         """Locate the other end of a pipe / domain socket"""
+        return self._get_other_end_pids(file, get_ipc_keys(file))
+
+    def _get_other_end_pids(self, file, keys):
+        # type: (px_file.PxFile, IpcKeys) -> Iterable[int]
+        if self._socket_index is not None and file.type in SOCKET_TYPES \
+                and self._socket_index.get(file.inode) is not None:
+            assert file.inode is not None
+            peer_inode = self._socket_index.get_peer_inode(file.inode)
+            if peer_inode is None:
+                return []
+            return self._socket_inode_to_pids.get(int(peer_inode), [])
+
         if file.type in ['IPv4', 'IPv6']:
-            local, remote = file.get_endpoints()
-            if remote is None:
+            if keys.remote_endpoint is None:
                 return []
 
-            pid = self._local_endpoint_to_pid.get(remote)
+            pid = self._local_endpoint_to_pid.get(keys.remote_endpoint)
             if pid:
                 return [pid]
             else:
                 return []
 
-        name = file.name
-        if name and name.startswith("->"):
-            # With lsof 4.87 on OS X 10.11.3, pipe and socket names start with "->",
-            # but their endpoint names don't. Strip initial "->" from name before
-            # scanning for it.
-            name = name[2:]
-
-        file_device_with_arrow = None
-        if file.device is not None:
-            file_device_with_arrow = "->" + file.device
-
         pids = set()  # type: Set[int]
 
         # The other end of the socket / pipe is encoded in the DEVICE field of
         # lsof's output ("view source" in your browser to see the conversation):
         # http://www.justskins.com/forums/lsof-find-both-endpoints-of-a-unix-socket-123037.html
-        if name:
-            matching_pids = self._device_to_pids.get(name)
+        if keys.peer_device_number is not None:
+            matching_pids = self._device_number_to_pids.get(keys.peer_device_number)
             if matching_pids:
                 pids.update(matching_pids)
 
-        if file_device_with_arrow:
-            matching_pids = self._name_to_pids.get(file_device_with_arrow)
+        if keys.device_number is not None:
+            matching_pids = self._peer_device_number_to_pids.get(keys.device_number)
             if matching_pids:
                 pids.update(matching_pids)
 
-        device_number = file.device_number()
-        if device_number:
-            matching_files = self._device_number_to_files.get(device_number)
-            if not matching_files:
-                matching_files = []
-            for candidate in matching_files:
-                if candidate.name == file.name:
-                    pids.add(candidate.pid)
-
-        fifo_id = file.fifo_id()
-        if fifo_id and file.access and file.type == 'FIFO':
+            matching_pids = self._device_number_and_name_to_pids.get(
+                (keys.device_number, file.name))
+            if matching_pids:
+                pids.update(matching_pids)
+
+        if keys.fifo_id is not None and file.access and file.type == 'FIFO':
             # On Linux, this is how we trace FIFOs
             opposing_access = {'r': 'w', 'w': 'r'}.get(file.access)
             if opposing_access:
-                name_and_opposing_access = fifo_id + opposing_access
-                matching_pids = self._fifo_id_and_access_to_pids.get(name_and_opposing_access)
+                matching_pids = self._fifo_id_and_access_to_pids.get(
+                    (keys.fifo_id, opposing_access))
                 if matching_pids:
                     pids.update(matching_pids)
 
         return pids
 
-    def add_ipc_entry(self, process, file):
-        # type: (PeerProcess, px_file.PxFile) -> None
-        """
-        Note that we're connected to process via file
-        """
-        if process not in self._map:
-            self._map[process] = set()
 
-        self._map[process].add(file)
+# The keys a file is indexed on in IpcGraph, parsed out of its lsof strings.
+#
+# device_number and peer_device_number are the file's DEVICE field and the
+# device number its name points to, if any. fifo_id is an inode number if we
+# have one, and a name otherwise. inode is the file's inode as a number.
+IpcKeys = collections.namedtuple("IpcKeys", [
+    "device_number",
+    "peer_device_number",
+    "fifo_id",
+    "inode",
+    "local_endpoint",
+    "remote_endpoint",
+])
 
-    def keys(self):
-        # type: () -> Iterable[PeerProcess]
-        """
-        Returns a set of other px_processes this process is connected to
-        """
-        return self._map.keys()
 
-    def __getitem__(self, process):
-        # type: (PeerProcess) -> Set[px_file.PxFile]
-        """
-        Returns a set of px_files through which we're connected to the px_process
-        """
-        return self._map.__getitem__(process)
+def _parse_hex(string):
+    # type: (Optional[Text]) -> Optional[int]
+    """
+    Parses "0x1234" into 0x1234. Returns None for strings not starting with
+    "0x", and for zero which is what lsof says when it doesn't know.
+    """
+    if not string or not string.startswith("0x"):
+        # Most names are paths or words like "pipe", and raising exceptions
+        # for all of those would be slow
+        return None
+    try:
+        return int(string, 16) or None
+    except ValueError:
+        return None
+
+
+def _parse_inode(inode):
+    # type: (Optional[Text]) -> Optional[int]
+    if inode is None or not inode.isdigit():
+        return None
+    return int(inode)
+
+
+def get_ipc_keys(file):
+    # type: (px_file.PxFile) -> IpcKeys
+    name = file.name
+    if name and name.startswith("->"):
+        # With lsof 4.87 on OS X 10.11.3, pipe and socket names start with "->",
+        # but their endpoint names don't. Strip initial "->" from name before
+        # scanning for it.
+        name = name[2:]
+
+    inode = _parse_inode(file.inode)
+
+    fifo_id = file.fifo_id()  # type: Optional[Union[int, Text]]
+    if inode is not None and fifo_id == file.inode:
+        fifo_id = inode
+
+    local_endpoint, remote_endpoint = file.get_endpoints()
+
+    return IpcKeys(
+        _parse_hex(file.device),
+        _parse_hex(name),
+        fifo_id,
+        inode,
+        local_endpoint,
+        remote_endpoint)
 
 
 class PeerProcess(object):
@@ -332,3 +565,19 @@ def add_arraymapping(mapping, key, value):
     # type: (MutableMapping[S, List[T]], S, T) -> None
     array = mapping.setdefault(key, [])
     array.append(value)
+
+
+def remove_arraymapping(mapping, key, value):
+    # type: (MutableMapping[S, List[T]], S, T) -> None
+    """
+    Undoes one add_arraymapping() call with the same key and value.
+    """
+    array = mapping.get(key)
+    if not array:
+        return
+    try:
+        array.remove(value)
+    except ValueError:
+        return
+    if not array:
+        del mapping[key]
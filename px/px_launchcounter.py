@@ -92,7 +92,7 @@ class Launchcounter(object):
                 continue
 
             old_proc = pid2oldProc[new_proc.pid]
-            if old_proc.start_time != new_proc.start_time:
+            if old_proc.start_seconds != new_proc.start_seconds:
                 # This is a new process, PID has been reused
                 new_procs.append(new_proc)
                 continue
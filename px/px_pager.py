@@ -4,6 +4,7 @@ import logging
 import threading
 import subprocess
 
+from . import px_exec_util
 from . import px_processinfo
 
 if False:
@@ -31,11 +32,14 @@ def _pump_info_to_fd(with_fileno, process, processes):
             # The user probably just exited the pager before we were done piping into it
             LOG.debug("Lost contact with pager, errno %d", e.errno)
 
-            # FIXME: If an lsof instance was spawned by our px_processinfo.print_process_info()
-            # call above (this is likely), we may want to kill that particular lsof instance.
-            # It will use a bunch of CPU for some time, and we will never use its result anyway.
+            # Nobody will see the results from any lsof we have running, just
+            # stop it from burning CPU
+            px_exec_util.kill_all()
         else:
             LOG.warning("Unexpected OSError pumping process info into pager", exc_info=True)
+    except px_exec_util.KilledError:
+        # We killed lsof ourselves after the pager exited, see page_process_info()
+        LOG.debug("Pager exited while collecting process info")
     except Exception:
         # Logging exceptions on warning level will make them visible to somebody
         # who changes the LOGLEVEL in px.py, but not to ordinary users.
@@ -119,6 +123,9 @@ def launch_pager():
 def page_process_info(process, processes):
     # type: (px_process.PxProcess, List[px_process.PxProcess]) -> None
 
+    # We might have killed everything when a previous pager exited, see below
+    px_exec_util.reset_kill_all()
+
     pager = launch_pager()
     pager_stdin = pager.stdin
     assert pager_stdin is not None
@@ -134,5 +141,12 @@ def page_process_info(process, processes):
     if pagerExitcode != 0:
         LOG.warn("Pager exited with code %d", pagerExitcode)
 
+    # If the user exits the pager while we're still collecting info, any lsof
+    # we have running would otherwise keep going for up to a minute for
+    # nothing. This makes checking several PIDs in a row from ptop cheap.
+    #
+    # This also kills any lsof the info thread starts after this.
+    px_exec_util.kill_all()
+
     # FIXME: Maybe join info_thread here as well to ensure we aren't still pumping before returning?
     # This could possibly prevent https://github.com/walles/px/issues/67
@@ -0,0 +1,213 @@
+"""
+Collects process snapshots in a background thread.
+
+This way ptop can keep handling keypresses and redrawing the screen while the
+process list is being collected, which can take a while on big systems.
+
+How often we poll is decided by a PollScheduler, which keeps px's own CPU usage
+within a budget.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from . import px_process
+from . import px_terminal
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import List      # NOQA
+    from typing import Optional  # NOQA
+
+
+LOG = logging.getLogger(__name__)
+
+# Try to keep px's own CPU usage below this fraction of one core
+DEFAULT_CPU_BUDGET = 0.02
+
+# Set this to a percentage of one core to override DEFAULT_CPU_BUDGET
+CPU_BUDGET_ENVIRONMENT_VARIABLE = "PX_TOP_CPU_BUDGET"
+
+# Don't poll more often than this even if we have CPU budget to spare
+MIN_INTERVAL_SECONDS = 1.0
+
+
+def _get_cpu_seconds():
+    # type: () -> float
+    """
+    Returns the CPU time used by px so far, including waited-for child
+    processes like ps.
+    """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def get_cpu_budget():
+    # type: () -> float
+    """
+    Returns the configured CPU budget as a fraction of one core, or
+    DEFAULT_CPU_BUDGET if none or an invalid one is configured.
+    """
+    budget_string = os.environ.get(CPU_BUDGET_ENVIRONMENT_VARIABLE)
+    if not budget_string:
+        return DEFAULT_CPU_BUDGET
+
+    try:
+        budget_percent = float(budget_string)
+    except ValueError:
+        return DEFAULT_CPU_BUDGET
+
+    if budget_percent <= 0:
+        return DEFAULT_CPU_BUDGET
+
+    return budget_percent / 100.0
+
+
+class PollScheduler(object):
+    """
+    Decides how long to wait between polls.
+
+    Feed it the CPU time spent on each poll cycle, polling, redrawing and all,
+    and it will stretch or shrink the interval to keep our CPU usage within
+    cpu_budget.
+    """
+
+    def __init__(self,
+                 cpu_budget=DEFAULT_CPU_BUDGET,  # type: float
+                 min_interval_seconds=MIN_INTERVAL_SECONDS  # type: float
+                 ):
+        # type: (...) -> None
+        assert cpu_budget > 0
+        self._cpu_budget = cpu_budget
+        self._min_interval_seconds = min_interval_seconds
+
+        # Smoothed CPU seconds per poll cycle, None until we have measured one
+        self._cycle_cpu_seconds = None  # type: Optional[float]
+
+    def add_cycle(self, cpu_seconds):
+        # type: (float) -> None
+        if self._cycle_cpu_seconds is None:
+            self._cycle_cpu_seconds = cpu_seconds
+            return
+
+        # Smooth things out so that one slow poll doesn't make us jump around
+        self._cycle_cpu_seconds = (self._cycle_cpu_seconds + cpu_seconds) / 2.0
+
+    def get_interval_seconds(self):
+        # type: () -> float
+        """
+        How long to wait from the start of one poll to the start of the next.
+        """
+        if self._cycle_cpu_seconds is None:
+            return self._min_interval_seconds
+        return max(self._min_interval_seconds, self._cycle_cpu_seconds / self._cpu_budget)
+
+
+class PxPoller(object):
+    def __init__(self,
+                 poll_complete_notification_fd=None,  # type: Optional[int]
+                 scheduler=None  # type: Optional[PollScheduler]
+                 ):
+        # type: (...) -> None
+        """
+        After each completed poll, px_terminal.POLL_COMPLETE_KEY is written to
+        poll_complete_notification_fd if that is set.
+
+        If no scheduler is given, we use a PollScheduler with default settings.
+
+        Call start() to start polling.
+        """
+        self._poll_complete_notification_fd = poll_complete_notification_fd
+        self._scheduler = scheduler or PollScheduler()
+
+        # Published snapshots are never changed, so readers can use them without
+        # holding the lock
+        self._lock = threading.Lock()
+        self._processes = None  # type: Optional[List[px_process.PxProcess]]
+
+        # Measured time between the last two published snapshots
+        self._refresh_interval_seconds = None  # type: Optional[float]
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(name="Poller", target=self._poller_thread)
+        self._thread.daemon = True
+
+    def start(self):
+        # type: () -> None
+        self._thread.start()
+
+    def stop(self):
+        # type: () -> None
+        """
+        Ask the poller thread to stop. A poll that's already running will be
+        allowed to finish, but won't be published.
+        """
+        self._stop.set()
+
+    def _poller_thread(self):
+        # type: () -> None
+        snapshotter = px_process.PxProcessSnapshotter()
+        last_published = None  # type: Optional[float]
+        cycle_start_cpu_seconds = _get_cpu_seconds()
+        failing = False
+        while not self._stop.is_set():
+            poll_start = time.time()
+            try:
+                processes = snapshotter.get_all()
+            except Exception:
+                # Keep showing the last snapshot and try again later, px will
+                # report the problem on exit. Only log the first failure in a
+                # row, so that a persistent problem doesn't flood the log.
+                if not failing:
+                    LOG.exception("Polling processes failed, will keep trying")
+                failing = True
+                self._stop.wait(self._scheduler.get_interval_seconds())
+                continue
+            failing = False
+
+            if self._stop.is_set():
+                break
+
+            now = time.time()
+            with self._lock:
+                self._processes = processes
+                if last_published is not None:
+                    self._refresh_interval_seconds = now - last_published
+            last_published = now
+
+            if self._poll_complete_notification_fd is not None:
+                os.write(
+                    self._poll_complete_notification_fd,
+                    px_terminal.POLL_COMPLETE_KEY.encode("utf-8"))
+
+            interval_seconds = self._scheduler.get_interval_seconds()
+            self._stop.wait(max(0.0, interval_seconds - (time.time() - poll_start)))
+
+            # Measuring after the wait means that the redraws caused by this
+            # poll get counted as well
+            cpu_seconds = _get_cpu_seconds()
+            self._scheduler.add_cycle(cpu_seconds - cycle_start_cpu_seconds)
+            cycle_start_cpu_seconds = cpu_seconds
+
+    def get_all_processes(self):
+        # type: () -> Optional[List[px_process.PxProcess]]
+        """
+        Returns the most recently collected process list, or None if the first
+        poll hasn't completed yet.
+
+        Don't modify the returned list or its processes, make copies instead.
+        """
+        with self._lock:
+            return self._processes
+
+    def get_refresh_interval_seconds(self):
+        # type: () -> Optional[float]
+        """
+        Returns the time between the two most recent snapshots, or None if we
+        don't have two snapshots yet.
+        """
+        with self._lock:
+            return self._refresh_interval_seconds
@@ -1,3 +1,5 @@
+import copy
+import time
 import logging
 import datetime
 import operator
@@ -23,8 +25,14 @@ if sys.version_info.major >= 3:
     from typing import Optional    # NOQA
     from typing import List        # NOQA
     from typing import Iterable    # NOQA
+    from typing import Iterator    # NOQA
+    from typing import Tuple       # NOQA
+    from typing import Mapping     # NOQA
     from six import text_type      # NOQA
 
+    # See PxProcessBuilder.get_key()
+    ProcessKey = Tuple[int, Optional[Text], Optional[float]]
+
 
 LOG = logging.getLogger(__name__)
 
@@ -45,15 +53,35 @@ CPUTIME_LINUX_DAYS = re.compile("^([0-9]+)-([0-9][0-9]):([0-9][0-9]):([0-9][0-9]
 
 TIMEZONE = dateutil.tz.tzlocal()
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=dateutil.tz.tzutc())
+
+# Process listing backends for get_all()
+BACKEND_PROC = "proc"
+BACKEND_PS = "ps"
+
 
 uid_to_username_cache = {}  # type: Dict[int, Text]
 get_command_cache = {}  # type: Dict[Text, Text]
 
+# See get_boot_time()
+boot_time_cache = []  # type: List[float]
+
+
+def _to_seconds(timestamp):
+    # type: (datetime.datetime) -> float
+    """
+    Convert a timezone aware datetime into seconds since the epoch.
+
+    All processes in one listing share the same now, so listings do this once
+    and pass the result on as now_seconds.
+    """
+    return (timestamp - EPOCH).total_seconds()
+
 
 def _parse_time(time_s):
-    # type: (Text)->datetime.datetime
+    # type: (Text) -> float
     """
-    Parse a local date from ps into a datetime.datetime object.
+    Parse a local date from ps into seconds since the epoch.
 
     Example inputs:
       "Wed Dec 16 12:41:43 2020"
@@ -81,62 +109,119 @@ def _parse_time(time_s):
     second = int(time_s[17:19])
     year = int(time_s[20:24])
 
-    return datetime.datetime(year, zero_based_month + 1, day_of_month, hour, minute, second, tzinfo=TIMEZONE)
+    return time.mktime(
+        (year, zero_based_month + 1, day_of_month, hour, minute, second, 0, 0, -1))
 
 
 class PxProcess(object):
+    # Processes are many, so we want them small. Display strings are computed
+    # on first access and then cached in the underscore slots.
+    __slots__ = (
+        'pid',
+        'ppid',
+        'cmdline',
+        'start_seconds',
+        'age_seconds',
+        'username',
+        'memory_percent',
+        'cpu_percent',
+        'cpu_time_seconds',
+        'score',
+        'children',
+        'parent',
+
+        '_start_time',
+        '_command',
+        '_lowercase_command',
+        '_age_s',
+        '_memory_percent_s',
+        '_cpu_percent_s',
+        '_cpu_time_s',
+    )
+
+    # Compared by __eq__(), cached display strings are left out since they are
+    # all derived from these
+    _EQ_FIELDS = __slots__[0:12]
+
     def __init__(self,
                  cmdline,   # type: Text
                  pid,       # type: int
-                 start_time_string,  # type: Text
+                 start_time_string,  # type: Optional[Text]
                  username,  # type: Text
                  now,       # type: datetime.datetime
                  ppid,      # type: Optional[int]
                  memory_percent=None,  # type: Optional[float]
                  cpu_percent=None,     # type: Optional[float]
                  cpu_time=None,        # type: Optional[float]
+                 start_seconds=None,   # type: Optional[float]
+                 now_seconds=None,     # type: Optional[float]
                  ):
         # type: (...) -> None
+        """
+        Either start_time_string (from ps) or start_seconds (from /proc) must
+        be set.
+
+        start_seconds is in seconds since the epoch.
+
+        now_seconds is now in seconds since the epoch. Pass it if you have it,
+        otherwise it's computed from now.
+        """
         self.pid = pid  # type: int
-        self.ppid = ppid  # type: Optional[int]
 
         self.cmdline = cmdline  # type: text_type
-        self.command = self._get_command()  # type: text_type
-        self.lowercase_command = self.command.lower()  # type: text_type
+        self._command = None  # type: Optional[text_type]
+        self._lowercase_command = None  # type: Optional[text_type]
+
+        if start_seconds is None:
+            assert start_time_string
+            start_seconds = _parse_time(start_time_string.strip())
+        self.start_seconds = start_seconds  # type: float
+        self._start_time = None  # type: Optional[datetime.datetime]
+
+        self.children = set()  # type: MutableSet[PxProcess]
+        self.parent = None  # type: Optional[PxProcess]
 
-        self.start_time = _parse_time(start_time_string.strip())
-        self.age_seconds = (now - self.start_time).total_seconds()  # type: float
+        self._cpu_time_s = None  # type: Optional[text_type]
+        if now_seconds is None:
+            now_seconds = _to_seconds(now)
+        self._update(now_seconds, ppid, username, memory_percent, cpu_percent, cpu_time)
+
+    def _update(self,
+                now_seconds,  # type: float
+                ppid,      # type: Optional[int]
+                username,  # type: Text
+                memory_percent,  # type: Optional[float]
+                cpu_percent,     # type: Optional[float]
+                cpu_time,        # type: Optional[float]
+                ):
+        # type: (...) -> None
+        """
+        Set the fields that can change during a process' lifetime.
+        """
+        self.ppid = ppid  # type: Optional[int]
+
+        self.age_seconds = now_seconds - self.start_seconds  # type: float
         if self.age_seconds < 0:
-            LOG.error("Process age < 0: age_seconds=%r now=%r start_time=%r start_time_string=%r timezone=%r",
+            LOG.error("Process age < 0: age_seconds=%r now_seconds=%r start_seconds=%r timezone=%r",
                 self.age_seconds,
-                now,
-                self.start_time,
-                start_time_string.strip(),
+                now_seconds,
+                self.start_seconds,
                 datetime.datetime.now(TIMEZONE).tzname())
             assert False
         assert self.age_seconds >= 0
-        self.age_s = seconds_to_str(self.age_seconds)  # type: text_type
+        self._age_s = None  # type: Optional[text_type]
 
         self.username = username  # type: text_type
 
-        self.memory_percent = memory_percent
-        self.memory_percent_s = "--"  # type: text_type
-        if memory_percent is not None:
-            self.memory_percent_s = (
-                "{:.0f}%".format(memory_percent))
+        self.memory_percent = memory_percent  # type: Optional[float]
+        self._memory_percent_s = None  # type: Optional[text_type]
 
-        self.cpu_percent = cpu_percent
-        self.cpu_percent_s = "--"  # type: text_type
-        if cpu_percent is not None:
-            self.cpu_percent_s = (
-                "{:.0f}%".format(cpu_percent))
+        self.cpu_percent = cpu_percent  # type: Optional[float]
+        self._cpu_percent_s = None  # type: Optional[text_type]
 
         # Setting the CPU time like this implicitly recomputes the score
         self.set_cpu_time_seconds(cpu_time)
 
-        self.children = set()  # type: MutableSet[PxProcess]
-        self.parent = None  # type: Optional[PxProcess]
-
     def __repr__(self):
         # I guess this is really what __str__ should be doing, but the point of
         # implementing this method is to make the py.test output more readable,
@@ -149,16 +234,85 @@ class PxProcess(object):
     def __eq__(self, other):
         if other is None:
             return False
-        return self.__dict__ == other.__dict__
+        for field in PxProcess._EQ_FIELDS:
+            mine = getattr(self, field)
+            theirs = getattr(other, field)
+
+            # The identity check saves us from infinite parent / children
+            # recursion
+            if mine is not theirs and mine != theirs:
+                return False
+        return True
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __copy__(self):
+        # type: () -> PxProcess
+        # The default copy.copy() implementation is slow on slotted classes,
+        # and ptop copies lots of processes
+        clone = PxProcess.__new__(PxProcess)
+        for field, value in zip(PxProcess.__slots__, _get_slots(self)):
+            setattr(clone, field, value)
+        return clone
+
     def __hash__(self):
         return self.pid
 
+    @property
+    def start_time(self):
+        # type: () -> datetime.datetime
+        if self._start_time is None:
+            self._start_time = datetime.datetime.fromtimestamp(self.start_seconds, TIMEZONE)
+        return self._start_time
+
+    @property
+    def command(self):
+        # type: () -> text_type
+        """Just the command without any arguments or path"""
+        if self._command is None:
+            self._command = self._get_command()
+        return self._command
+
+    @property
+    def lowercase_command(self):
+        # type: () -> text_type
+        if self._lowercase_command is None:
+            self._lowercase_command = self.command.lower()
+        return self._lowercase_command
+
+    @property
+    def age_s(self):
+        # type: () -> text_type
+        if self._age_s is None:
+            self._age_s = seconds_to_str(self.age_seconds)
+        return self._age_s
+
+    @property
+    def memory_percent_s(self):
+        # type: () -> text_type
+        if self._memory_percent_s is None:
+            self._memory_percent_s = percent_to_str(self.memory_percent)
+        return self._memory_percent_s
+
+    @property
+    def cpu_percent_s(self):
+        # type: () -> text_type
+        if self._cpu_percent_s is None:
+            self._cpu_percent_s = percent_to_str(self.cpu_percent)
+        return self._cpu_percent_s
+
+    @property
+    def cpu_time_s(self):
+        # type: () -> text_type
+        if self._cpu_time_s is None:
+            self._cpu_time_s = u"--"
+            if self.cpu_time_seconds is not None:
+                self._cpu_time_s = seconds_to_str(self.cpu_time_seconds)
+        return self._cpu_time_s
+
     def _recompute_score(self):
-        self.score = 0.0
+        self.score = 0.0  # type: float
         if self.memory_percent is None:
             return
         if self.cpu_time_seconds is None:
@@ -168,13 +322,15 @@ class PxProcess(object):
             (self.cpu_time_seconds + 1.0) *
             (self.memory_percent + 1.0) / (self.age_seconds + 1.0))
 
+    def set_cpu_percent(self, percent):
+        # type: (Optional[float]) -> None
+        self.cpu_percent = percent
+        self._cpu_percent_s = None
+
     def set_cpu_time_seconds(self, seconds):
         # type: (Optional[float]) -> None
-        self.cpu_time_s = "--"  # type: Text
-        self.cpu_time_seconds = None
-        if seconds is not None:
-            self.cpu_time_s = seconds_to_str(seconds)
-            self.cpu_time_seconds = seconds
+        self.cpu_time_seconds = seconds  # type: Optional[float]
+        self._cpu_time_s = None
 
         self._recompute_score()
 
@@ -185,23 +341,7 @@ class PxProcess(object):
         See px_process_test.test_match() for the exact definition of how the
         matching is done.
         """
-        if string is None:
-            return True
-
-        if self.username == string:
-            return True
-
-        if not require_exact_user:
-            if self.username.startswith(string):
-                return True
-
-        if string in self.cmdline:
-            return True
-
-        if string in self.cmdline.lower():
-            return True
-
-        return False
+        return _match(self.username, self.cmdline, string, require_exact_user)
 
     def get_command_line_array(self):
         return px_commandline.to_array(self.cmdline)
@@ -226,20 +366,45 @@ class PxProcess(object):
         return match.group(1)
 
     def is_alive(self):
-        try:
-            # Signal 0 has no effect
-            os.kill(self.pid, 0)
-        except OSError as e:
-            if e.errno == errno.ESRCH:
-                # No such process
-                return False
+        return pid_is_alive(self.pid)
+
 
-            # Process found but something else went wrong
+def pid_is_alive(pid):
+    # type: (int) -> bool
+    try:
+        # Signal 0 has no effect
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            # No such process
+            return False
+
+        # Process found but something else went wrong
+        return True
+
+    # No problem, process was there
+    return True
+
+
+def _match(username, cmdline, string, require_exact_user):
+    # type: (Text, Text, Optional[Text], bool) -> bool
+    if string is None:
+        return True
+
+    if username == string:
+        return True
+
+    if not require_exact_user:
+        if username.startswith(string):
             return True
 
-        # No problem, process was there
+    if string in cmdline:
+        return True
+
+    if string in cmdline.lower():
         return True
 
+    return False
 
 
 class PxProcessBuilder(object):
@@ -248,11 +413,16 @@ class PxProcessBuilder(object):
         self.pid = None       # type: Optional[int]
         self.ppid = None      # type: Optional[int]
         self.start_time_string = None  # type: Optional[Text]
+        self.start_seconds = None  # type: Optional[float]
         self.username = None  # type: Optional[Text]
         self.cpu_percent = None  # type: Optional[float]
         self.cpu_time = None  # type: Optional[float]
         self.memory_percent = None  # type: Optional[float]
 
+        # Executable name from /proc/PID/stat, changes on exec(). Only set by
+        # the /proc backend.
+        self.comm = None  # type: Optional[bytes]
+
     def __repr__(self):
         return \
             "start_time_string=%r pid=%r ppid=%r user=%r cpu%%=%r cputime=%r mem%%=%r cmd=<%r>" % (
@@ -266,19 +436,61 @@ class PxProcessBuilder(object):
                 self.cmdline
             )
 
-    def build(self, now):
-        # type: (datetime.datetime) -> PxProcess
+    def get_key(self):
+        # type: () -> ProcessKey
+        """
+        Identifies a process even if its PID gets reused, see
+        PxProcessSnapshotter.
+        """
+        assert self.pid is not None
+        return (self.pid, self.start_time_string, self.start_seconds)
+
+    def match(self, string):
+        # type: (Optional[Text]) -> bool
+        """
+        Like PxProcess.match(), but without having to build the process first.
+        """
+        assert self.username is not None
+        assert self.cmdline is not None
+        return _match(self.username, self.cmdline, string, require_exact_user=True)
+
+    def update(self, process, now_seconds):
+        # type: (PxProcess, float) -> PxProcess
+        """
+        Returns a copy of process with all fields that can change during a
+        process' lifetime taken from this builder.
+
+        process must have been built from the same process as this builder,
+        meaning from a builder with the same get_key().
+        """
+        username = self.username
+        if username is None:
+            # Not collected for known processes, see _get_all_builders()
+            username = process.username
+
+        updated = copy.copy(process)
+        updated.children = set()
+        updated.parent = None
+        updated._update(
+            now_seconds, self.ppid, username,
+            self.memory_percent, self.cpu_percent, self.cpu_time)
+        return updated
+
+    def build(self, now, now_seconds=None):
+        # type: (datetime.datetime, Optional[float]) -> PxProcess
         assert self.cmdline
         assert self.pid is not None
-        assert self.start_time_string
+        assert self.start_time_string or self.start_seconds is not None
         assert self.username
         return PxProcess(
             cmdline=self.cmdline,
             pid=self.pid,
             ppid=self.ppid,
             start_time_string=self.start_time_string,
+            start_seconds=self.start_seconds,
             username=self.username,
             now=now,
+            now_seconds=now_seconds,
             memory_percent=self.memory_percent,
             cpu_percent=self.cpu_percent,
             cpu_time=self.cpu_time
@@ -329,6 +541,11 @@ def uid_to_username(uid):
 
 def ps_line_to_process(ps_line, now):
     # type: (Text, datetime.datetime) -> PxProcess
+    return _ps_line_to_builder(ps_line).build(now)
+
+
+def _ps_line_to_builder(ps_line):
+    # type: (Text) -> PxProcessBuilder
     match = PS_LINE.match(ps_line)
     if not match:
         raise Exception("Failed to match ps line <%r>" % ps_line)
@@ -336,14 +553,14 @@ def ps_line_to_process(ps_line, now):
     process_builder = PxProcessBuilder()
     process_builder.pid = int(match.group(1))
     process_builder.ppid = int(match.group(2))
-    process_builder.start_time_string = match.group(3)
+    process_builder.start_time_string = match.group(3).strip()
     process_builder.username = uid_to_username(int(match.group(4)))
     process_builder.cpu_percent = float(match.group(5))
     process_builder.cpu_time = parse_time(match.group(6))
     process_builder.memory_percent = float(match.group(7))
     process_builder.cmdline = match.group(8)
 
-    return process_builder.build(now)
+    return process_builder
 
 
 def create_kernel_process(now):
@@ -356,8 +573,7 @@ def create_kernel_process(now):
     process_builder.pid = 0
     process_builder.ppid = None
 
-    # FIXME: This should be the system boot timestamp, not the epoch
-    process_builder.start_time_string = datetime.datetime.utcfromtimestamp(0).strftime("%c")
+    process_builder.start_seconds = get_boot_time()
 
     process_builder.username = u"root"
     process_builder.cpu_time = None
@@ -398,7 +614,10 @@ def resolve_links(processes, now):
 
 def remove_process_and_descendants(processes, pid):
     # type: (Dict[int, PxProcess], int) -> None
-    process = processes[pid]
+    process = processes.get(pid)
+    if process is None:
+        return
+
     if process.parent is not None:
         process.parent.children.remove(process)
     toexclude = [process]
@@ -409,9 +628,186 @@ def remove_process_and_descendants(processes, pid):
             toexclude.append(child)
 
 
-def get_all():
-    # type: () -> List[PxProcess]
-    processes = {}
+def get_all(backend=None, search=None):
+    # type: (Optional[str], Optional[Text]) -> List[PxProcess]
+    """
+    List all processes on the system.
+
+    The backend parameter can be BACKEND_PROC or BACKEND_PS. If it isn't set we
+    go for /proc if that is available (Linux), and fall back to ps otherwise
+    (macOS).
+
+    If search is set, only processes matching it (see PxProcess.match()) and
+    their ancestors are returned. The others are never built, which is a lot
+    cheaper than building everything and filtering afterwards.
+    """
+    now = datetime.datetime.now().replace(tzinfo=TIMEZONE)
+    now_seconds = _to_seconds(now)
+    process_builders = _get_all_builders(backend, now_seconds)
+    if search:
+        process_builders = _filter_builders(process_builders, search)
+
+    processes = {}  # type: Dict[int, PxProcess]
+    for process_builder in process_builders:
+        process = process_builder.build(now, now_seconds)
+        processes[process.pid] = process
+
+    return _finish_process_list(processes, now)
+
+
+def _filter_builders(process_builders, search):
+    # type: (Iterable[PxProcessBuilder], Text) -> List[PxProcessBuilder]
+    """
+    Returns the builders matching search, plus the builders for all their
+    ancestors.
+    """
+    pid_to_builder = {}  # type: Dict[Optional[int], PxProcessBuilder]
+    matches = []  # type: List[PxProcessBuilder]
+    for process_builder in process_builders:
+        pid_to_builder[process_builder.pid] = process_builder
+        if process_builder.match(search):
+            matches.append(process_builder)
+
+    wanted = {}  # type: Dict[Optional[int], PxProcessBuilder]
+    for process_builder in matches:
+        builder = process_builder  # type: Optional[PxProcessBuilder]
+        while builder is not None and builder.pid not in wanted:
+            wanted[builder.pid] = builder
+            builder = pid_to_builder.get(builder.ppid)
+
+    return list(wanted.values())
+
+
+def iter_all(backend=None, search=None):
+    # type: (Optional[str], Optional[Text]) -> Iterator[PxProcess]
+    """
+    Like get_all(), but yields processes while the process listing is still
+    being read, so callers can start filtering before it is done.
+
+    Since not all parents are known until the end, the yielded processes have
+    no parent and no children.
+
+    If search is set, only processes matching it are built and yielded. Since
+    there are no parent links, ancestors are not included.
+
+    Just like get_all(), we leave out ourselves and our own children (like the
+    ps process doing the listing).
+    """
+    now = datetime.datetime.now().replace(tzinfo=TIMEZONE)
+    now_seconds = _to_seconds(now)
+    my_pid = os.getpid()
+    has_kernel_process = False
+    for process_builder in _get_all_builders(backend, now_seconds):
+        if process_builder.pid == my_pid or process_builder.ppid == my_pid:
+            continue
+        if process_builder.pid == 0:
+            has_kernel_process = True
+        if search and not process_builder.match(search):
+            continue
+        yield process_builder.build(now, now_seconds)
+
+    if not has_kernel_process:
+        # Just like resolve_links() would have done
+        kernel_process = create_kernel_process(now)
+        if kernel_process.match(search):
+            yield kernel_process
+
+
+def _finish_process_list(processes, now):
+    # type: (Dict[int, PxProcess], datetime.datetime) -> List[PxProcess]
+    resolve_links(processes, now)
+    remove_process_and_descendants(processes, os.getpid())
+
+    return list(processes.values())
+
+
+def _get_all_builders(backend, now_seconds, known_comms=None):
+    # type: (Optional[str], float, Optional[Mapping[ProcessKey, bytes]]) -> Iterable[PxProcessBuilder]
+    """
+    known_comms maps PxProcessBuilder.get_key() to PxProcessBuilder.comm for
+    processes the caller already knows. Backends are free to leave out
+    cmdline and username for those, unless comm has changed.
+    """
+    if backend is None:
+        backend = get_default_backend()
+
+    if backend == BACKEND_PROC:
+        return _get_all_builders_from_proc(now_seconds, known_comms=known_comms)
+    if backend == BACKEND_PS:
+        return _get_all_builders_from_ps()
+
+    raise ValueError("Unknown process listing backend: " + str(backend))
+
+
+class PxProcessSnapshotter(object):
+    """
+    Lists processes just like get_all(), but without rebuilding processes we
+    already listed last time.
+
+    Processes are identified by their PID and start time, so a reused PID
+    still gets a new process. For processes we have seen before, only the
+    fields that can change during a process' lifetime are updated, and
+    command extraction, start time parsing and friends are skipped. This
+    makes the cost of each get_all() call scale with process churn rather
+    than with the total number of processes.
+
+    With the /proc backend, command lines and user names are only read for
+    new processes.
+
+    Processes returned by earlier get_all() calls are never modified, so
+    holding on to an old snapshot (like ptop's baseline) is fine.
+    """
+
+    def __init__(self, backend=None):
+        # type: (Optional[str]) -> None
+        self._backend = backend
+
+        # Processes from the last snapshot, by PxProcessBuilder.get_key()
+        self._last_snapshot = {}  # type: Dict[ProcessKey, PxProcess]
+
+        # PxProcessBuilder.comm values from the last snapshot, so that we
+        # notice when a process exec()s something else
+        self._last_comms = {}  # type: Dict[ProcessKey, bytes]
+
+    def get_all(self):
+        # type: () -> List[PxProcess]
+        now = datetime.datetime.now().replace(tzinfo=TIMEZONE)
+        now_seconds = _to_seconds(now)
+
+        snapshot = {}  # type: Dict[ProcessKey, PxProcess]
+        comms = {}  # type: Dict[ProcessKey, bytes]
+        processes = {}  # type: Dict[int, PxProcess]
+        for process_builder in _get_all_builders(
+                self._backend, now_seconds, self._last_comms):
+            key = process_builder.get_key()
+            if process_builder.comm is not None:
+                comms[key] = process_builder.comm
+            process = self._last_snapshot.get(key)
+            if process is None:
+                process = process_builder.build(now, now_seconds)
+            elif process_builder.cmdline is not None and process.cmdline != process_builder.cmdline:
+                # The process changed its command line
+                process = process_builder.build(now, now_seconds)
+            else:
+                process = process_builder.update(process, now_seconds)
+
+            snapshot[key] = process
+            processes[process.pid] = process
+
+        self._last_snapshot = snapshot
+        self._last_comms = comms
+        return _finish_process_list(processes, now)
+
+
+def get_default_backend():
+    # type: () -> str
+    if os.path.isfile("/proc/self/stat"):
+        return BACKEND_PROC
+    return BACKEND_PS
+
+
+def _get_all_builders_from_ps():
+    # type: () -> Iterator[PxProcessBuilder]
 
     # NOTE: Both the full path to ps and "close_fds = False" are important
     # because they enable the use of _posix_spawn()...
@@ -437,18 +833,257 @@ def get_all():
 
         stdout = ps.stdout
         assert stdout
-        now = datetime.datetime.now().replace(tzinfo=TIMEZONE)
-        for ps_line in stdout:
-            process = ps_line_to_process(ps_line.decode('utf-8'), now)
-            processes[process.pid] = process
+        try:
+            for ps_line in _read_lines(stdout.fileno()):
+                yield _ps_line_to_builder(ps_line)
+        finally:
+            # If our consumer stopped early, closing the pipe makes ps exit
+            stdout.close()
+            exit_code = ps.wait()
 
-        if ps.wait() != 0:
-            raise IOError("Exit code {} from {}".format(ps.returncode, command))
+        if exit_code != 0:
+            raise IOError("Exit code {} from {}".format(exit_code, command))
 
-    resolve_links(processes, now)
-    remove_process_and_descendants(processes, os.getpid())
 
-    return list(processes.values())
+def _read_lines(fd):
+    # type: (int) -> Iterator[Text]
+    """
+    Yields UTF-8 decoded lines from fd until EOF.
+
+    The input is read in big chunks, and each chunk is decoded and split in one
+    go, rather than going through a buffered file object one line at a time.
+    """
+    partial_line = b""
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+
+        complete_lines, _, partial_line = (partial_line + chunk).rpartition(b"\n")
+        if not complete_lines:
+            continue
+
+        for line in complete_lines.decode('utf-8').split(u"\n"):
+            yield line
+
+    if partial_line:
+        yield partial_line.decode('utf-8')
+
+
+def _read_proc_file(path):
+    # type: (str) -> bytes
+    """
+    Read a whole /proc file.
+
+    Using os.open() rather than open() saves us from creating a buffered file
+    object per file, and we read a lot of files.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        os.close(fd)
+
+
+def get_boot_time():
+    # type: () -> float
+    """
+    Returns the system boot time in seconds since the epoch, or 0.0 (the epoch)
+    if we can't find out.
+    """
+    if not boot_time_cache:
+        boot_time_cache.append(_get_boot_time())
+    return boot_time_cache[0]
+
+
+def _get_boot_time():
+    # type: () -> float
+    try:
+        return _get_boot_time_from_proc()
+    except (IOError, OSError):
+        # No /proc, not Linux
+        pass
+
+    try:
+        # Example output: "{ sec = 1616146245, usec = 0 } Fri Mar 19 10:30:45 2021"
+        output = px_exec_util.run(["sysctl", "-n", "kern.boottime"])
+        match = re.search("sec = ([0-9]+)", output)
+        if match:
+            return float(match.group(1))
+    except (IOError, OSError):
+        # No sysctl, not macOS
+        pass
+
+    LOG.warning("Unable to find system boot time, going with the epoch")
+    return 0.0
+
+
+def _get_boot_time_from_proc(proc="/proc"):
+    # type: (str) -> float
+    """
+    Returns the system boot time in seconds since the epoch.
+    """
+    for line in _read_proc_file(proc + "/stat").splitlines():
+        if line.startswith(b"btime "):
+            return float(line[6:])
+
+    raise IOError("btime not found in " + proc + "/stat")
+
+
+def _get_total_ram_kb_from_proc(proc="/proc"):
+    # type: (str) -> int
+    for line in _read_proc_file(proc + "/meminfo").splitlines():
+        if line.startswith(b"MemTotal:"):
+            # Example: "MemTotal:        8033116 kB"
+            return int(line.split()[1])
+
+    raise IOError("MemTotal not found in " + proc + "/meminfo")
+
+
+def _parse_proc_stat(stat):
+    # type: (bytes) -> Tuple[bytes, List[bytes]]
+    """
+    Parse the contents of a /proc/PID/stat file.
+
+    Returns a (comm, fields) tuple, where fields[0] is the process state field
+    and the rest follow in the order documented in proc(5).
+
+    comm can contain both spaces and parentheses, so we split on the last ')'.
+    """
+    comm_start = stat.index(b"(")
+    comm_end = stat.rindex(b")")
+    return (stat[comm_start + 1:comm_end], stat[comm_end + 2:].split(b" "))
+
+
+def _get_uid_from_proc_status(status):
+    # type: (bytes) -> int
+    """
+    Extract the effective UID from the contents of a /proc/PID/status file.
+
+    The effective UID is what "ps -o uid=" shows.
+    """
+    uid_start = status.index(b"\nUid:") + 5
+    uid_end = status.index(b"\n", uid_start)
+
+    # Example: "0\t0\t0\t0", real, effective, saved and filesystem UIDs
+    return int(status[uid_start:uid_end].split()[1])
+
+
+def _proc_cmdline_to_text(cmdline, comm, state):
+    # type: (bytes, bytes, bytes) -> Text
+    """
+    Make /proc/PID/cmdline contents look like the command line ps shows.
+    """
+    if cmdline:
+        # Arguments are NUL separated and the last one NUL terminated
+        return cmdline.rstrip(b"\0").replace(b"\0", b" ").decode('utf-8', 'replace')
+
+    # Kernel threads and zombies have no command line, this is how ps shows
+    # those.
+    text = u"[" + comm.decode('utf-8', 'replace') + u"]"
+    if state == b"Z":
+        text += u" <defunct>"
+    return text
+
+
+def _proc_to_builder(proc,  # type: str
+                     pid,   # type: int
+                     now_seconds,  # type: float
+                     clock_ticks_per_second,  # type: int
+                     page_size_bytes,  # type: int
+                     boot_seconds,     # type: float
+                     total_ram_kb,     # type: int
+                     known_comms,      # type: Optional[Mapping[ProcessKey, bytes]]
+                     ):
+    # type: (...) -> PxProcessBuilder
+    pid_dir = proc + "/" + str(pid)
+
+    comm, stat_fields = _parse_proc_stat(_read_proc_file(pid_dir + "/stat"))
+
+    # Field indices are from the proc(5) man page, minus three for the pid and
+    # the comm fields (not in stat_fields) and for man page numbering starting
+    # at one.
+    state = stat_fields[0]
+    ppid = int(stat_fields[1])
+    cpu_ticks = int(stat_fields[11]) + int(stat_fields[12])  # utime + stime
+    start_ticks = int(stat_fields[19])
+    rss_pages = int(stat_fields[21])
+
+    # No datetime here, those are created only if somebody wants to show one
+    start_seconds = boot_seconds + start_ticks / float(clock_ticks_per_second)
+    if start_seconds > now_seconds:
+        # Just started and btime is rounded to whole seconds
+        start_seconds = now_seconds
+
+    cpu_time = cpu_ticks / float(clock_ticks_per_second)
+
+    # This is how ps computes %cpu: CPU time divided by wall clock age
+    age_seconds = now_seconds - start_seconds
+    cpu_percent = 0.0
+    if age_seconds > 0:
+        cpu_percent = 100.0 * cpu_time / age_seconds
+
+    process_builder = PxProcessBuilder()
+    process_builder.pid = pid
+    process_builder.ppid = ppid
+    process_builder.start_seconds = start_seconds
+    process_builder.cpu_percent = cpu_percent
+    process_builder.cpu_time = cpu_time
+    process_builder.memory_percent = (
+        100.0 * rss_pages * page_size_bytes / 1024.0 / total_ram_kb)
+    process_builder.comm = comm
+
+    if known_comms is not None and known_comms.get(process_builder.get_key()) == comm:
+        # Caller already knows the rest, don't read any more files. If comm
+        # changed the process has exec()ed something else, so then we do.
+        return process_builder
+
+    uid = _get_uid_from_proc_status(_read_proc_file(pid_dir + "/status"))
+    cmdline = _read_proc_file(pid_dir + "/cmdline")
+    process_builder.username = uid_to_username(uid)
+    process_builder.cmdline = _proc_cmdline_to_text(cmdline, comm, state)
+
+    return process_builder
+
+
+def _get_all_builders_from_proc(now_seconds, proc="/proc", known_comms=None):
+    # type: (float, str, Optional[Mapping[ProcessKey, bytes]]) -> Iterator[PxProcessBuilder]
+    """
+    List all processes by reading /proc/PID/{stat,status,cmdline}.
+
+    This is what ps does as well on Linux, but doing it ourselves saves us
+    from forking ps and from parsing its output.
+    """
+    clock_ticks_per_second = os.sysconf('SC_CLK_TCK')
+    page_size_bytes = os.sysconf('SC_PAGE_SIZE')
+    boot_seconds = _get_boot_time_from_proc(proc)
+    total_ram_kb = _get_total_ram_kb_from_proc(proc)
+
+    for filename in os.listdir(proc):
+        if not filename.isdigit():
+            continue
+
+        try:
+            process_builder = _proc_to_builder(
+                proc, int(filename), now_seconds,
+                clock_ticks_per_second, page_size_bytes,
+                boot_seconds, total_ram_kb, known_comms)
+        except (IOError, OSError) as e:
+            if e.errno in [errno.ENOENT, errno.ESRCH]:
+                # Process went away while we were looking at it, never mind
+                continue
+            raise
+
+        yield process_builder
+
+
+_get_slots = operator.attrgetter(*PxProcess.__slots__)
 
 
 def order_best_last(processes):
@@ -465,6 +1100,13 @@ def order_best_first(processes):
     return ordered
 
 
+def percent_to_str(percent):
+    # type: (Optional[float]) -> Text
+    if percent is None:
+        return u"--"
+    return u"{:.0f}%".format(percent)
+
+
 def seconds_to_str(seconds):
     # type: (float) -> Text
     if seconds < 60:
@@ -0,0 +1,296 @@
+"""
+Columnar process snapshots.
+
+A PxProcessColumns keeps one typed array per process field rather than one
+Python object per process. Scoring, subtracting baseline CPU times, sorting and
+top-K selection then work on whole columns, and PxProcess objects are only
+materialized for the rows somebody actually wants to look at.
+
+Float columns use -1.0 for "unknown", since none of the real values can be
+negative.
+"""
+
+import copy
+import array
+import heapq
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from . import px_process      # NOQA
+    from six import text_type     # NOQA
+    from typing import Dict       # NOQA
+    from typing import List       # NOQA
+    from typing import Tuple      # NOQA
+    from typing import Iterable   # NOQA
+    from typing import Optional   # NOQA
+
+
+UNKNOWN = -1.0
+
+# Orderings for get_toplist_rows()
+ORDER_CPU_PERCENT = "cpu_percent"
+ORDER_CPU_TIME = "cpu_time"
+ORDER_MEMORY = "memory"
+
+
+def _to_column_value(value):
+    # type: (Optional[float]) -> float
+    if value is None:
+        return UNKNOWN
+    return value
+
+
+class PxProcessColumns(object):
+    """
+    A process snapshot stored as a struct of arrays.
+
+    Row number n in every column describes self.processes[n].
+    """
+
+    def __init__(self, processes):
+        # type: (Iterable[px_process.PxProcess]) -> None
+        self.processes = list(processes)
+
+        self.pids = array.array('l', [p.pid for p in self.processes])
+        self.ppids = array.array(
+            'l', [-1 if p.ppid is None else p.ppid for p in self.processes])
+        self.start_times = array.array(
+            'd', [p.start_seconds for p in self.processes])
+        self.ages = array.array('d', [p.age_seconds for p in self.processes])
+        self.cpu_times = array.array(
+            'd', [_to_column_value(p.cpu_time_seconds) for p in self.processes])
+
+        # subtract_cpu_times() replaces cpu_times, but comparing snapshots
+        # needs the original values
+        self._raw_cpu_times = self.cpu_times
+        self.cpu_percents = array.array(
+            'd', [_to_column_value(p.cpu_percent) for p in self.processes])
+        self.memory_percents = array.array(
+            'd', [_to_column_value(p.memory_percent) for p in self.processes])
+
+        # Command lines go into a string table, rows just point into it
+        self.cmdlines = []  # type: List[text_type]
+        cmdline_ids = []  # type: List[int]
+        cmdline_to_id = {}  # type: Dict[text_type, int]
+        for process in self.processes:
+            cmdline_id = cmdline_to_id.get(process.cmdline)
+            if cmdline_id is None:
+                cmdline_id = len(self.cmdlines)
+                cmdline_to_id[process.cmdline] = cmdline_id
+                self.cmdlines.append(process.cmdline)
+            cmdline_ids.append(cmdline_id)
+        self.cmdline_ids = array.array('l', cmdline_ids)
+
+        self.scores = self._compute_scores()
+
+        # Set by subtract_cpu_times() and set_recent_cpu_percents(), tells
+        # to_processes() to check for changed values
+        self._cpu_times_adjusted = False
+        self._cpu_percents_adjusted = False
+
+        # Lazily computed by _get_key_to_row()
+        self._key_to_row = None  # type: Optional[Dict[Tuple[int, float], int]]
+
+        # Lazily computed by _get_cmdline_ranks()
+        self._cmdline_ranks = None  # type: Optional[array.array]
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.processes)
+
+    def _compute_scores(self):
+        # type: () -> array.array
+        """Same formula as PxProcess._recompute_score(), for all rows at once"""
+        return array.array('d', [
+            0.0 if cpu < 0.0 or memory < 0.0 else (cpu + 1.0) * (memory + 1.0) / (age + 1.0)
+            for cpu, memory, age in zip(self.cpu_times, self.memory_percents, self.ages)])
+
+    def _get_key_to_row(self):
+        # type: () -> Dict[Tuple[int, float], int]
+        if self._key_to_row is None:
+            self._key_to_row = dict(
+                (key, row) for row, key in enumerate(zip(self.pids, self.start_times)))
+        return self._key_to_row
+
+    def set_recent_cpu_percents(self, previous):
+        # type: (PxProcessColumns) -> None
+        """
+        Replace the CPU percentages, which are averages over each process'
+        lifetime, with the CPU usage since the previous snapshot.
+
+        Processes that are new since previous get their lifetime average, all
+        of their lifetime is within the interval anyway.
+
+        CPU times are compared before any subtract_cpu_times() on either
+        snapshot, so the current snapshot can be reused as the next one's
+        previous.
+        """
+        key_to_previous_row = previous._get_key_to_row()
+        previous_cpu_times = previous._raw_cpu_times
+        previous_ages = previous.ages
+        cpu_times = self._raw_cpu_times
+        cpu_percents = self.cpu_percents
+        ages = self.ages
+        for row, key in enumerate(zip(self.pids, self.start_times)):
+            cpu_time = cpu_times[row]
+            if cpu_time < 0.0:
+                # Unknown, can't do better than what we have
+                continue
+
+            previous_row = key_to_previous_row.get(key)
+            if previous_row is None:
+                cpu_time_delta = cpu_time
+                interval_seconds = ages[row]
+            else:
+                previous_cpu_time = previous_cpu_times[previous_row]
+                if previous_cpu_time < 0.0:
+                    continue
+                cpu_time_delta = max(0.0, cpu_time - previous_cpu_time)
+
+                # Ages grow with wall clock time, so this is the time between
+                # the snapshots
+                interval_seconds = ages[row] - previous_ages[previous_row]
+
+            if interval_seconds <= 0.0:
+                continue
+            cpu_percents[row] = 100.0 * cpu_time_delta / interval_seconds
+
+        self._cpu_percents_adjusted = True
+
+    def subtract_cpu_times(self, baseline):
+        # type: (PxProcessColumns) -> None
+        """
+        For all processes that are also in baseline, subtract the baseline's
+        CPU time from ours.
+
+        Processes are matched on PID and start time, so reused PIDs aren't
+        mixed up. Scores are updated to match the new CPU times.
+        """
+        key_to_baseline_row = baseline._get_key_to_row()
+        baseline_cpu_times = baseline._raw_cpu_times
+
+        # Copy, _raw_cpu_times must stay unchanged
+        cpu_times = array.array('d', self._raw_cpu_times)
+        self.cpu_times = cpu_times
+        for row, key in enumerate(zip(self.pids, self.start_times)):
+            baseline_row = key_to_baseline_row.get(key)
+            if baseline_row is None:
+                # This process is newer than the baseline
+                continue
+
+            cpu_time = cpu_times[row]
+            baseline_cpu_time = baseline_cpu_times[baseline_row]
+            if cpu_time < 0.0 or baseline_cpu_time < 0.0:
+                # Can't subtract unknown CPU times
+                continue
+
+            cpu_times[row] = cpu_time - baseline_cpu_time
+
+        self.scores = self._compute_scores()
+        self._cpu_times_adjusted = True
+
+    def _get_cmdline_ranks(self):
+        # type: () -> array.array
+        """Returns the alphabetical rank of each command line, indexed by cmdline ID"""
+        if self._cmdline_ranks is not None:
+            return self._cmdline_ranks
+
+        ranks = array.array('l', [0]) * len(self.cmdlines)
+        ordered_ids = sorted(range(len(self.cmdlines)), key=self.cmdlines.__getitem__)
+        for rank, cmdline_id in enumerate(ordered_ids):
+            ranks[cmdline_id] = rank
+        self._cmdline_ranks = ranks
+        return ranks
+
+    def order_best_first(self, rows=None):
+        # type: (Optional[Iterable[int]]) -> List[int]
+        """
+        Like px_process.order_best_first(), but returns row numbers.
+
+        If rows is given, only those rows are ordered.
+        """
+        if rows is None:
+            rows = range(len(self))
+        scores = self.scores
+        cmdline_ids = self.cmdline_ids
+        ranks = self._get_cmdline_ranks()
+        return sorted(rows, key=lambda row: (-scores[row], ranks[cmdline_ids[row]]))
+
+    def get_toplist_rows(self,
+                         order=ORDER_CPU_TIME,  # type: str
+                         rows=None,        # type: Optional[Iterable[int]]
+                         max_count=None    # type: Optional[int]
+                         ):
+        # type: (...) -> List[int]
+        """
+        Returns row numbers in ptop order, highest CPU or memory usage first.
+
+        order is one of the ORDER_ constants. Ties are broken by score and then
+        by command line.
+
+        If rows is given, only those rows are considered. If max_count is
+        given, only the top max_count rows are returned.
+        """
+        if rows is None:
+            rows = range(len(self))
+
+        if order == ORDER_MEMORY:
+            primary = self.memory_percents
+        elif order == ORDER_CPU_PERCENT:
+            primary = self.cpu_percents
+        elif order != ORDER_CPU_TIME:
+            raise ValueError("Unknown toplist order: " + str(order))
+        elif any(cpu_time > 0.0 for cpu_time in self.cpu_times):
+            # There is at least one > 0 time in the process list, so sorting by
+            # time will be of some use
+            primary = self.cpu_times
+        else:
+            # No > 0 time in the process list, try CPU percentage as an
+            # approximation of that. This should happen on the first iteration
+            # when ptop has just been launched.
+            primary = self.cpu_percents
+
+        scores = self.scores
+        cmdline_ids = self.cmdline_ids
+        ranks = self._get_cmdline_ranks()
+
+        def key(row):
+            # type: (int) -> Tuple[float, float, int]
+            # UNKNOWN sorts together with zero
+            return (max(primary[row], 0.0), scores[row], -ranks[cmdline_ids[row]])
+
+        if max_count is None:
+            return sorted(rows, key=key, reverse=True)
+        return heapq.nlargest(max_count, rows, key=key)
+
+    def to_processes(self, rows):
+        # type: (Iterable[int]) -> List[px_process.PxProcess]
+        """
+        Returns the processes for the given rows.
+
+        If CPU times or percentages have been adjusted, the affected processes
+        are copies with the adjusted values. The original processes are never
+        changed.
+        """
+        if not self._cpu_times_adjusted and not self._cpu_percents_adjusted:
+            return [self.processes[row] for row in rows]
+
+        processes = []  # type: List[px_process.PxProcess]
+        for row in rows:
+            original = self.processes[row]
+            process = original
+
+            cpu_time = self.cpu_times[row]
+            if cpu_time >= 0.0 and cpu_time != original.cpu_time_seconds:
+                process = copy.copy(original)
+                process.set_cpu_time_seconds(cpu_time)
+
+            cpu_percent = self.cpu_percents[row]
+            if cpu_percent >= 0.0 and cpu_percent != original.cpu_percent:
+                if process is original:
+                    process = copy.copy(original)
+                process.set_cpu_percent(cpu_percent)
+
+            processes.append(process)
+        return processes
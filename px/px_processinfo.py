@@ -1,4 +1,5 @@
 import sys
+import time
 import errno
 import getpass
 import datetime
@@ -6,9 +7,12 @@ import operator
 
 import os
 from . import px_file
+from . import px_file_cache
+from . import px_fdsummary
 from . import px_process
 from . import px_ipc_map
 from . import px_terminal
+from . import px_socket_index
 from . import px_cwdfriends
 from . import px_loginhistory
 
@@ -221,12 +225,56 @@ def print_cwd_friends(fd, process, all_processes, all_files):
         println(fd, "  " + str(friend))
 
 
+def describe_file_cache_age(timestamp, request_time, ttl_seconds, backend):
+    # type: (float, float, float, str) -> text_type
+    """
+    Describe where a file listing from px_file_cache came from.
+
+    request_time is when we asked for the listing. Anything listed before that
+    came from the cache.
+    """
+    if timestamp >= request_time:
+        return "{} done, cached for {:.0f}s, proceeding.".format(backend, ttl_seconds)
+
+    age_seconds = max(0, time.time() - timestamp)
+    return "Using cached {} file list from {:.0f}s ago ({}={:.0f}), proceeding.".format(
+        backend, age_seconds, px_file_cache.TTL_ENVIRONMENT_VARIABLE, ttl_seconds)
+
+
+def to_fd_summary_lines(summary):
+    # type: (px_fdsummary.PxFdSummary) -> List[text_type]
+    if not summary.fd_count:
+        return []
+
+    lines = [
+        "All {} fds by type: ".format(summary.fd_count) + ", ".join(
+            "{} {}".format(count, filetype) for filetype, count in summary.type_counts),
+    ]
+
+    for heading, top_list in [
+            ("Directories with the most fds:", summary.top_directories),
+            ("Sockets with the most fds:", summary.top_sockets),
+            ("Processes with the most pipes to this one:", summary.pipe_peers)]:
+        if not top_list:
+            continue
+        lines.append(heading)
+        for item, count in top_list:
+            lines.append("  {:>5} {}".format(count, item))
+
+    return lines
+
+
 def print_fds(fd, process, processes):
     # type: (int, px_process.PxProcess, Iterable[px_process.PxProcess]) -> None
 
-    # It's true, I measured it myself /johan.walles@gmail.com
-    println(fd, datetime.datetime.now().isoformat() +
-            ": Now invoking lsof, this can take over a minute on a big system...")
+    backend = px_file.get_default_backend()
+    if backend == px_file.BACKEND_LSOF:
+        # It's true, I measured it myself /johan.walles@gmail.com
+        println(fd, datetime.datetime.now().isoformat() +
+                ": Now invoking lsof, this can take over a minute on a big system...")
+    else:
+        println(fd, datetime.datetime.now().isoformat() +
+                ": Now listing open files, this can take a while on a big system...")
 
     # Flush what we have so far so the user has something to read during the pause.
     # This is useful when piping output into a pager like moar or less.
@@ -234,14 +282,26 @@ def print_fds(fd, process, processes):
     # NOTE: If we switch to writing to file-like objects we should flush here,
     # our println() function flushes implicitly.
 
-    files = px_file.get_all()
-    println(fd, datetime.datetime.now().isoformat() + ": lsof done, proceeding.")
+    socket_index = None
+    if backend == px_file.BACKEND_PROC:
+        socket_index = px_socket_index.SocketIndex()
+
+    cache_ttl_seconds = px_file_cache.get_ttl_seconds()
+    if cache_ttl_seconds is None:
+        files = px_file.get_for_process(process.pid, backend, socket_index)
+        println(fd, datetime.datetime.now().isoformat() + ": " + backend + " done, proceeding.")
+    else:
+        t0 = time.time()
+        timestamp, files = px_file_cache.get_all(cache_ttl_seconds, backend, socket_index)
+        println(fd, datetime.datetime.now().isoformat() + ": " +
+                describe_file_cache_age(timestamp, t0, cache_ttl_seconds, backend))
 
     println(fd, "")
     print_cwd_friends(fd, process, processes, files)
 
     is_root = (os.geteuid() == 0)
-    ipc_map = px_ipc_map.IpcMap(process, files, processes, is_root=is_root)
+    ipc_map = px_ipc_map.IpcMap(
+        process, files, processes, is_root=is_root, socket_index=socket_index)
 
     println(fd, "")
     println(fd, "File descriptors:")
@@ -249,15 +309,21 @@ def print_fds(fd, process, processes):
     println(fd, "  stdout: " + ipc_map.fds[1])
     println(fd, "  stderr: " + ipc_map.fds[2])
     # Note that we used to list all FDs here, but some processes (like Chrome)
-    # has silly amounts, making the px output unreadable. Users should consult
-    # lsof directly for the full list.
+    # has silly amounts, making the px output unreadable. Summarize them
+    # instead, users can consult lsof directly for the full list.
+    summary_lines = to_fd_summary_lines(px_fdsummary.PxFdSummary(ipc_map))
+    if summary_lines:
+        println(fd, "")
+    for line in summary_lines:
+        println(fd, "  " + line)
 
     println(fd, "")
     println(fd, "Network connections:")
     # FIXME: Print "nothing found" or something if we don't find anything to put
     # here, maybe with a hint to run as root if we think that would help.
     for connection in sorted(ipc_map.network_connections, key=operator.attrgetter("name")):
-        println(fd, "  " + str(connection))
+        # IpcMap has already waited for these names to resolve
+        println(fd, "  " + connection.describe(resolve_timeout_seconds=0))
 
     println(fd, "")
     println(fd, "Inter Process Communication:")
@@ -266,9 +332,9 @@ def print_fds(fd, process, processes):
 
     println(fd, "")
     lsof = px_terminal.bold("sudo lsof -p {}".format(process.pid))
-    watch_lsof = px_terminal.bold("sudo watch lsof -p {}".format(process.pid))
+    watch = px_terminal.bold("px --watch {}".format(process.pid))
     println(fd, "For a list of all open files, do \"{}\", "
-            "or \"{}\" for a live view.".format(lsof, watch_lsof))
+            "or \"{}\" for a live view.".format(lsof, watch))
 
     if os.getuid() != 0:
         println(fd, "")
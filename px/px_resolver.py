@@ -0,0 +1,231 @@
+"""
+Concurrent, cached reverse DNS lookups.
+
+Looking up the name of an IP address can take seconds, especially when it
+fails. Doing that for one network connection after the other quickly adds up,
+which is why px used to describe only stdin, stdout and stderr.
+
+This module does lookups in a pool of background threads, and remembers both
+successful and failed lookups for a while. Callers can:
+
+* Ask for a name and wait up to a timeout for it to arrive
+* Start lookups for lots of addresses up front and wait for all of them with
+  one shared deadline
+* Ask for whatever is known right now without waiting, and show the raw
+  address until the name shows up
+"""
+
+import time
+import socket
+import logging
+import threading
+import collections
+
+from multiprocessing.pool import ThreadPool
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import Dict      # NOQA
+    from typing import Tuple     # NOQA
+    from typing import Callable  # NOQA
+    from typing import Iterable  # NOQA
+    from typing import Optional  # NOQA
+
+LOG = logging.getLogger(__name__)
+
+# How long to wait for one name to arrive by default
+DEFAULT_TIMEOUT_SECONDS = 2.0
+
+DEFAULT_WORKERS = 8
+
+DEFAULT_CACHE_SIZE = 1024
+
+# How long to remember names and failures. Failures are retried sooner since
+# they can be caused by temporary network problems.
+POSITIVE_TTL_SECONDS = 600.0
+NEGATIVE_TTL_SECONDS = 60.0
+
+
+def gethostbyaddr(address):
+    # type: (str) -> Optional[str]
+    """
+    Looks up the name of an IP address, or returns None if that fails.
+    """
+    try:
+        host = socket.gethostbyaddr(address)[0]
+    except Exception:
+        # Lookup failed for whatever reason, give up
+        return None
+
+    if host == "localhost.localdomain":
+        # "localdomain" is just a long word that doesn't add any information
+        host = "localhost"
+
+    return host
+
+
+class Resolver(object):
+    """
+    Resolves IP addresses into host names in the background.
+
+    Names and failures are kept in an LRU cache of at most cache_size entries.
+    Failures are cached as None.
+    """
+
+    def __init__(self,
+                 workers=DEFAULT_WORKERS,        # type: int
+                 cache_size=DEFAULT_CACHE_SIZE,  # type: int
+                 lookup=gethostbyaddr,           # type: Callable[[str], Optional[str]]
+                 ):
+        # type: (...) -> None
+        self._workers = workers
+        self._cache_size = cache_size
+        self._lookup = lookup
+
+        self._lock = threading.Lock()
+
+        # Address to (name, expiry time). Least recently used first.
+        self._cache = collections.OrderedDict()  # type: Dict[str, Tuple[Optional[str], float]]
+
+        # Address to an event that is set when the lookup is done
+        self._in_flight = {}  # type: Dict[str, threading.Event]
+
+        self._pool = None  # type: Optional[ThreadPool]
+
+    def _get_cached(self, address):
+        # type: (str) -> Tuple[bool, Optional[str]]
+        """
+        Returns a (found, name) tuple. Must be called with self._lock held.
+        """
+        entry = self._cache.pop(address, None)
+        if entry is None:
+            return (False, None)
+
+        name, expiry = entry
+        if time.time() > expiry:
+            return (False, None)
+
+        # Re-insert to mark as most recently used
+        self._cache[address] = entry
+        return (True, name)
+
+    def _store(self, address, name):
+        # type: (str, Optional[str]) -> None
+        ttl_seconds = POSITIVE_TTL_SECONDS if name is not None else NEGATIVE_TTL_SECONDS
+        with self._lock:
+            self._cache.pop(address, None)
+            self._cache[address] = (name, time.time() + ttl_seconds)
+            while len(self._cache) > self._cache_size:
+                # Evict the least recently used entry
+                del self._cache[next(iter(self._cache))]
+
+            self._in_flight.pop(address).set()
+
+    def _resolve_in_background(self, address):
+        # type: (str) -> None
+        name = None  # type: Optional[str]
+        try:
+            name = self._lookup(address)
+        except Exception:
+            LOG.debug("Looking up %s failed", address, exc_info=True)
+        finally:
+            self._store(address, name)
+
+    def _start(self, address):
+        # type: (str) -> Tuple[bool, Optional[str], Optional[threading.Event]]
+        """
+        Returns (found, name, event). If found is False, the lookup is in
+        progress and event will be set when it's done.
+        """
+        with self._lock:
+            found, name = self._get_cached(address)
+            if found:
+                return (True, name, None)
+
+            event = self._in_flight.get(address)
+            if event is not None:
+                return (False, None, event)
+
+            event = threading.Event()
+            self._in_flight[address] = event
+            if self._pool is None:
+                # Pool threads are daemon threads, so hung lookups won't keep
+                # us from exiting
+                self._pool = ThreadPool(self._workers)
+            pool = self._pool
+
+        pool.apply_async(self._resolve_in_background, (address,))
+        return (False, None, event)
+
+    def prefetch(self, addresses):
+        # type: (Iterable[str]) -> None
+        """
+        Start looking up any addresses we don't already know about.
+        """
+        for address in addresses:
+            self._start(address)
+
+    def get(self, address):
+        # type: (str) -> Optional[str]
+        """
+        Returns the name of address if we know it, None otherwise.
+
+        Never waits. If the address isn't known a lookup is started, so that
+        the name will likely be available next time you ask.
+        """
+        return self._start(address)[1]
+
+    def resolve(self, address, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        # type: (str, float) -> Optional[str]
+        """
+        Returns the name of address, or None if the lookup failed or didn't
+        finish within timeout_seconds.
+        """
+        found, name, event = self._start(address)
+        if found:
+            return name
+
+        assert event is not None
+        if timeout_seconds > 0 and event.wait(timeout_seconds):
+            return self._start(address)[1]
+
+        return None
+
+    def wait(self, addresses, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        # type: (Iterable[str], float) -> bool
+        """
+        Looks up all addresses concurrently, and waits for all of them to
+        finish or for timeout_seconds to pass, whichever happens first.
+
+        Returns True if all lookups finished in time.
+        """
+        events = []
+        for address in addresses:
+            event = self._start(address)[2]
+            if event is not None:
+                events.append(event)
+
+        deadline = time.time() + timeout_seconds
+        for event in events:
+            remaining_seconds = deadline - time.time()
+            if remaining_seconds <= 0 or not event.wait(remaining_seconds):
+                return False
+
+        return True
+
+
+_resolver = None  # type: Optional[Resolver]
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    # type: () -> Resolver
+    """
+    Returns the resolver shared by everybody in this px process.
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = Resolver()
+        return _resolver
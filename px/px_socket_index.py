@@ -0,0 +1,292 @@
+"""
+Index of all sockets on the system, by inode.
+
+On Linux, /proc/PID/fd only tells us that an fd is "socket:[12345]". What that
+socket is connected to is listed in the /proc/net/{tcp,tcp6,udp,udp6,unix}
+tables, and for unix domain sockets through the sock_diag netlink interface.
+
+Reading those tables once up front makes finding the other end of a socket a
+couple of dictionary lookups.
+"""
+
+import os
+import errno
+import socket
+import struct
+import collections
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import Dict      # NOQA
+    from typing import Tuple     # NOQA
+    from typing import Iterator  # NOQA
+    from typing import Optional  # NOQA
+
+
+# protocol is one of "tcp", "tcp6", "udp", "udp6" and "unix".
+#
+# For network sockets local and remote are lsof style endpoints, like
+# "127.0.0.1:631", "[::1]:631" or "*:631". remote is None for unconnected
+# sockets, and local is None for unbound ones.
+#
+# For unix domain sockets local is the path the socket is bound to if any, and
+# remote is None.
+#
+# state is the TCP state, like "LISTEN" or "ESTABLISHED", or the socket type
+# for unix domain sockets, like "STREAM". None for UDP.
+SocketInfo = collections.namedtuple(
+    "SocketInfo", ["protocol", "local", "remote", "state"])
+
+# From include/net/tcp_states.h in the Linux kernel
+TCP_STATES = {
+    0x01: "ESTABLISHED",
+    0x02: "SYN_SENT",
+    0x03: "SYN_RECV",
+    0x04: "FIN_WAIT1",
+    0x05: "FIN_WAIT2",
+    0x06: "TIME_WAIT",
+    0x07: "CLOSE",
+    0x08: "CLOSE_WAIT",
+    0x09: "LAST_ACK",
+    0x0A: "LISTEN",
+    0x0B: "CLOSING",
+}
+
+# From include/linux/net.h in the Linux kernel
+UNIX_SOCKET_TYPES = {
+    1: "STREAM",
+    2: "DGRAM",
+    5: "SEQPACKET",
+}
+
+NETWORK_PROTOCOLS = ["tcp", "tcp6", "udp", "udp6"]
+
+# From include/uapi/linux/{netlink,sock_diag,unix_diag}.h
+_NETLINK_SOCK_DIAG = 4
+_SOCK_DIAG_BY_FAMILY = 20
+_NLM_F_REQUEST = 0x01
+_NLM_F_DUMP = 0x300
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_UDIAG_SHOW_PEER = 0x04
+_UNIX_DIAG_PEER = 2
+
+# struct nlmsghdr, struct unix_diag_req and struct unix_diag_msg
+_NLMSGHDR = struct.Struct("=LHHLL")
+_UNIX_DIAG_REQ = struct.Struct("=BBHLLLLL")
+_UNIX_DIAG_MSG = struct.Struct("=BBBBLLL")
+_RTATTR = struct.Struct("=HH")
+_U32 = struct.Struct("=L")
+
+
+def _decode_address(hex_address):
+    # type: (str) -> str
+    """
+    Decodes an address from /proc/net/tcp{,6}.
+
+    The kernel prints addresses as a sequence of 32 bit words in host byte
+    order. "0100007F" is 127.0.0.1 on little endian machines.
+    """
+    if not hex_address.strip("0"):
+        # Any address, this is how lsof says that
+        return "*"
+
+    packed = b"".join(
+        _U32.pack(int(hex_address[i:i + 8], 16)) for i in range(0, len(hex_address), 8))
+    if len(packed) == 4:
+        return socket.inet_ntoa(packed)
+    return "[" + socket.inet_ntop(socket.AF_INET6, packed) + "]"
+
+
+def _decode_endpoint(hex_endpoint):
+    # type: (str) -> Optional[str]
+    """
+    Decodes "0100007F:0277" into "127.0.0.1:631".
+
+    Returns None for the all zeroes endpoint, which is what unconnected sockets
+    have as their remote endpoint.
+    """
+    hex_address, hex_port = hex_endpoint.split(":")
+    port = int(hex_port, 16)
+    if port == 0 and not hex_address.strip("0"):
+        return None
+    return _decode_address(hex_address) + ":" + str(port)
+
+
+def _read_network_table(path, protocol):
+    # type: (str, str) -> Iterator[Tuple[str, SocketInfo]]
+    """
+    Yields (inode, SocketInfo) tuples for the sockets in a /proc/net/tcp style
+    table.
+    """
+    is_tcp = protocol.startswith("tcp")
+    with open(path, "r") as table:
+        # Skip the heading
+        next(table, None)
+
+        for line in table:
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+
+            local = _decode_endpoint(fields[1])
+            remote = _decode_endpoint(fields[2])
+            state = None
+            if is_tcp:
+                state = TCP_STATES.get(int(fields[3], 16))
+            yield (fields[9], SocketInfo(protocol, local, remote, state))
+
+
+def _read_unix_table(path):
+    # type: (str) -> Iterator[Tuple[str, SocketInfo]]
+    """
+    Yields (inode, SocketInfo) tuples for the sockets in /proc/net/unix.
+    """
+    with open(path, "r") as table:
+        # Skip the heading
+        next(table, None)
+
+        for line in table:
+            # The path is optional and may contain spaces
+            fields = line.split(None, 7)
+            if len(fields) < 7:
+                continue
+
+            bound_path = None
+            if len(fields) == 8:
+                bound_path = fields[7].rstrip("\n")
+            state = UNIX_SOCKET_TYPES.get(int(fields[4], 16))
+            yield (fields[6], SocketInfo("unix", bound_path, None, state))
+
+
+def _get_unix_peers():
+    # type: () -> Dict[str, str]
+    """
+    Returns a unix domain socket inode to peer inode mapping.
+
+    This information is only available through the sock_diag netlink
+    interface. If we can't use that for whatever reason, an empty dict is
+    returned.
+    """
+    try:
+        netlink = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, _NETLINK_SOCK_DIAG)
+    except (AttributeError, socket.error, OSError):
+        # Not on Linux, or not allowed
+        return {}
+
+    peers = {}  # type: Dict[str, str]
+    try:
+        request = _UNIX_DIAG_REQ.pack(
+            socket.AF_UNIX, 0, 0,
+            0xffffffff,  # All states
+            0,
+            _UDIAG_SHOW_PEER,
+            0xffffffff, 0xffffffff)
+        netlink.sendto(
+            _NLMSGHDR.pack(
+                _NLMSGHDR.size + len(request),
+                _SOCK_DIAG_BY_FAMILY,
+                _NLM_F_REQUEST | _NLM_F_DUMP,
+                1, 0) + request,
+            (0, 0))
+
+        while True:
+            data = netlink.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                message_length, message_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if message_type == _NLMSG_DONE:
+                    return peers
+                if message_type == _NLMSG_ERROR or message_length < _NLMSGHDR.size:
+                    return peers
+
+                message_start = offset + _NLMSGHDR.size
+                inode = _UNIX_DIAG_MSG.unpack_from(data, message_start)[4]
+
+                # Look for the peer attribute
+                attribute = message_start + _UNIX_DIAG_MSG.size
+                message_end = offset + message_length
+                while attribute + _RTATTR.size <= message_end:
+                    attribute_length, attribute_type = _RTATTR.unpack_from(data, attribute)
+                    if attribute_length < _RTATTR.size:
+                        break
+                    if attribute_type == _UNIX_DIAG_PEER:
+                        peer = _U32.unpack_from(data, attribute + _RTATTR.size)[0]
+                        peers[str(inode)] = str(peer)
+                    attribute += (attribute_length + 3) & ~3
+
+                offset += (message_length + 3) & ~3
+    except (socket.error, OSError, struct.error):
+        # Give up, but keep whatever we got so far
+        return peers
+    finally:
+        netlink.close()
+
+
+class SocketIndex(object):
+    """
+    All sockets on the system, keyed on their inodes.
+
+    Inodes are strings, since that's what PxFile.inode is.
+    """
+
+    def __init__(self, proc="/proc"):
+        # type: (str) -> None
+        self.sockets = {}  # type: Dict[str, SocketInfo]
+
+        for protocol in NETWORK_PROTOCOLS:
+            self._load(_read_network_table(os.path.join(proc, "net", protocol), protocol))
+        self._load(_read_unix_table(os.path.join(proc, "net", "unix")))
+
+        # sock_diag can only tell us about the live system
+        self._unix_peers = {}  # type: Dict[str, str]
+        if self.sockets and proc == "/proc":
+            self._unix_peers = _get_unix_peers()
+
+        # For finding the other end of local network connections
+        self._endpoints_to_inode = {}  # type: Dict[Tuple[str, str, str], str]
+        for inode, info in self.sockets.items():
+            if info.protocol == "unix" or info.local is None or info.remote is None:
+                continue
+            self._endpoints_to_inode[(info.protocol, info.local, info.remote)] = inode
+
+    def _load(self, table):
+        # type: (Iterator[Tuple[str, SocketInfo]]) -> None
+        try:
+            for inode, info in table:
+                if inode == "0":
+                    # Sockets that are going away, in TIME_WAIT for example
+                    continue
+                self.sockets[inode] = info
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ENOENT, errno.EACCES):
+                raise
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.sockets)
+
+    def get(self, inode):
+        # type: (Optional[str]) -> Optional[SocketInfo]
+        if inode is None:
+            return None
+        return self.sockets.get(inode)
+
+    def get_peer_inode(self, inode):
+        # type: (str) -> Optional[str]
+        """
+        Returns the inode of the socket at the other end of the socket with
+        the given inode, or None if the other end isn't on this machine or we
+        don't know where it is.
+        """
+        info = self.sockets.get(inode)
+        if info is None:
+            return None
+
+        if info.protocol == "unix":
+            return self._unix_peers.get(inode)
+
+        if info.local is None or info.remote is None:
+            return None
+        return self._endpoints_to_inode.get((info.protocol, info.remote, info.local))
@@ -6,6 +6,8 @@ import select
 import termios
 import tty
 
+from . import px_process
+
 if sys.version_info.major >= 3:
     # For mypy PEP-484 static typing validation
     from six import text_type    # NOQA
@@ -14,7 +16,6 @@ if sys.version_info.major >= 3:
     from typing import Union     # NOQA
     from typing import Optional  # NOQA
     from typing import Iterable  # NOQA
-    from . import px_process     # NOQA
 
 
 KEY_ESC = "\x1b"
@@ -57,6 +58,15 @@ SIGWINCH_PIPE = os.pipe()
 # NOTE: This must be detected as non-printable by handle_search_keypress().
 SIGWINCH_KEY = u'\x00'
 
+# Used for informing our getch() function that there is new process data to
+# show, see px_poller.
+POLL_COMPLETE_PIPE = os.pipe()
+
+# We'll report new process data as this key having been pressed.
+#
+# NOTE: This must be detected as non-printable by handle_search_keypress().
+POLL_COMPLETE_KEY = u'\x01'
+
 _enable_color = True
 
 def disable_color():
@@ -125,18 +135,24 @@ def read_select(
             raise
 
 
-def getch(timeout_seconds=None, fd=None):
-    # type: (Optional[int], int) -> Optional[ConsumableString]
+def getch(timeout_seconds=None, fd=None, include_poll_pipe=False):
+    # type: (Optional[int], int, bool) -> Optional[ConsumableString]
     """
     Wait at most timeout_seconds for a character to become available on stdin.
 
+    If include_poll_pipe is set, completed background polls are reported as
+    POLL_COMPLETE_KEY. Only ptop wants those, other screens would just redraw
+    for nothing.
+
     Returns the character, or None on timeout.
     """
     if fd is None:
         fd = sys.stdin.fileno()
 
-    can_read_from = (
-        read_select([fd, SIGWINCH_PIPE[0]], timeout_seconds))
+    fds = [fd, SIGWINCH_PIPE[0]]
+    if include_poll_pipe:
+        fds.append(POLL_COMPLETE_PIPE[0])
+    can_read_from = read_select(fds, timeout_seconds)
 
     # Read all(ish) bytes from the first ready-for-read stream. If more than one
     # stream is ready, we'll catch the second one on the next call to this
@@ -210,7 +226,8 @@ def draw_screen_lines(lines, clear=True):
 def to_screen_lines(procs,  # type: List[px_process.PxProcess]
                     columns,  # type: Optional[int]
                     row_to_highlight,  # type: Optional[int]
-                    highlight_heading  # type: Optional[text_type]
+                    highlight_heading,  # type: Optional[text_type]
+                    max_rows=None  # type: Optional[int]
                     ):
     # type: (...) -> List[text_type]
     """
@@ -221,6 +238,10 @@ def to_screen_lines(procs,  # type: List[px_process.PxProcess]
 
     If highligh_heading contains a column name, that column will be highlighted.
     The column name must be from the hard coded list in this function, see below.
+
+    If max_rows is set, only the first max_rows processes are formatted, and
+    column widths are based on those. Which values to highlight is still based
+    on all procs.
     """
 
     headings = [u"PID", u"COMMAND", u"USERNAME", u"CPU", u"CPUTIME", u"RAM", u"COMMANDLINE"]
@@ -228,15 +249,44 @@ def to_screen_lines(procs,  # type: List[px_process.PxProcess]
     if highlight_heading is not None:
         highlight_column = headings.index(highlight_heading)
 
+    visible_procs = procs
+    if max_rows is not None:
+        visible_procs = procs[:max(max_rows, 0)]
+
+    # Find the highest values to highlight them. There can be lots of procs, so
+    # only look at numeric fields here, no string formatting.
+    max_pid = 0
+    max_cpu_percent = 0.0
+    max_memory_percent = 0.0
+    max_cpu_time = 0.0
+    for proc in procs:
+        if proc.pid > max_pid:
+            max_pid = proc.pid
+        if proc.cpu_percent is not None and proc.cpu_percent > max_cpu_percent:
+            max_cpu_percent = proc.cpu_percent
+        if proc.memory_percent is not None and proc.memory_percent > max_memory_percent:
+            max_memory_percent = proc.memory_percent
+        if proc.cpu_time_seconds is not None and proc.cpu_time_seconds > max_cpu_time:
+            max_cpu_time = proc.cpu_time_seconds
+
+    max_cpu_percent_s = None  # type: Optional[text_type]
+    if max_cpu_percent > 0:
+        max_cpu_percent_s = px_process.percent_to_str(max_cpu_percent)
+    max_memory_percent_s = None  # type: Optional[text_type]
+    if max_memory_percent > 0:
+        max_memory_percent_s = px_process.percent_to_str(max_memory_percent)
+    max_cpu_time_s = None  # type: Optional[text_type]
+    if max_cpu_time > 0:
+        max_cpu_time_s = px_process.seconds_to_str(max_cpu_time)
+
     # Compute widest width for pid, command, user, cpu and memory usage columns
-    pid_width = len(headings[0])
+    pid_width = max(len(headings[0]), len(str(max_pid)))
     command_width = len(headings[1])
     username_width = len(headings[2])
     cpu_width = len(headings[3])
     cputime_width = len(headings[4])
     mem_width = len(headings[5])
-    for proc in procs:
-        pid_width = max(pid_width, len(str(proc.pid)))
+    for proc in visible_procs:
         command_width = max(command_width, len(proc.command))
         username_width = max(username_width, len(proc.username))
         cpu_width = max(cpu_width, len(proc.cpu_percent_s))
@@ -277,24 +327,7 @@ def to_screen_lines(procs,  # type: List[px_process.PxProcess]
     heading_line = bold(heading_line)
     lines.append(heading_line)
 
-    max_cpu_percent_s = None  # type: Optional[text_type]
-    max_cpu_percent = 0.0
-    max_memory_percent_s = None  # type: Optional[text_type]
-    max_memory_percent = 0.0
-    max_cpu_time_s = None  # type: Optional[text_type]
-    max_cpu_time = 0.0
-    for proc in procs:
-        if proc.cpu_percent is not None and proc.cpu_percent > max_cpu_percent:
-            max_cpu_percent = proc.cpu_percent
-            max_cpu_percent_s = proc.cpu_percent_s
-        if proc.memory_percent is not None and proc.memory_percent > max_memory_percent:
-            max_memory_percent = proc.memory_percent
-            max_memory_percent_s = proc.memory_percent_s
-        if proc.cpu_time_seconds is not None and proc.cpu_time_seconds > max_cpu_time:
-            max_cpu_time = proc.cpu_time_seconds
-            max_cpu_time_s = proc.cpu_time_s
-
-    for line_number, proc in enumerate(procs):
+    for line_number, proc in enumerate(visible_procs):
         cpu_percent_s = proc.cpu_percent_s
         if proc.cpu_percent_s == "0%":
             cpu_percent_s = faint(cpu_percent_s.rjust(cpu_width))
@@ -324,8 +357,6 @@ def to_screen_lines(procs,  # type: List[px_process.PxProcess]
             cropped = crop_ansi_string_at_length(line, columns)
         lines.append(cropped)
 
-    lines[0] = heading_line
-
     return lines
 
 
@@ -1,16 +1,16 @@
 # coding=utf-8
 
 import sys
-import copy
-import time
 import logging
 import unicodedata
 
 import os
 from . import px_load
 from . import px_process
+from . import px_process_columns
 from . import px_terminal
 from . import px_meminfo
+from . import px_poller
 from . import px_processinfo
 from . import px_launchcounter
 from . import px_process_menu
@@ -51,11 +51,25 @@ last_highlighted_row = 0  # type: int
 # row even if the tow PID moves away.
 highlight_has_moved = False  # type: bool
 
-# When we last polled the system for a process list, in seconds since the Epoch
-last_process_poll = 0.0
+# How to order the top list, cycled through by the user, see get_command()
+SORT_ORDERS = [
+    px_process_columns.ORDER_CPU_TIME,     # CPU usage since ptop was started
+    px_process_columns.ORDER_CPU_PERCENT,  # CPU usage since the last refresh
+    px_process_columns.ORDER_MEMORY,
+]
+sort_order = SORT_ORDERS[0]
 
-# Order top list by memory usage. The opposite is by CPU usage.
-sort_by_memory = False
+SORT_ORDER_HEADINGS = {
+    px_process_columns.ORDER_CPU_PERCENT: u"Top CPU using processes right now",
+    px_process_columns.ORDER_CPU_TIME: u"Top CPU using processes since ptop started",
+    px_process_columns.ORDER_MEMORY: u"Top memory using processes",
+}
+
+SORT_ORDER_HIGHLIGHT_COLUMNS = {
+    px_process_columns.ORDER_CPU_PERCENT: u"CPU",
+    px_process_columns.ORDER_CPU_TIME: u"CPUTIME",
+    px_process_columns.ORDER_MEMORY: u"RAM",
+}
 
 
 def adjust_cpu_times(baseline, current):
@@ -71,88 +85,77 @@ def adjust_cpu_times(baseline, current):
 
     Neither current nor baseline are changed by this function.
     """
-    pid2proc = {}  # type: Dict[int,px_process.PxProcess]
-    for proc in current:
-        pid2proc[proc.pid] = proc
-
-    for baseline_proc in baseline:
-        current_proc = pid2proc.get(baseline_proc.pid)
-        if current_proc is None:
-            # This process is newer than the baseline
-            continue
-
-        if current_proc.start_time != baseline_proc.start_time:
-            # This PID has been reused
-            continue
-
-        if current_proc.cpu_time_seconds is None:
-            # We can't substract from None
-            continue
-
-        if baseline_proc.cpu_time_seconds is None:
-            # We can't substract None
-            continue
-
-        current_proc = copy.copy(current_proc)
-        if current_proc.cpu_time_seconds and baseline_proc.cpu_time_seconds:
-            current_proc.set_cpu_time_seconds(
-                current_proc.cpu_time_seconds - baseline_proc.cpu_time_seconds)
-        pid2proc[current_proc.pid] = current_proc
-
-    return list(pid2proc.values())
-
-
-def get_notnone_cpu_time_seconds(proc):
-    # type: (px_process.PxProcess) -> float
-    seconds = proc.cpu_time_seconds
-    if seconds is not None:
-        return seconds
-    return 0
-
-
-def get_notnone_memory_percent(proc):
-    # type: (px_process.PxProcess) -> float
-    percent = proc.memory_percent
-    if percent is not None:
-        return percent
-    return 0
-
-
-def sort_by_cpu_usage(toplist):
-    # type(List[px_process.PxProcess]) -> List[px_process.PxProcess]
-    can_sort_by_time = False
-    for process in toplist:
-        if process.cpu_time_seconds:
-            can_sort_by_time = True
-            break
+    columns = px_process_columns.PxProcessColumns(current)
+    columns.subtract_cpu_times(px_process_columns.PxProcessColumns(baseline))
+    return columns.to_processes(range(len(columns)))
+
+
+def get_toplist(baseline,  # type: Union[px_process_columns.PxProcessColumns, List[px_process.PxProcess]]
+                current,   # type: List[px_process.PxProcess]
+                order=px_process_columns.ORDER_CPU_TIME,  # type: str
+                search=None,      # type: Optional[text_type]
+                max_count=None,   # type: Optional[int]
+                previous=None,    # type: Optional[px_process_columns.PxProcessColumns]
+                ):
+    # type: (...) -> List[px_process.PxProcess]
+    """
+    Returns current ordered for display, with CPU times counted from baseline.
+
+    Pass baseline as PxProcessColumns if you are going to reuse it, that saves
+    converting it on every call.
+
+    If previous is set, CPU percentages are computed over the time since that
+    snapshot, rather than over each process' lifetime.
 
-    if can_sort_by_time:
-        # There is at least one > 0 time in the process list, so sorting by time
-        # will be of some use
-        return sorted(toplist, key=get_notnone_cpu_time_seconds, reverse=True)
+    If search is set, only matching processes are returned. If max_count is
+    set, at most that many processes are returned, and only those get
+    materialized.
 
-    # No > 0 time in the process list, try CPU percentage as an approximation of
-    # that. This should happen on the first iteration when ptop has just been
-    # launched.
-    return sorted(toplist, key=lambda process: process.cpu_percent or 0, reverse=True)
+    To get several toplists from the same snapshot, use get_columns() once
+    and then get_toplist_from_columns() for each toplist.
+    """
+    if not isinstance(baseline, px_process_columns.PxProcessColumns):
+        baseline = px_process_columns.PxProcessColumns(baseline)
+
+    return get_toplist_from_columns(
+        get_columns(baseline, current, previous), order, search, max_count)
 
 
-def get_toplist(baseline,  # type: List[px_process.PxProcess]
+def get_columns(baseline,  # type: px_process_columns.PxProcessColumns
                 current,   # type: List[px_process.PxProcess]
-                by_memory=False  # type: bool
+                previous=None,  # type: Optional[px_process_columns.PxProcessColumns]
                 ):
-    # type(...) -> List[px_process.PxProcess]
-    toplist = adjust_cpu_times(baseline, current)
+    # type: (...) -> px_process_columns.PxProcessColumns
+    """
+    Converts current into columns for get_toplist_from_columns(), with CPU
+    times counted from baseline. See get_toplist() for what previous does.
 
-    # Sort by interestingness last
-    toplist = px_process.order_best_first(toplist)
-    if by_memory:
-        toplist = sorted(toplist, key=get_notnone_memory_percent, reverse=True)
-    else:
-        # By CPU time, this is the default
-        toplist = sort_by_cpu_usage(toplist)
+    The returned columns can be passed as previous for the next snapshot.
+    """
+    columns = px_process_columns.PxProcessColumns(current)
+    if previous is not None:
+        columns.set_recent_cpu_percents(previous)
+    columns.subtract_cpu_times(baseline)
+    return columns
+
+
+def get_toplist_from_columns(columns,  # type: px_process_columns.PxProcessColumns
+                             order=px_process_columns.ORDER_CPU_TIME,  # type: str
+                             search=None,     # type: Optional[text_type]
+                             max_count=None,  # type: Optional[int]
+                             ):
+    # type: (...) -> List[px_process.PxProcess]
+    """
+    Like get_toplist(), but for columns from get_columns().
+    """
+    rows = None  # type: Optional[List[int]]
+    if search is not None:
+        # Note that we accept partial user name match, otherwise incrementally typing
+        # a username becomes weird for the ptop user
+        rows = [row for row, process in enumerate(columns.processes)
+                if process.match(search, require_exact_user=False)]
 
-    return toplist
+    return columns.to_processes(columns.get_toplist_rows(order, rows, max_count))
 
 
 def writebytes(bytestring):
@@ -210,13 +213,13 @@ def get_screen_lines(
     columns,   # type: int
     include_footer=True,  # type: bool
     search=None,  # type: Optional[text_type]
+    refresh_interval_seconds=None,  # type: Optional[float]
 ):
     # type: (...) -> List[text_type]
-
-    if search is not None:
-        # Note that we accept partial user name match, otherwise incrementally typing
-        # a username becomes weird for the ptop user
-        toplist = list(filter(lambda p: p.match(search, require_exact_user=False), toplist))
+    """
+    toplist must already be filtered by search, like get_toplist() does.
+    search is only used for showing the search prompt.
+    """
 
     # Hand out different amount of lines to the different sections
     header_height = 3  # System load, RAM load, empty line
@@ -268,23 +271,18 @@ def get_screen_lines(
     if top_mode == MODE_SEARCH:
         highlight_row = None
 
-    highlight_column = u"CPUTIME"
-    if sort_by_memory:
-        highlight_column = u"RAM"
-    toplist_table_lines = \
-        px_terminal.to_screen_lines(toplist, columns, highlight_row, highlight_column)
+    highlight_column = SORT_ORDER_HIGHLIGHT_COLUMNS[sort_order]
+    toplist_table_lines = px_terminal.to_screen_lines(
+        toplist, columns, highlight_row, highlight_column, max_rows=max_process_count)
 
     # Ensure that we cover the whole screen, even if it's higher than the
     # number of processes
     toplist_table_lines += rows * ['']
 
-    top_what = "CPU"
-    if sort_by_memory:
-        top_what = "memory"
-    lines += [
-        px_terminal.crop_ansi_string_at_length(
-            px_terminal.bold("Top " + top_what + " using processes"), columns)
-    ]
+    heading = px_terminal.bold(SORT_ORDER_HEADINGS[sort_order])
+    if refresh_interval_seconds is not None:
+        heading += ", refreshed every {:.1f}s".format(refresh_interval_seconds)
+    lines += [px_terminal.crop_ansi_string_at_length(heading, columns)]
 
     if top_mode == MODE_SEARCH:
         lines += [SEARCH_PROMPT_ACTIVE + px_terminal.bold(search or "") + SEARCH_CURSOR]
@@ -313,7 +311,8 @@ def redraw(
     rows,      # type: int
     columns,   # type: int
     clear=True,  # type: bool
-    include_footer=True  # type: bool
+    include_footer=True,  # type: bool
+    refresh_interval_seconds=None,  # type: Optional[float]
 ):
     # type: (...) -> None
     """
@@ -324,7 +323,8 @@ def redraw(
     global search_string
     lines = get_screen_lines(
         toplist, launchcounter, rows, columns, include_footer,
-        search=search_string)
+        search=search_string,
+        refresh_interval_seconds=refresh_interval_seconds)
 
     px_terminal.draw_screen_lines(lines, clear)
 
@@ -382,11 +382,13 @@ def handle_search_keypresses(key_sequence):
     search_string += key_sequence._string
 
 
-def get_command(**kwargs):
+def get_command(poller=None, **kwargs):
     """
     Call getch() and interpret the results.
+
+    If poller is set, that's where we look up the process to show a menu for.
     """
-    input = px_terminal.getch(**kwargs)
+    input = px_terminal.getch(include_poll_pipe=True, **kwargs)
     if input is None:
         return None
     assert len(input) > 0
@@ -398,7 +400,7 @@ def get_command(**kwargs):
 
     global last_highlighted_row
     global last_highlighted_pid
-    global sort_by_memory
+    global sort_order
     while len(input) > 0:
         if input.consume(px_terminal.KEY_UPARROW):
             last_highlighted_row -= 1
@@ -407,9 +409,13 @@ def get_command(**kwargs):
             last_highlighted_row += 1
             last_highlighted_pid = None
         elif input.consume(px_terminal.KEY_ENTER):
-            if last_highlighted_pid is None:
+            if last_highlighted_pid is None or poller is None:
+                continue
+            # Listing processes can take a while, use the poller's latest
+            # snapshot rather than making the user wait for a new one
+            processes = poller.get_all_processes()
+            if processes is None:
                 continue
-            processes = px_process.get_all()
             process = px_processinfo.find_process_by_pid(last_highlighted_pid, processes)
             if not process:
                 continue
@@ -419,7 +425,7 @@ def get_command(**kwargs):
             top_mode = MODE_SEARCH
             return None
         elif input.consume(u'm') or input.consume(u'M'):
-            sort_by_memory = not sort_by_memory
+            sort_order = SORT_ORDERS[(SORT_ORDERS.index(sort_order) + 1) % len(SORT_ORDERS)]
         elif input.consume(u'q'):
             return CMD_QUIT
         elif input.consume(px_terminal.SIGWINCH_KEY):
@@ -437,17 +443,52 @@ def _top(search=""):
     global search_string
     search_string = search
 
-    baseline = px_process.get_all()
-    current = baseline
+    # Note that the baseline isn't from the poller; the poller's snapshotter
+    # has to build all processes on its first run anyway.
+    current = px_process.get_all()
+    baseline = px_process_columns.PxProcessColumns(current)
+
+    # Collect new process lists in the background, so that keypresses never
+    # have to wait for a poll to finish
+    poller = px_poller.PxPoller(
+        px_terminal.POLL_COMPLETE_PIPE[1],
+        px_poller.PollScheduler(cpu_budget=px_poller.get_cpu_budget()))
+    poller.start()
+    try:
+        _top_loop(baseline, current, poller)
+    finally:
+        poller.stop()
+
+
+def _top_loop(baseline,  # type: px_process_columns.PxProcessColumns
+              current,   # type: List[px_process.PxProcess]
+              poller,    # type: px_poller.PxPoller
+              ):
+    # type: (...) -> None
     launchcounter = px_launchcounter.Launchcounter()
+    launchcounter.update(current)
+
+    # Converted once per snapshot, not once per redraw. Each snapshot's
+    # columns are the previous ones for the next snapshot, for computing
+    # recent CPU usage.
+    current_columns = get_columns(baseline, current)
     while True:
-        launchcounter.update(current)
+        latest = poller.get_all_processes()
+        if latest is not None and latest is not current:
+            current = latest
+            current_columns = get_columns(baseline, current, current_columns)
+            launchcounter.update(current)
+
         rows, columns = px_terminal.get_window_size()
-        global sort_by_memory
-        toplist = get_toplist(baseline, current, sort_by_memory)
-        redraw(toplist, launchcounter, rows, columns)
+        # There will never be more processes on screen than there are rows
+        toplist = get_toplist_from_columns(current_columns, sort_order, search_string, rows)
+        refresh_interval_seconds = poller.get_refresh_interval_seconds()
+        redraw(toplist, launchcounter, rows, columns,
+               refresh_interval_seconds=refresh_interval_seconds)
 
-        command = get_command(timeout_seconds=1)
+        # No timeout, new process lists from the poller wake us up. Not
+        # redrawing when nothing has happened saves CPU.
+        command = get_command(poller=poller, timeout_seconds=None)
 
         # Handle all keypresses before refreshing the display
         while command is not None:
@@ -455,18 +496,11 @@ def _top(search=""):
                 # The idea here is that if you terminate with "q" you still
                 # probably want the heading line on screen. So just do another
                 # update with somewhat fewer lines, and you'll get just that.
-                redraw(toplist, launchcounter, rows - 4, columns, include_footer=False)
+                redraw(toplist, launchcounter, rows - 4, columns, include_footer=False,
+                       refresh_interval_seconds=refresh_interval_seconds)
                 return
 
-            command = get_command(timeout_seconds=0)
-
-        # For interactivity reasons, don't do this too often
-        global last_process_poll
-        now = time.time()
-        delta_seconds = now - last_process_poll
-        if delta_seconds >= 0.8:
-            current = px_process.get_all()
-            last_process_poll = now
+            command = get_command(poller=poller, timeout_seconds=0)
 
 
 def top(search=""):
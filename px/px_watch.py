@@ -0,0 +1,286 @@
+"""
+Live view of one process' open files and IPC peers, for "px --watch PID".
+
+Rather than listing all open files on every refresh like "watch lsof -p PID"
+would, we keep an IpcGraph in memory and only apply what has changed:
+
+* The watched process' own files are listed on every refresh. This is cheap,
+  it's just one process.
+* Peer files, the other ends of our pipes and sockets, are only looked up for
+  fds that are new since the last refresh.
+* Peer files of closed fds, and of processes that have exited, are dropped.
+* With the /proc backend, the socket index is only reloaded when our fds
+  change.
+
+To pick up things the incremental updates can't see, like a new process
+inheriting the other end of one of our pipes, all peer files are looked up
+again, with a fresh socket index, every FULL_REFRESH_SECONDS.
+"""
+
+import os
+import sys
+import time
+import datetime
+import operator
+
+from . import px_file
+from . import px_process
+from . import px_terminal
+from . import px_ipc_map
+from . import px_processinfo
+from . import px_socket_index
+
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import Set       # NOQA
+    from typing import Dict      # NOQA
+    from typing import List      # NOQA
+    from typing import Iterable  # NOQA
+    from typing import Optional  # NOQA
+    from six import text_type    # NOQA
+
+REFRESH_INTERVAL_SECONDS = 1
+
+# How often to look up all peer files, not just the ones of new fds
+FULL_REFRESH_SECONDS = 10.0
+
+
+def _get_ipc_files(files):
+    # type: (Iterable[px_file.PxFile]) -> Set[px_file.PxFile]
+    return set(file for file in files if file.type in px_ipc_map.FILE_TYPES)
+
+
+class PxWatcher(object):
+    """
+    Keeps the IpcGraph of one process up to date.
+
+    Call refresh() to re-scan, then look at ipc_map, fds and closed_fds to
+    find out what the process has open now and what has changed.
+    """
+
+    def __init__(self, process, backend=None):
+        # type: (px_process.PxProcess, Optional[str]) -> None
+        if backend is None:
+            backend = px_file.get_default_backend()
+        self.process = process
+        self._backend = backend
+        self._is_root = (os.geteuid() == 0)
+
+        self._processes = [process]  # type: List[px_process.PxProcess]
+        self._graph = px_ipc_map.IpcGraph([], self._processes)
+        self._own_files = set()  # type: Set[px_file.PxFile]
+
+        # Peer file to the own files it was looked up for. Peer files are
+        # looked up for a batch of own files at a time, and are kept until all
+        # own files of that batch have been closed.
+        self._peer_files = {}  # type: Dict[px_file.PxFile, Set[px_file.PxFile]]
+        self._last_full_refresh = None  # type: Optional[float]
+
+        # Only used with the /proc backend, see refresh()
+        self._socket_index = None  # type: Optional[px_socket_index.SocketIndex]
+
+        self.ipc_map = None  # type: Optional[px_ipc_map.IpcMap]
+        self.alive = True
+
+        # FD number to description, as of the last refresh
+        self.fds = {}  # type: Dict[int, str]
+        self._open_fds = set()  # type: Set[int]
+
+        # FDs that are new or changed since the refresh before the last one
+        self.changed_fds = set()  # type: Set[int]
+
+        # FDs that were closed since the refresh before the last one, with
+        # their descriptions from before they were closed
+        self.closed_fds = {}  # type: Dict[int, str]
+
+        self.refresh_seconds = 0.0
+
+    def _get_peer_files(self, ipc_files, socket_index):
+        # type: (Set[px_file.PxFile], Optional[px_socket_index.SocketIndex]) -> Dict[px_file.PxFile, Set[px_file.PxFile]]
+        """
+        Maps the peer files of ipc_files to the ipc_files they were looked
+        up for.
+        """
+        if not ipc_files:
+            return {}
+        peer_files = px_file.get_peer_files(
+            self.process.pid, ipc_files, self._backend, socket_index)
+        return dict((peer_file, set(ipc_files)) for peer_file in peer_files)
+
+    def _update_peer_files(self, added, removed, socket_index, full_refresh):
+        # type: (Set[px_file.PxFile], Set[px_file.PxFile], Optional[px_socket_index.SocketIndex], bool) -> None
+        if full_refresh:
+            self._peer_files = self._get_peer_files(
+                _get_ipc_files(self._own_files), socket_index)
+            return
+
+        for peer_file, wanted_by in self._get_peer_files(
+                _get_ipc_files(added), socket_index).items():
+            self._peer_files.setdefault(peer_file, set()).update(wanted_by)
+
+        alive = {}  # type: Dict[int, bool]
+        for peer_file, wanted_by in list(self._peer_files.items()):
+            wanted_by.difference_update(removed)
+            if peer_file.pid not in alive:
+                alive[peer_file.pid] = px_process.pid_is_alive(peer_file.pid)
+            if not wanted_by or not alive[peer_file.pid]:
+                del self._peer_files[peer_file]
+
+    def _update_processes(self):
+        # type: () -> Optional[List[px_process.PxProcess]]
+        """
+        Returns a new process listing if we have peers we don't know the names
+        of, None otherwise.
+        """
+        known_pids = set(process.pid for process in self._processes)
+        for peer_file in self._peer_files:
+            if peer_file.pid not in known_pids:
+                self._processes = px_process.get_all()
+                return self._processes
+        return None
+
+    def refresh(self):
+        # type: () -> None
+        t0 = time.time()
+
+        full_refresh = self._last_full_refresh is None or \
+            t0 - self._last_full_refresh >= FULL_REFRESH_SECONDS
+        if full_refresh:
+            self._last_full_refresh = t0
+
+        # Loading a socket index means reading all of /proc/net, so we keep
+        # the one we have as long as our fds stay the same
+        use_proc = self._backend == px_file.BACKEND_PROC
+        if use_proc and full_refresh:
+            self._socket_index = px_socket_index.SocketIndex()
+        own_files = px_file.get_own_files(self.process.pid, self._backend, self._socket_index)
+        if use_proc and not full_refresh and own_files != self._own_files:
+            # New sockets would be missing from our old index
+            self._socket_index = px_socket_index.SocketIndex()
+            own_files = px_file.get_own_files(
+                self.process.pid, self._backend, self._socket_index)
+        socket_index = self._socket_index
+
+        if not own_files and not self.process.is_alive():
+            self.alive = False
+
+        added = own_files - self._own_files
+        removed = self._own_files - own_files
+        self._own_files = own_files
+
+        files_before = set(self._peer_files)
+        files_before.update(removed)
+        files_before.update(own_files - added)
+
+        self._update_peer_files(added, removed, socket_index, full_refresh)
+
+        files_after = set(self._peer_files)
+        files_after.update(own_files)
+
+        self._graph.update(
+            files_after - files_before,
+            files_before - files_after,
+            socket_index=socket_index,
+            processes=self._update_processes())
+
+        self.ipc_map = px_ipc_map.IpcMap(
+            self.process, [], self._processes, self._is_root, ipc_graph=self._graph)
+
+        # Note that fds 0, 1 and 2 are always in ipc_map.fds, even if closed
+        previous_fds = self.fds
+        previous_open_fds = self._open_fds
+        self._open_fds = set(file.fd for file in self.ipc_map.own_files if file.fd is not None)
+        self.fds = self.ipc_map.fds if self.alive else {}
+        self.changed_fds = set(
+            fd for fd in self._open_fds
+            if previous_fds and previous_fds.get(fd) != self.fds[fd])
+        self.closed_fds = dict(
+            (fd, previous_fds[fd]) for fd in previous_open_fds
+            if fd not in self._open_fds)
+
+        self.refresh_seconds = time.time() - t0
+
+
+def to_screen_lines(watcher):
+    # type: (PxWatcher) -> List[text_type]
+    heading = px_terminal.bold(str(watcher.process))
+    if not watcher.alive:
+        heading += " " + px_terminal.red("exited")
+    lines = [
+        heading + "  " + px_terminal.faint(
+            "{}, {}ms. Press q to quit.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"),
+                int(watcher.refresh_seconds * 1000))),
+        "",
+        "File descriptors:",
+    ]
+
+    fd_lines = []  # type: List[text_type]
+    for fd in sorted(set(watcher.fds.keys()).union(watcher.closed_fds.keys())):
+        if fd in watcher.closed_fds:
+            fd_lines.append(px_terminal.red(
+                "  {:>5}: {} (closed)".format(fd, watcher.closed_fds[fd])))
+            continue
+
+        line = "  {:>5}: {}".format(fd, watcher.fds[fd])
+        if fd in watcher.changed_fds:
+            line = px_terminal.green(line)
+        fd_lines.append(line)
+    lines += fd_lines
+
+    ipc_map = watcher.ipc_map
+    if ipc_map is None or not watcher.alive:
+        return lines
+
+    lines.append("")
+    lines.append("Network connections:")
+    for connection in sorted(ipc_map.network_connections, key=operator.attrgetter("name")):
+        lines.append("  " + connection.describe(resolve_timeout_seconds=0))
+
+    lines.append("")
+    lines.append("Inter Process Communication:")
+    for line in px_processinfo.to_ipc_lines(ipc_map):
+        lines.append("  " + line)
+
+    return lines
+
+
+def redraw(watcher):
+    # type: (PxWatcher) -> None
+    rows, columns = px_terminal.get_window_size()
+    lines = to_screen_lines(watcher)[:rows]
+    px_terminal.draw_screen_lines(
+        [px_terminal.crop_ansi_string_at_length(line, columns) for line in lines])
+
+
+def _watch_loop(watcher):
+    # type: (PxWatcher) -> None
+    while True:
+        if watcher.alive:
+            watcher.refresh()
+        redraw(watcher)
+
+        # Window resizes and other keypresses just make us refresh early
+        input = px_terminal.getch(timeout_seconds=REFRESH_INTERVAL_SECONDS)
+        if input is not None and input.consume(u'q'):
+            return
+
+
+def watch(pid):
+    # type: (int) -> None
+    if not sys.stdout.isatty():
+        sys.stderr.write('Watch mode only works on TTYs, try running just "px {}" instead.\n'
+                         .format(pid))
+        exit(1)
+
+    process = px_processinfo.find_process_by_pid(pid, px_process.get_all())
+    if not process:
+        sys.stderr.write("No such PID: {}\n".format(pid))
+        exit(1)
+
+    watcher = PxWatcher(process)
+
+    # Exceptions propagate to px.main(), which reports them and exits with an
+    # error once we have left fullscreen mode
+    with px_terminal.fullscreen_display():
+        _watch_loop(watcher)
@@ -18,3 +18,45 @@ def test_exec_false_with_check():
     except subprocess.CalledProcessError:
         # This is the exception we want, done!
         pass
+
+
+def test_kill_all():
+    sleeper = subprocess.Popen(["sleep", "10"])
+    px_exec_util.register_killable(sleeper)
+    unrelated = subprocess.Popen(["sleep", "10"])
+    try:
+        px_exec_util.kill_all()
+        assert sleeper.wait() != 0
+        assert px_exec_util.unregister_killable(sleeper)
+
+        # Not registered, should still be running
+        assert unrelated.poll() is None
+
+        # Nothing registered any more, this should be a no-op
+        px_exec_util.kill_all()
+    finally:
+        px_exec_util.reset_kill_all()
+        unrelated.kill()
+        unrelated.wait()
+
+
+def test_kill_all_kills_later_processes():
+    px_exec_util.kill_all()
+    try:
+        # Started after kill_all(), should be killed on registration
+        late = subprocess.Popen(["sleep", "10"])
+        px_exec_util.register_killable(late)
+        assert late.wait() != 0
+        assert px_exec_util.unregister_killable(late)
+    finally:
+        px_exec_util.reset_kill_all()
+
+    # After resetting, new processes should be left alone
+    sleeper = subprocess.Popen(["sleep", "10"])
+    try:
+        px_exec_util.register_killable(sleeper)
+        assert sleeper.poll() is None
+        assert not px_exec_util.unregister_killable(sleeper)
+    finally:
+        sleeper.kill()
+        sleeper.wait()
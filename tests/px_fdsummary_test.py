@@ -0,0 +1,49 @@
+from px import px_fdsummary
+from px import px_processinfo
+
+from . import testutils
+
+
+def test_fd_summary():
+    files = [
+        testutils.create_file("REG", "/usr/lib/libc.so", None, 1234, fd=3),
+        testutils.create_file("REG", "/usr/lib/libm.so", None, 1234, fd=4),
+        testutils.create_file("REG", "/var/log/syslog", None, 1234, fd=5),
+        testutils.create_file("DIR", "/usr/lib", None, 1234, fd=6),
+        testutils.create_file("unix", "/run/some.sock type=STREAM", None, 1234, fd=7),
+        testutils.create_file("unix", "/run/some.sock type=STREAM", None, 1234, fd=8),
+        testutils.create_file("unix", "->0x1234", None, 1234, fd=9),
+        testutils.create_file("IPv4", "*:8080", None, 1234, fd=10),
+
+        # Pipes to cupsd
+        testutils.create_file("FIFO", "pipe", None, 1234, access="w", inode="17", fd=0),
+        testutils.create_file("FIFO", "pipe", None, 1000, access="r", inode="17", fd=0),
+        testutils.create_file("FIFO", "pipe", None, 1234, access="r", inode="18", fd=11),
+        testutils.create_file("FIFO", "pipe", None, 1000, access="w", inode="18", fd=1),
+
+        # Not ours, and without an fd
+        testutils.create_file("REG", "/somewhere/else", None, 1000, fd=3),
+        testutils.create_file("DIR", "/", None, 1234, fdtype="cwd"),
+    ]
+
+    ipc_map = testutils.create_ipc_map(1234, files)
+    summary = px_fdsummary.PxFdSummary(ipc_map, top_count=2)
+
+    assert summary.fd_count == 10
+    assert summary.type_counts == [("REG", 3), ("unix", 3), ("FIFO", 2), ("DIR", 1), ("IPv4", 1)]
+    assert summary.top_directories == [("/usr/lib", 3), ("/var/log", 1)]
+    assert summary.top_sockets == [("[unix] /run/some.sock", 2), ("[IPv4] *:8080 (LISTEN)", 1)]
+    assert summary.pipe_peers == [("cupsd(1000)", 2)]
+
+    lines = px_processinfo.to_fd_summary_lines(summary)
+    assert lines[0] == "All 10 fds by type: 3 REG, 3 unix, 2 FIFO, 1 DIR, 1 IPv4"
+    assert lines[-2] == "Processes with the most pipes to this one:"
+    assert lines[-1] == "      2 cupsd(1000)"
+
+
+def test_fd_summary_no_files():
+    ipc_map = testutils.create_ipc_map(1234, [])
+    summary = px_fdsummary.PxFdSummary(ipc_map)
+
+    assert summary.fd_count == 0
+    assert px_processinfo.to_fd_summary_lines(summary) == []
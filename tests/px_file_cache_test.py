@@ -0,0 +1,123 @@
+import time
+import threading
+
+from px import px_file
+from px import px_file_cache
+
+from . import testutils
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import List  # NOQA
+
+
+def _create_files():
+    return set([
+        testutils.create_file("REG", "/tmp/a file", "0x1234", 100,
+                              access="rw", inode="4711", fd=3, fdtype=None),
+        testutils.create_file("FIFO", "pipe", None, 101, access="r", inode="17", fd=0),
+        testutils.create_file("DIR", "/", None, 101, fdtype="cwd"),
+    ])
+
+
+def _fake_get_all(monkeypatch, files, delay_seconds=0.0):
+    calls = []  # type: List[str]
+
+    def get_all(backend=None, socket_index=None, workers=None):
+        calls.append(backend)
+        time.sleep(delay_seconds)
+        return set(files)
+
+    monkeypatch.setattr(px_file, "get_all", get_all)
+    return calls
+
+
+def test_serialize_roundtrip():
+    files = _create_files()
+    backend, timestamp, loaded = px_file_cache._deserialize(
+        px_file_cache._serialize("lsof", 1234.5, files))
+
+    assert backend == "lsof"
+    assert timestamp == 1234.5
+    assert loaded == files
+
+
+def test_get_all_reuses_listing(tmpdir, monkeypatch):
+    files = _create_files()
+    calls = _fake_get_all(monkeypatch, files)
+    path = str(tmpdir.join("cache", "files.cache"))
+
+    t0 = time.time()
+    timestamp1, files1 = px_file_cache.get_all(60, "lsof", path=path)
+    timestamp2, files2 = px_file_cache.get_all(60, "lsof", path=path)
+
+    assert calls == ["lsof"]
+    assert files1 == files
+    assert files2 == files
+    assert timestamp1 >= t0
+    assert timestamp2 == timestamp1
+
+
+def test_get_all_expired(tmpdir, monkeypatch):
+    calls = _fake_get_all(monkeypatch, _create_files())
+    path = str(tmpdir.join("files.cache"))
+
+    px_file_cache.get_all(60, "lsof", path=path)
+    px_file_cache._write(path, "lsof", time.time() - 61, _create_files())
+    px_file_cache.get_all(60, "lsof", path=path)
+
+    assert calls == ["lsof", "lsof"]
+
+
+def test_get_all_other_backend(tmpdir, monkeypatch):
+    calls = _fake_get_all(monkeypatch, _create_files())
+    path = str(tmpdir.join("files.cache"))
+
+    px_file_cache.get_all(60, "lsof", path=path)
+    px_file_cache.get_all(60, "proc", path=path)
+
+    assert calls == ["lsof", "proc"]
+
+
+def test_get_all_broken_cache(tmpdir, monkeypatch):
+    files = _create_files()
+    calls = _fake_get_all(monkeypatch, files)
+    cache = tmpdir.join("files.cache")
+    cache.write("This is not a px file cache")
+
+    timestamp, loaded = px_file_cache.get_all(60, "lsof", path=str(cache))
+
+    assert calls == ["lsof"]
+    assert loaded == files
+
+
+def test_get_all_concurrent(tmpdir, monkeypatch):
+    # All threads should share one refresh
+    calls = _fake_get_all(monkeypatch, _create_files(), delay_seconds=0.2)
+    path = str(tmpdir.join("files.cache"))
+
+    threads = [
+        threading.Thread(target=px_file_cache.get_all, args=(60, "lsof", None, path))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["lsof"]
+
+
+def test_get_ttl_seconds(monkeypatch):
+    monkeypatch.delenv(px_file_cache.TTL_ENVIRONMENT_VARIABLE, raising=False)
+    assert px_file_cache.get_ttl_seconds() is None
+
+    monkeypatch.setenv(px_file_cache.TTL_ENVIRONMENT_VARIABLE, "30")
+    assert px_file_cache.get_ttl_seconds() == 30
+
+    monkeypatch.setenv(px_file_cache.TTL_ENVIRONMENT_VARIABLE, "0")
+    assert px_file_cache.get_ttl_seconds() is None
+
+    monkeypatch.setenv(px_file_cache.TTL_ENVIRONMENT_VARIABLE, "soon")
+    assert px_file_cache.get_ttl_seconds() is None
@@ -1,7 +1,14 @@
+import os
 import re
 import sys
+import subprocess
 
 from px import px_file
+from px import px_ipc_map
+from px import px_exec_util
+from px import px_socket_index
+
+from . import testutils
 
 if sys.version_info.major >= 3:
     # For mypy PEP-484 static typing validation
@@ -64,6 +71,90 @@ def test_lsof_to_files():
     assert str(files[4]) == "[??] (revoked)"
 
 
+def test_lsof_to_files_dedup():
+    lsof = ""
+    lsof += '\0'.join(["p123", "\n"])
+    lsof += '\0'.join(["f5", "ar", "tREG", "i42", "n/somefile", "\n"])
+
+    # Same file, as seen from another thread of the same process
+    lsof += '\0'.join(["f5", "ar", "tREG", "i42", "n/somefile", "\n"])
+
+    lsof += '\0'.join(["p456", "\n"])
+    lsof += '\0'.join(["f5", "ar", "tREG", "i42", "n/somefile", "\n"])
+
+    files = px_file.lsof_to_files(lsof)
+    assert [file.pid for file in files] == [123, 456]
+
+    # Repeated low cardinality strings should be shared
+    assert files[0].type is files[1].type
+
+
+def test_lsof_to_files_intern_limit(monkeypatch):
+    monkeypatch.setattr(px_file, "_MAX_INTERNED_STRINGS", 2)
+
+    lsof = ""
+    for pid in range(10):
+        lsof += '\0'.join(["p" + str(pid), "\n"])
+        lsof += '\0'.join(["f5", "ar", "tREG", "d0x" + str(pid), "n/somefile", "\n"])
+
+    files = px_file.lsof_to_files(lsof)
+    assert [file.pid for file in files] == list(range(10))
+    assert [file.device for file in files] == ["0x" + str(pid) for pid in range(10)]
+
+    # Slotted, no __dict__
+    assert not hasattr(files[0], "__dict__")
+
+
+def test_iter_lsof_killed():
+    files = px_file._iter_lsof()
+    next(files)
+
+    px_exec_util.kill_all()
+    try:
+        for file in files:
+            pass
+        assert False and "We should never get here"
+    except px_exec_util.KilledError:
+        # This is the exception we want, done!
+        pass
+    finally:
+        px_exec_util.reset_kill_all()
+
+
+def test_iter_lsof_started_after_kill_all():
+    px_exec_util.kill_all()
+    try:
+        for file in px_file._iter_lsof():
+            pass
+        assert False and "We should never get here"
+    except px_exec_util.KilledError:
+        # This is the exception we want, done!
+        pass
+    finally:
+        px_exec_util.reset_kill_all()
+
+    # After resetting, lsof should run to completion again
+    assert list(px_file._iter_lsof(["-p", str(os.getpid())]))
+
+
+def test_lsof_stream_to_files():
+    my_dir = os.path.dirname(__file__)
+    for fixture in ("lsof-test-output-linux-1.txt", "lsof-test-output-linux-2.txt"):
+        path = os.path.join(my_dir, fixture)
+        with open(path, "r") as lsof_output:
+            expected = px_file.lsof_to_files(lsof_output.read())
+
+        # The fixtures are bigger than one read, so this covers shards split
+        # between reads
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            actual = list(px_file.lsof_stream_to_files(fd))
+        finally:
+            os.close(fd)
+
+        assert actual == expected
+
+
 def test_get_all():
     files = px_file.get_all()
 
@@ -78,6 +169,206 @@ def test_get_all():
     assert cwd_count > 0
 
 
+def test_get_all_from_proc_fake(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    proc.mkdir("self")  # Not a PID, should be ignored
+    regular_file = tmpdir.join("regular")
+    regular_file.write("")
+
+    pid = proc.mkdir("1234")
+    pid.join("cwd").mksymlinkto(tmpdir)
+    pid.join("exe").mksymlinkto(regular_file)
+    fd = pid.mkdir("fd")
+    fdinfo = pid.mkdir("fdinfo")
+    fd.join("0").mksymlinkto("pipe:[10508]")
+    fdinfo.join("0").write("pos:\t0\nflags:\t01000001\nmnt_id:\t13\n")
+    fd.join("1").mksymlinkto(regular_file)
+    fdinfo.join("1").write("pos:\t0\nflags:\t0100002\nmnt_id:\t13\n")
+    fd.join("2").mksymlinkto("socket:[10498]")
+    fd.join("3").mksymlinkto("anon_inode:[eventpoll]")
+
+    # No access to this one
+    proc.mkdir("5678")
+
+    files = sorted(px_file._get_all_from_proc(str(proc)), key=repr)
+    by_fd = dict((file.fd, file) for file in files if file.fd is not None)
+    by_fdtype = dict((file.fdtype, file) for file in files if file.fdtype is not None)
+    assert len(files) == 6
+    assert all(file.pid == 1234 for file in files)
+
+    assert by_fdtype["cwd"].type == "DIR"
+    assert by_fdtype["cwd"].name == str(tmpdir)
+    assert by_fdtype["txt"].type == "REG"
+    assert by_fdtype["txt"].name == str(regular_file)
+
+    assert by_fd[0].type == "FIFO"
+    assert by_fd[0].name == "pipe"
+    assert by_fd[0].inode == "10508"
+    assert by_fd[0].access == "w"
+    assert by_fd[0].fifo_id() == "10508"
+
+    assert by_fd[1].type == "REG"
+    assert by_fd[1].name == str(regular_file)
+    assert by_fd[1].inode == str(os.stat(str(regular_file)).st_ino)
+    assert by_fd[1].access == "rw"
+
+    assert by_fd[2].type == "sock"
+    assert by_fd[2].inode == "10498"
+    assert by_fd[2].access is None
+
+    assert by_fd[3].type == "a_inode"
+    assert by_fd[3].name == "[eventpoll]"
+
+
+def test_get_all_from_proc_live():
+    if px_file.get_default_backend() != px_file.BACKEND_PROC:
+        # No /proc on this system
+        return
+
+    read_fd, write_fd = os.pipe()
+    try:
+        files = [file for file in px_file.get_all(px_file.BACKEND_PROC)
+                 if file.pid == os.getpid()]
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+    by_fd = dict((file.fd, file) for file in files if file.fd is not None)
+    assert by_fd[read_fd].type == "FIFO"
+    assert by_fd[read_fd].access == "r"
+    assert by_fd[write_fd].type == "FIFO"
+    assert by_fd[write_fd].access == "w"
+    assert by_fd[read_fd].fifo_id() == by_fd[write_fd].fifo_id()
+
+    cwds = [file for file in files if file.fdtype == "cwd"]
+    assert len(cwds) == 1
+    assert cwds[0].name == os.getcwd()
+
+
+def test_collect_in_parallel():
+    def collect(pids):
+        return [px_file.PxFile(pid, "REG") for pid in pids]
+
+    pids = list(range(100))
+    for workers in (1, 3, 200):
+        files = list(px_file._collect_in_parallel(collect, pids, workers))
+        assert sorted(file.pid for file in files) == pids
+
+    assert list(px_file._collect_in_parallel(collect, [], 4)) == []
+
+
+def test_get_all_from_lsof_chunked(monkeypatch):
+    monkeypatch.setattr(px_file, "_MAX_LSOF_PIDS", 3)
+
+    # The second listing has two processes that started while we were busy
+    listings = [set(range(1, 11)), set(range(1, 13))]
+    monkeypatch.setattr(px_file, "_get_all_pids", lambda: listings.pop(0))
+
+    selections = []
+
+    def fake_iter_lsof(selection):
+        selections.append(selection)
+        return [px_file.PxFile(int(pid), "REG") for pid in selection[1].split(",")]
+    monkeypatch.setattr(px_file, "_iter_lsof", fake_iter_lsof)
+
+    files = list(px_file._get_all_from_lsof(workers=2))
+    assert sorted(file.pid for file in files) == list(range(1, 13))
+
+    for selection in selections:
+        assert selection[0] == "-p"
+        assert len(selection[1].split(",")) <= 3
+
+
+def test_get_all_from_proc_fake_parallel(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    for pid in range(1, 20):
+        fd_dir = proc.mkdir(str(pid)).mkdir("fd")
+        for fd in range(pid):
+            fd_dir.join(str(fd)).mksymlinkto("pipe:[{}]".format(pid * 100 + fd))
+
+    serial = set(px_file._get_all_from_proc(str(proc), workers=1))
+    assert len(serial) == sum(range(1, 20))
+    assert set(px_file._get_all_from_proc(str(proc), workers=4)) == serial
+
+
+def test_get_for_process_from_proc_fake(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    proc.mkdir("net").join("tcp").write(
+        "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt uid inode\n"
+        "   0: 0100007F:1F90 0100007F:C350 01 0:0 0:0 0 1000 0 1002\n"
+        "   1: 0100007F:C350 0100007F:1F90 01 0:0 0:0 0 1000 0 1003\n")
+
+    def create_pid(pid, links):
+        pid_dir = proc.mkdir(str(pid))
+        pid_dir.join("cwd").mksymlinkto(tmpdir)
+        fd_dir = pid_dir.mkdir("fd")
+        for fd, link in enumerate(links):
+            fd_dir.join(str(fd)).mksymlinkto(link)
+
+    create_pid(100, ["pipe:[1]", "socket:[1002]", "anon_inode:[eventpoll]"])
+    create_pid(200, ["pipe:[1]", "pipe:[2]", "anon_inode:[eventpoll]"])
+    create_pid(300, ["socket:[1003]", "socket:[1004]"])
+
+    files = list(px_file._get_for_process_from_proc(100, str(proc)))
+    assert sorted((f.pid, f.fd) for f in files if f.fd is not None) == [
+        (100, 0), (100, 1), (100, 2),
+        (200, 0),
+        (300, 0),
+    ]
+    assert sorted(f.pid for f in files if f.fdtype == "cwd") == [100, 200, 300]
+
+    by_pid = dict((f.pid, f) for f in files if f.fd == 0)
+    assert by_pid[200].type == "FIFO"
+    assert by_pid[200].inode == "1"
+    assert by_pid[300].type == "IPv4"
+    assert by_pid[300].name == "127.0.0.1:50000->127.0.0.1:8080"
+
+
+def test_get_peer_links_sockets_only(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    proc.mkdir("net").join("tcp").write(
+        "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt uid inode\n"
+        "   0: 0100007F:1F90 0100007F:C350 01 0:0 0:0 0 1000 0 1002\n"
+        "   1: 0100007F:C350 0100007F:1F90 01 0:0 0:0 0 1000 0 1003\n")
+    socket_index = px_socket_index.SocketIndex(str(proc))
+
+    socket = px_file.PxFile(100, "IPv4")
+    socket.inode = "1002"
+
+    # Same inode number as the socket, but on another file system
+    regular = px_file.PxFile(100, "REG")
+    regular.inode = "1003"
+
+    assert px_file._get_peer_links([socket], socket_index) == set(["socket:[1003]"])
+    assert px_file._get_peer_links([regular], socket_index) == set()
+
+
+def test_get_for_process():
+    # Start a child process reading from a pipe we're writing to
+    child = subprocess.Popen(["sleep", "10"], stdin=subprocess.PIPE)
+    try:
+        me = os.getpid()
+        process = testutils.create_process(pid=me)
+        processes = [process]
+
+        backends = [px_file.BACKEND_LSOF]
+        if px_file.get_default_backend() == px_file.BACKEND_PROC:
+            backends.append(px_file.BACKEND_PROC)
+
+        for backend in backends:
+            files = px_file.get_for_process(me, backend)
+            ipc_map = px_ipc_map.IpcMap(process, files, processes, is_root=False)
+            assert child.pid in [peer.pid for peer in ipc_map.keys()]
+
+            cwds = [file for file in files if file.fdtype == "cwd" and file.pid == me]
+            assert len(cwds) == 1
+    finally:
+        assert child.stdin is not None
+        child.stdin.close()
+        child.kill()
+        child.wait()
+
+
 def lsof_to_file(shard_array):
     # type: (List[str]) -> px_file.PxFile
     return px_file.lsof_to_files('\0'.join(shard_array + ["\n"]))[0]
@@ -0,0 +1,79 @@
+import json
+
+from px import px_ipc_map
+from px import px_ipc_export
+
+from . import testutils
+
+
+def create_graph():
+    files = [
+        # 100 pipes to 200, twice
+        testutils.create_file("FIFO", "pipe", None, 100, inode="17", access="w", fd=1),
+        testutils.create_file("FIFO", "pipe", None, 200, inode="17", access="r", fd=0),
+        testutils.create_file("FIFO", "pipe", None, 100, inode="18", access="w", fd=2),
+        testutils.create_file("FIFO", "pipe", None, 200, inode="18", access="r", fd=2),
+
+        # 200 talks to 300 over TCP
+        testutils.create_file(
+            "IPv4", "localhost:33815->localhost:postgresql", None, 200, "u", fd=3),
+        testutils.create_file(
+            "IPv4", "localhost:postgresql->localhost:33815", None, 300, "u", fd=4),
+
+        # 300 talks to another machine, that's not part of the graph
+        testutils.create_file("IPv4", "127.0.0.1:9999->8.8.8.8:https", None, 300, fd=5),
+    ]
+    processes = [
+        testutils.create_process(pid=100, commandline="/bin/producer"),
+        testutils.create_process(pid=200, commandline="/bin/consumer"),
+    ]
+    return (px_ipc_map.IpcGraph(files, processes), processes)
+
+
+def test_iter_edges():
+    graph, processes = create_graph()
+
+    # Every edge is reported once
+    assert list(px_ipc_export.iter_edges(graph, [100, 200, 300])) == [
+        (100, 200, "FIFO", 2),
+        (200, 300, "IPv4", 1),
+    ]
+
+    # Unless we only ask about one end of it
+    assert list(px_ipc_export.iter_edges(graph, [300])) == [
+        (300, 200, "IPv4", 1),
+    ]
+
+
+def test_to_json_lines():
+    graph, processes = create_graph()
+    lines = list(px_ipc_export.to_json_lines(graph, processes, [100, 200, 300]))
+
+    assert [json.loads(line) for line in lines] == [
+        {"kind": "process", "pid": 100, "label": "producer(100)",
+         "command": "producer", "user": "root"},
+        {"kind": "process", "pid": 200, "label": "consumer(200)",
+         "command": "consumer", "user": "root"},
+        {"kind": "edge", "pids": [100, 200], "channel": "FIFO", "count": 2},
+        {"kind": "process", "pid": 300, "label": "PID 300"},
+        {"kind": "edge", "pids": [200, 300], "channel": "IPv4", "count": 1},
+    ]
+
+
+def test_to_dot_lines():
+    graph, processes = create_graph()
+    lines = list(px_ipc_export.to_dot_lines(graph, processes, [100, 200, 300]))
+
+    assert lines == [
+        'graph px {',
+        '  100 [label="producer(100)"];',
+        '  200 [label="consumer(200)"];',
+        '  100 -- 200 [label="FIFO x2"];',
+        '  300 [label="PID 300"];',
+        '  200 -- 300 [label="IPv4"];',
+        '}',
+    ]
+
+
+def test_dot_quote():
+    assert px_ipc_export._dot_quote('a "b" \\c') == '"a \\"b\\" \\\\c"'
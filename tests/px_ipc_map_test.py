@@ -197,6 +197,9 @@ def test_stdfds_closed():
     assert ipc_map.fds[1] == '<closed>'
     assert ipc_map.fds[2] == '<closed>'
 
+    # All fds are described, not just 0-2
+    assert ipc_map.fds[3] == '/wherever'
+
 
 def test_stdfds_unavailable():
     ipc_map = testutils.create_ipc_map(1234, [])
@@ -282,3 +285,101 @@ def test_ipc_pipe_osx():
 def test_peer_process_str():
     assert str(px_ipc_map.PeerProcess(pid=45)) == "PID 45"
     assert str(px_ipc_map.PeerProcess(name="Johan")) == "Johan"
+
+
+def _pids(peers):
+    return sorted(peer.pid or 0 for peer in peers)
+
+
+def test_ipc_graph():
+    files = [
+        # 100 pipes to 200 and 300
+        testutils.create_file("FIFO", "pipe", None, 100, inode="17", access="w", fd=1),
+        testutils.create_file("FIFO", "pipe", None, 200, inode="17", access="r", fd=0),
+        testutils.create_file("FIFO", "pipe", None, 300, inode="17", access="r", fd=0),
+
+        # 200 talks to 300 over TCP
+        testutils.create_file(
+            "IPv4", "localhost:33815->localhost:postgresql", None, 200, "u", fd=3),
+        testutils.create_file(
+            "IPv4", "localhost:postgresql->localhost:33815", None, 300, "u", fd=4),
+
+        # 300 talks to another machine
+        testutils.create_file("IPv4", "127.0.0.1:9999->8.8.8.8:https", None, 300, fd=5),
+
+        testutils.create_file("REG", "/some/file", None, 300, fd=6),
+    ]
+    processes = [testutils.create_process(pid=pid) for pid in [100, 200, 300]]
+    graph = px_ipc_map.IpcGraph(files, processes)
+
+    assert sorted(graph.get_pids()) == [100, 200, 300]
+    assert len(graph.get_files(300)) == 4
+
+    peers = graph.get_peers(100)
+    assert _pids(peers) == [200, 300]
+    assert peers[graph.get_peer_process(200)] == set([files[0]])
+
+    peers = graph.get_peers(300)
+    assert _pids(peers) == [100, 200]
+    assert peers[graph.get_peer_process(200)] == set([files[4]])
+    assert graph.get_network_connections(300) == set([files[5]])
+
+    # Asking again gives the same answer without recomputing it
+    assert graph.get_peers(300) is peers
+
+    # IpcMaps for different processes can share one graph
+    ipc_map = px_ipc_map.IpcMap(processes[1], [], processes, False, ipc_graph=graph)
+    assert _pids(ipc_map.keys()) == [100, 300]
+    assert [f.fd for f in ipc_map.own_files] == [0, 3] or \
+        [f.fd for f in ipc_map.own_files] == [3, 0]
+
+
+def test_ipc_graph_update():
+    pipe_w = testutils.create_file("FIFO", "pipe", None, 100, inode="17", access="w", fd=1)
+    pipe_r = testutils.create_file("FIFO", "pipe", None, 200, inode="17", access="r", fd=0)
+    tcp_a = testutils.create_file(
+        "IPv4", "localhost:33815->localhost:postgresql", None, 100, "u", fd=3)
+    tcp_b = testutils.create_file(
+        "IPv4", "localhost:postgresql->localhost:33815", None, 300, "u", fd=4)
+    processes = [testutils.create_process(pid=pid) for pid in [100, 200, 300]]
+
+    graph = px_ipc_map.IpcGraph([pipe_w, pipe_r], processes)
+    assert _pids(graph.get_peers(100)) == [200]
+
+    graph.update([tcp_a, tcp_b], [])
+    assert _pids(graph.get_peers(100)) == [200, 300]
+
+    graph.update([], [pipe_r, tcp_b])
+    # The pipe now leads to UNKNOWN destinations, which have no PID
+    assert _pids(graph.get_peers(100)) == [0]
+    assert graph.get_network_connections(100) == set([tcp_a])
+    assert sorted(graph.get_pids()) == [100]
+    assert graph.get_files(200) == []
+
+    # Updating should give the same result as starting over
+    fresh = px_ipc_map.IpcGraph([pipe_w, tcp_a], processes)
+    assert graph.get_network_connections(100) == fresh.get_network_connections(100)
+    assert graph._device_number_to_pids == fresh._device_number_to_pids
+    assert graph._fifo_id_and_access_to_pids == fresh._fifo_id_and_access_to_pids
+    assert graph._local_endpoint_to_pid == fresh._local_endpoint_to_pid
+
+
+def test_get_ipc_keys():
+    keys = px_ipc_map.get_ipc_keys(
+        testutils.create_file("PIPE", "[] ->0xAda", "0xE0e", 25))
+    assert keys.device_number == 0xE0E
+    assert keys.peer_device_number == 0xADA
+    assert keys.fifo_id == "->0xAda"
+    assert keys.local_endpoint is None
+
+    keys = px_ipc_map.get_ipc_keys(
+        testutils.create_file("FIFO", "pipe", None, 100, inode="100200", access="r"))
+    assert keys.device_number is None
+    assert keys.peer_device_number is None
+    assert keys.fifo_id == 100200
+    assert keys.inode == 100200
+
+    keys = px_ipc_map.get_ipc_keys(
+        testutils.create_file("IPv4", "localhost:33815->localhost:postgresql", None, 1234))
+    assert keys.local_endpoint == "localhost:33815"
+    assert keys.remote_endpoint == "localhost:postgresql"
@@ -0,0 +1,87 @@
+import os
+import select
+
+from px import px_poller
+from px import px_process
+from px import px_terminal
+
+
+def test_poller():
+    read, write = os.pipe()
+    scheduler = px_poller.PollScheduler(min_interval_seconds=0.1, cpu_budget=1.0)
+    poller = px_poller.PxPoller(write, scheduler)
+    assert poller.get_all_processes() is None
+
+    poller.start()
+    try:
+        # Wait for two polls to complete
+        for _ in range(2):
+            assert select.select([read], [], [], 10)[0] == [read]
+            assert os.read(read, 1) == px_terminal.POLL_COMPLETE_KEY.encode("utf-8")
+    finally:
+        poller.stop()
+
+    processes = poller.get_all_processes()
+    assert processes is not None
+    assert os.getppid() in [process.pid for process in processes]
+
+    refresh_interval_seconds = poller.get_refresh_interval_seconds()
+    assert refresh_interval_seconds is not None
+    assert refresh_interval_seconds > 0.05
+
+
+def test_poll_scheduler():
+    scheduler = px_poller.PollScheduler(cpu_budget=0.02, min_interval_seconds=1.0)
+    assert scheduler.get_interval_seconds() == 1.0
+
+    # Cheap polls, stay at the minimum interval
+    scheduler.add_cycle(0.001)
+    assert scheduler.get_interval_seconds() == 1.0
+
+    # Expensive polls, 0.1s at 2% budget means polling every 5s
+    for _ in range(20):
+        scheduler.add_cycle(0.1)
+    assert abs(scheduler.get_interval_seconds() - 5.0) < 0.01
+
+    # Cheaper again, shrink back down
+    for _ in range(20):
+        scheduler.add_cycle(0.04)
+    assert abs(scheduler.get_interval_seconds() - 2.0) < 0.01
+
+
+def test_poller_survives_failures(monkeypatch):
+    real_get_all = px_process.PxProcessSnapshotter.get_all
+    calls = []
+
+    def failing_get_all(self):
+        calls.append(1)
+        if len(calls) == 1:
+            raise IOError("Process vanished")
+        return real_get_all(self)
+    monkeypatch.setattr(px_process.PxProcessSnapshotter, "get_all", failing_get_all)
+
+    read, write = os.pipe()
+    scheduler = px_poller.PollScheduler(min_interval_seconds=0.1, cpu_budget=1.0)
+    poller = px_poller.PxPoller(write, scheduler)
+    poller.start()
+    try:
+        assert select.select([read], [], [], 10)[0] == [read]
+    finally:
+        poller.stop()
+
+    assert len(calls) >= 2
+    assert poller.get_all_processes() is not None
+
+
+def test_get_cpu_budget(monkeypatch):
+    monkeypatch.delenv(px_poller.CPU_BUDGET_ENVIRONMENT_VARIABLE, raising=False)
+    assert px_poller.get_cpu_budget() == px_poller.DEFAULT_CPU_BUDGET
+
+    monkeypatch.setenv(px_poller.CPU_BUDGET_ENVIRONMENT_VARIABLE, "5")
+    assert px_poller.get_cpu_budget() == 0.05
+
+    monkeypatch.setenv(px_poller.CPU_BUDGET_ENVIRONMENT_VARIABLE, "0")
+    assert px_poller.get_cpu_budget() == px_poller.DEFAULT_CPU_BUDGET
+
+    monkeypatch.setenv(px_poller.CPU_BUDGET_ENVIRONMENT_VARIABLE, "lots")
+    assert px_poller.get_cpu_budget() == px_poller.DEFAULT_CPU_BUDGET
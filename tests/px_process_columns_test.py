@@ -0,0 +1,157 @@
+import random
+import datetime
+
+from px import px_process
+from px import px_process_columns
+
+from . import testutils
+
+
+def create_processes():
+    processes = []
+    for pid in range(100, 150):
+        processes.append(testutils.create_process(
+            pid=pid,
+            cputime="0:{:02d}.00".format(random.randint(0, 5)),
+            cpuusage=str(random.randint(0, 3)),
+            mempercent=str(random.randint(0, 3)),
+            commandline="command {}".format(random.randint(0, 5))))
+    return processes
+
+
+def test_order_best_first():
+    processes = create_processes()
+    columns = px_process_columns.PxProcessColumns(processes)
+
+    actual = columns.to_processes(columns.order_best_first())
+    assert actual == px_process.order_best_first(processes)
+
+
+def test_get_toplist_rows():
+    processes = create_processes()
+    columns = px_process_columns.PxProcessColumns(processes)
+
+    by_cpu = columns.to_processes(columns.get_toplist_rows())
+    assert [p.cpu_time_seconds for p in by_cpu] == \
+        sorted([p.cpu_time_seconds for p in processes], reverse=True)
+
+    by_memory = columns.to_processes(
+        columns.get_toplist_rows(px_process_columns.ORDER_MEMORY))
+    assert [p.memory_percent for p in by_memory] == \
+        sorted([p.memory_percent for p in processes], reverse=True)
+
+    # Ties should be ordered like order_best_first() does it
+    for toplist, attribute in ((by_cpu, 'cpu_time_seconds'), (by_memory, 'memory_percent')):
+        for a, b in zip(toplist, toplist[1:]):
+            if getattr(a, attribute) != getattr(b, attribute):
+                continue
+            assert (a.score, b.cmdline) >= (b.score, a.cmdline)
+
+
+def test_get_toplist_rows_max_count():
+    columns = px_process_columns.PxProcessColumns(create_processes())
+
+    for order in (
+            px_process_columns.ORDER_CPU_PERCENT,
+            px_process_columns.ORDER_CPU_TIME,
+            px_process_columns.ORDER_MEMORY):
+        top_10 = columns.get_toplist_rows(order, max_count=10)
+        assert top_10 == columns.get_toplist_rows(order)[0:10]
+
+        rows = [3, 1, 4, 15, 9, 2, 6]
+        assert columns.get_toplist_rows(order, rows, max_count=3) == \
+            columns.get_toplist_rows(order, rows)[0:3]
+
+
+def test_get_toplist_rows_by_cpu_percent():
+    # With no CPU times at all, we should fall back on CPU percentages
+    processes = [
+        testutils.create_process(pid=100, cputime="0:00.00", cpuusage="1.0"),
+        testutils.create_process(pid=200, cputime="0:00.00", cpuusage="3.0"),
+        testutils.create_process(pid=300, cputime="0:00.00", cpuusage="2.0"),
+    ]
+    columns = px_process_columns.PxProcessColumns(processes)
+
+    toplist = columns.to_processes(columns.get_toplist_rows())
+    assert [p.pid for p in toplist] == [200, 300, 100]
+
+
+def test_subtract_cpu_times():
+    baseline = [
+        testutils.create_process(pid=100, cputime="0:03.00", commandline="match"),
+        testutils.create_process(pid=200, cputime="0:03.00", commandline="reused PID",
+                                 timestring="Mon Apr  7 09:33:11 2010"),
+    ]
+    current = [
+        testutils.create_process(pid=100, cputime="0:10.00", commandline="match"),
+        testutils.create_process(pid=200, cputime="0:10.00", commandline="reused PID",
+                                 timestring="Mon May  7 09:33:11 2010"),
+        testutils.create_process(pid=300, cputime="0:10.00", commandline="new"),
+    ]
+    current[2].set_cpu_time_seconds(None)
+
+    columns = px_process_columns.PxProcessColumns(current)
+    columns.subtract_cpu_times(px_process_columns.PxProcessColumns(baseline))
+    adjusted = columns.to_processes(range(len(columns)))
+
+    assert [p.cpu_time_seconds for p in adjusted] == [7.0, 10.0, None]
+    assert adjusted[0].score < current[0].score
+    assert adjusted[0] is not current[0]
+    assert adjusted[1] is current[1]
+    assert adjusted[2] is current[2]
+
+    # The original should be untouched
+    assert current[0].cpu_time_seconds == 10.0
+
+
+def test_set_recent_cpu_percents():
+    now = testutils.now()
+    later = now + datetime.timedelta(seconds=4)
+    previous = [
+        testutils.create_process(pid=100, cputime="0:10.00", now=now),
+        testutils.create_process(pid=200, cputime="0:10.00", now=now,
+                                 timestring="Mon Apr  7 09:33:11 2010"),
+    ]
+    current = [
+        testutils.create_process(pid=100, cputime="0:11.00", now=later),
+        testutils.create_process(pid=200, cputime="0:11.00", now=later,  # Reused PID
+                                 timestring="Mon May  7 09:33:11 2010"),
+    ]
+
+    columns = px_process_columns.PxProcessColumns(current)
+    columns.set_recent_cpu_percents(px_process_columns.PxProcessColumns(previous))
+    recent = columns.to_processes(range(len(columns)))
+
+    # One second of CPU over four seconds of wall clock time
+    assert recent[0].cpu_percent == 25.0
+    assert recent[0].cpu_percent_s == u"25%"
+
+    # New process, average over its lifetime
+    assert recent[1].cpu_percent == 100.0 * 11.0 / current[1].age_seconds
+
+    # The originals should be untouched
+    assert current[0].cpu_percent == 0.0
+
+
+def test_set_recent_cpu_percents_after_subtract():
+    """
+    Columns with baseline CPU times subtracted can be reused as the previous
+    snapshot, like ptop does.
+    """
+    now = testutils.now()
+    later = now + datetime.timedelta(seconds=4)
+    baseline = px_process_columns.PxProcessColumns(
+        [testutils.create_process(pid=100, cputime="0:08.00", now=now)])
+    previous = px_process_columns.PxProcessColumns(
+        [testutils.create_process(pid=100, cputime="0:10.00", now=now)])
+    previous.subtract_cpu_times(baseline)
+    assert list(previous.cpu_times) == [2.0]
+
+    columns = px_process_columns.PxProcessColumns(
+        [testutils.create_process(pid=100, cputime="0:11.00", now=later)])
+    columns.subtract_cpu_times(baseline)
+    columns.set_recent_cpu_percents(previous)
+    recent = columns.to_processes(range(len(columns)))
+
+    assert recent[0].cpu_percent == 25.0
+    assert recent[0].cpu_time_seconds == 3.0
@@ -0,0 +1,39 @@
+import os
+
+from px import px_terminal
+from px import px_process_menu
+
+from . import testutils
+
+
+def test_status_survives_poll(monkeypatch):
+    """
+    Background polls from ptop must not wake up the menu and clear its status.
+    """
+    stdin_read, stdin_write = os.pipe()
+    real_getch = px_terminal.getch
+
+    def getch(timeout_seconds=None, fd=None, include_poll_pipe=False):
+        # Don't block, and read keypresses from our own pipe
+        return real_getch(0, stdin_read, include_poll_pipe)
+    monkeypatch.setattr(px_terminal, "getch", getch)
+
+    menu = px_process_menu.PxProcessMenu(testutils.create_process())
+    menu.status = u"Not allowed to kill"
+
+    os.write(px_terminal.POLL_COMPLETE_PIPE[1], px_terminal.POLL_COMPLETE_KEY.encode("utf-8"))
+    try:
+        menu.await_and_handle_user_input()
+        assert menu.status == u"Not allowed to kill"
+        assert not menu.done
+    finally:
+        # The notification is still there for ptop, drain it so it doesn't leak
+        # into other tests
+        assert os.read(px_terminal.POLL_COMPLETE_PIPE[0], 1) == \
+            px_terminal.POLL_COMPLETE_KEY.encode("utf-8")
+
+    # Real keypresses still clear the status
+    os.write(stdin_write, b"\x1b[B")
+    menu.await_and_handle_user_input()
+    assert menu.status == u""
+    assert menu.active_entry == 1
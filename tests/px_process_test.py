@@ -1,4 +1,9 @@
+import time
+import signal
 import getpass
+import datetime
+import tempfile
+import subprocess
 
 import os
 import six
@@ -35,6 +40,27 @@ def test_create_process():
     assert test_me.age_seconds > 0
 
 
+def test_display_strings():
+    process = testutils.create_process(
+        cputime="0:10.00", cpuusage="12.3", mempercent="45.6",
+        commandline="/usr/bin/Hello world")
+
+    # No __dict__ means we're using __slots__, which saves memory
+    assert not hasattr(process, '__dict__')
+
+    assert process.command == "Hello"
+    assert process.lowercase_command == "hello"
+    assert process.cpu_time_s == "10.0s"
+    assert process.cpu_percent_s == "12%"
+    assert process.memory_percent_s == "46%"
+
+    # Cached strings must follow updates
+    process.set_cpu_time_seconds(75)
+    assert process.cpu_time_s == "1m15s"
+    process.set_cpu_time_seconds(None)
+    assert process.cpu_time_s == "--"
+
+
 def test_ps_line_to_process_unicode():
     process = testutils.create_process(cputime="2:14.15")
 
@@ -115,8 +141,8 @@ def _validate_references(processes):
             assert child.parent == process
 
 
-def _test_get_all():
-    all = px_process.get_all()
+def _test_get_all(backend=None):
+    all = px_process.get_all(backend)
     assert len(all) >= 4  # Expect at least kernel, init, bash and python
     for process in all:
         assert process is not None
@@ -182,6 +208,296 @@ def test_get_all_defaultlocale():
     _test_get_all()
 
 
+def test_get_all_ps():
+    _test_get_all(px_process.BACKEND_PS)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="Needs /proc")
+def test_get_all_proc():
+    _test_get_all(px_process.BACKEND_PROC)
+
+
+def test_iter_all():
+    for backend in (px_process.BACKEND_PS, px_process.get_default_backend()):
+        processes = list(px_process.iter_all(backend))
+        pids = [p.pid for p in processes]
+
+        assert len(pids) == len(set(pids))
+        assert os.getpid() not in pids
+        assert os.getppid() in pids
+        assert 0 in pids
+        assert 1 in pids
+
+        for process in processes:
+            assert process.parent is None
+            assert not process.children
+
+
+def test_iter_all_stop_early():
+    # Stopping early should neither hang nor raise
+    for process in px_process.iter_all(px_process.BACKEND_PS):
+        break
+
+
+def test_read_lines():
+    # Long enough to need multiple reads, and with multi byte characters that
+    # will end up on read boundaries
+    lines = [u"line {} \u00e5\u00e4\u00f6 \u20ac".format(i) for i in range(20000)]
+    data = (u"\n".join(lines) + u"\nno newline at end").encode('utf-8')
+
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.seek(0)
+        assert list(px_process._read_lines(f.fileno())) == lines + [u"no newline at end"]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="Needs /proc")
+def test_get_all_proc_same_as_ps():
+    by_ps = {}
+    for process in px_process.get_all(px_process.BACKEND_PS):
+        by_ps[process.pid] = process
+
+    for process in px_process.get_all(px_process.BACKEND_PROC):
+        if process.pid not in by_ps:
+            # Process started after the ps run
+            continue
+        ps_process = by_ps[process.pid]
+
+        assert process.ppid == ps_process.ppid
+        assert process.username == ps_process.username
+
+        # ps shows non-ASCII and non-printable characters as '?'. Kernel
+        # threads are named after what they're working on, which changes.
+        is_kernel_thread = process.cmdline.startswith(u'[')
+        if not is_kernel_thread and all(u' ' <= c <= u'~' for c in process.cmdline):
+            assert process.cmdline == ps_process.cmdline
+
+        # ps rounds start times to whole seconds
+        assert abs((process.start_time - ps_process.start_time).total_seconds()) < 2
+
+
+def test_parse_proc_stat():
+    comm, fields = px_process._parse_proc_stat(
+        b"1234 (a) (b c) S 1 1234 1234 0 -1 4194560 100 0 0 0 5 7 0 0 20 0 1 0 200 0 300")
+    assert comm == b"a) (b c"
+    assert fields[0] == b"S"
+    assert fields[1] == b"1"
+    assert fields[11] == b"5"
+    assert fields[12] == b"7"
+    assert fields[19] == b"200"
+    assert fields[21] == b"300"
+
+
+def test_proc_cmdline_to_text():
+    assert px_process._proc_cmdline_to_text(b"ls\0-l\0", b"ls", b"R") == u"ls -l"
+    assert px_process._proc_cmdline_to_text(b"", b"kthreadd", b"S") == u"[kthreadd]"
+    assert px_process._proc_cmdline_to_text(b"", b"zombie", b"Z") == u"[zombie] <defunct>"
+
+
+def test_get_all_from_proc_fake(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    proc.join("stat").write_binary(b"cpu  1 2 3 4\nbtime 1600000000\nprocesses 5\n")
+    proc.join("meminfo").write_binary(b"MemTotal:        1000000 kB\nMemFree: 1 kB\n")
+
+    clock_ticks_per_second = os.sysconf('SC_CLK_TCK')
+    page_size_bytes = os.sysconf('SC_PAGE_SIZE')
+    rss_pages = 100000 * 1024 // page_size_bytes  # 10% of MemTotal
+    pid_dir = proc.mkdir("4711")
+    pid_dir.join("stat").write_binary(
+        "4711 (sleep) S 1 4711 4711 0 -1 0 0 0 0 0 {} {} 0 0 20 0 1 0 {} 0 {}".format(
+            2 * clock_ticks_per_second, clock_ticks_per_second,
+            10 * clock_ticks_per_second, rss_pages).encode('ascii'))
+    pid_dir.join("status").write_binary(
+        b"Name:\tsleep\nPPid:\t1\nUid:\t1\t" + str(os.getuid()).encode('ascii') + b"\t1\t1\n")
+    pid_dir.join("cmdline").write_binary(b"sleep\x0042\x00")
+
+    # Not a process, should be ignored
+    proc.mkdir("sys")
+
+    now = testutils.now()
+    now_seconds = px_process._to_seconds(now)
+    processes = [builder.build(now, now_seconds)
+                 for builder in px_process._get_all_builders_from_proc(now_seconds, str(proc))]
+    assert len(processes) == 1
+
+    process = processes[0]
+    assert process.pid == 4711
+    assert process.ppid == 1
+    assert process.cmdline == u"sleep 42"
+    assert process.command == u"sleep"
+    assert process.username == getpass.getuser()
+    assert process.cpu_time_seconds == 3.0
+    assert process.memory_percent is not None
+    assert round(process.memory_percent) == 10
+    assert process.start_seconds == 1600000010.0
+    assert process.start_time == datetime.datetime.fromtimestamp(
+        1600000010, px_process.TIMEZONE)
+
+    # If the process has exec()ed something else, comm changes and the command
+    # line should be read again
+    builders = list(px_process._get_all_builders_from_proc(
+        now_seconds, str(proc), known_comms={(4711, None, process.start_seconds): b"sh"}))
+    assert len(builders) == 1
+    assert builders[0].comm == b"sleep"
+    assert builders[0].cmdline == u"sleep 42"
+
+    # For already known processes, only the stat file should be read
+    pid_dir.join("cmdline").remove()
+    builders = list(px_process._get_all_builders_from_proc(
+        now_seconds, str(proc), known_comms={(4711, None, process.start_seconds): b"sleep"}))
+    assert len(builders) == 1
+    assert builders[0].cpu_time == 3.0
+    assert builders[0].cmdline is None
+    assert builders[0].username is None
+
+
+def _create_builder(pid, cputime, timestring=testutils.TIMESTRING, commandline=u"hej"):
+    process_builder = px_process.PxProcessBuilder()
+    process_builder.pid = pid
+    process_builder.ppid = 1
+    process_builder.start_time_string = timestring
+    process_builder.username = u"usernamex"
+    process_builder.cpu_percent = 0.0
+    process_builder.cpu_time = cputime
+    process_builder.memory_percent = 1.0
+    process_builder.cmdline = commandline
+    return process_builder
+
+
+def test_snapshotter(monkeypatch):
+    builders = [
+        _create_builder(1, 1.0, commandline=u"init"),
+        _create_builder(100, 2.0),
+        _create_builder(200, 3.0),
+    ]
+    monkeypatch.setattr(px_process, "_get_all_builders", lambda backend, now_seconds, known_comms: builders)
+    snapshotter = px_process.PxProcessSnapshotter()
+
+    first = snapshotter.get_all()
+    first_by_pid = {}
+    for process in first:
+        first_by_pid[process.pid] = process
+    _validate_references(first)
+
+    builders = [
+        _create_builder(1, 1.5, commandline=u"init"),
+        _create_builder(100, 4.0),
+        _create_builder(200, 3.0, timestring="Mon Apr  7 09:33:11 2010"),  # Reused PID
+        _create_builder(300, 5.0),
+    ]
+
+    built = []
+    real_build = px_process.PxProcessBuilder.build
+
+    def counting_build(self, now, now_seconds=None):
+        built.append(self.pid)
+        return real_build(self, now, now_seconds)
+    monkeypatch.setattr(px_process.PxProcessBuilder, "build", counting_build)
+
+    second = snapshotter.get_all()
+    second_by_pid = {}
+    for process in second:
+        second_by_pid[process.pid] = process
+    _validate_references(second)
+
+    # Only the new processes should have been built from scratch. PID 0 is the
+    # fake kernel process, created on each get_all() call.
+    assert sorted(built) == [0, 200, 300]
+
+    assert second_by_pid[100].cpu_time_seconds == 4.0
+    assert second_by_pid[100].cpu_time_s == "4.0s"
+    assert second_by_pid[1].cpu_time_seconds == 1.5
+    assert second_by_pid[200].start_time != first_by_pid[200].start_time
+
+    # Earlier snapshots must not change
+    assert first_by_pid[100].cpu_time_seconds == 2.0
+    assert first_by_pid[100] is not second_by_pid[100]
+    _validate_references(first)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="Needs /proc")
+def test_snapshotter_exec(tmpdir):
+    go = str(tmpdir.join("go"))
+
+    # Start the process detached, our own descendants are excluded from
+    # process listings
+    script = "while [ ! -e {} ]; do sleep 0.05; done; exec sleep 30".format(go)
+    pid = int(subprocess.check_output(
+        ["sh", "-c", 'sh -c "$0" > /dev/null 2>&1 & echo $!', script]))
+    try:
+        snapshotter = px_process.PxProcessSnapshotter(px_process.BACKEND_PROC)
+        before = [p for p in snapshotter.get_all() if p.pid == pid]
+        assert len(before) == 1
+        assert before[0].command == u"sh"
+
+        # Make it exec() and wait for that to happen
+        open(go, "w").close()
+        t0 = time.time()
+        while time.time() - t0 < 5:
+            with open("/proc/{}/comm".format(pid)) as comm:
+                if comm.read().strip() == "sleep":
+                    break
+            time.sleep(0.05)
+
+        after = [p for p in snapshotter.get_all() if p.pid == pid]
+        assert len(after) == 1
+        assert after[0].cmdline == u"sleep 30"
+        assert after[0].command == u"sleep"
+    finally:
+        os.kill(pid, signal.SIGKILL)
+
+
+def test_get_all_search(monkeypatch):
+    builders = [
+        _create_builder(1, 1.0, commandline=u"init"),
+        _create_builder(100, 1.0, commandline=u"sshd"),
+        _create_builder(200, 1.0, commandline=u"bash"),
+        _create_builder(300, 1.0, commandline=u"/usr/bin/SomeDaemon --flag"),
+        _create_builder(400, 1.0, commandline=u"unrelated"),
+    ]
+    builders[2].ppid = 100
+    builders[3].ppid = 200
+    monkeypatch.setattr(px_process, "_get_all_builders", lambda backend, now_seconds: iter(builders))
+
+    built = []
+    real_build = px_process.PxProcessBuilder.build
+
+    def counting_build(self, now, now_seconds=None):
+        built.append(self.pid)
+        return real_build(self, now, now_seconds)
+    monkeypatch.setattr(px_process.PxProcessBuilder, "build", counting_build)
+
+    processes = px_process.get_all(search=u"somedaemon")
+    _validate_references(processes)
+
+    # The match, its ancestors and the fake kernel process
+    assert sorted(built) == [0, 1, 100, 200, 300]
+    assert sorted(p.pid for p in processes) == [0, 1, 100, 200, 300]
+    assert [p.pid for p in processes if p.match(u"somedaemon")] == [300]
+
+    del built[:]
+    assert [p.pid for p in px_process.iter_all(search=u"somedaemon")] == [300]
+    assert sorted(built) == [0, 300]
+
+    # Usernames match exactly
+    assert len(px_process.get_all(search=u"usernamex")) == 6
+    assert [p.pid for p in px_process.iter_all(search=u"username")] == []
+
+
+def test_snapshotter_live():
+    snapshotter = px_process.PxProcessSnapshotter()
+    first = snapshotter.get_all()
+    second = snapshotter.get_all()
+
+    _validate_references(first)
+    _validate_references(second)
+
+    first_pids = set(map(lambda p: p.pid, first))
+    second_pids = set(map(lambda p: p.pid, second))
+    assert os.getppid() in first_pids
+    assert os.getppid() in second_pids
+
+
 def test_process_eq():
     """Compare two mostly identical processes, where one has a parent and the other one not"""
     process_a = testutils.create_process()
@@ -193,6 +509,20 @@ def test_process_eq():
     assert process_a != process_b
 
 
+def test_parse_start_time():
+    assert px_process._parse_time(testutils.TIMESTRING) == \
+        (testutils.TIME - px_process.EPOCH).total_seconds()
+
+
+def test_create_kernel_process():
+    kernel = px_process.create_kernel_process(testutils.now())
+    assert kernel.start_seconds == px_process.get_boot_time()
+    assert kernel.start_seconds > 0
+
+    if os.path.isfile("/proc/stat"):
+        assert kernel.start_seconds == px_process._get_boot_time_from_proc()
+
+
 def test_parse_time():
     assert px_process.parse_time("0:00.03") == 0.03
     assert px_process.parse_time("1:02.03") == 62.03
@@ -1,3 +1,5 @@
+import time
+
 from px import px_process
 from px import px_ipc_map
 from px import px_terminal
@@ -128,3 +130,13 @@ def test_to_ipc_lines():
         px_terminal.bold("bar(47536)") + ": [PIPE] ->0xAda",
         px_terminal.bold("foo(47536)") + ": [PIPE] ->0xAda"
     ]
+
+
+def test_describe_file_cache_age():
+    now = time.time()
+
+    assert px_processinfo.describe_file_cache_age(now, now, 60, "lsof") == \
+        "lsof done, cached for 60s, proceeding."
+
+    assert px_processinfo.describe_file_cache_age(now - 42, now, 60, "lsof") == \
+        "Using cached lsof file list from 42s ago (PX_FILE_CACHE_TTL=60), proceeding."
@@ -0,0 +1,107 @@
+import time
+import threading
+
+from px import px_file
+from px import px_resolver
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import Dict      # NOQA
+    from typing import List      # NOQA
+    from typing import Optional  # NOQA
+
+
+class FakeLookup(object):
+    def __init__(self, names, delay_seconds=0.0):
+        # type: (Dict[str, str], float) -> None
+        self.names = names
+        self.delay_seconds = delay_seconds
+        self.lookups = []  # type: List[str]
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, address):
+        # type: (str) -> Optional[str]
+        self.lookups.append(address)
+        self.release.wait()
+        time.sleep(self.delay_seconds)
+        return self.names.get(address)
+
+
+def test_resolve():
+    lookup = FakeLookup({"127.0.0.1": "localhost"})
+    resolver = px_resolver.Resolver(lookup=lookup)
+
+    assert resolver.resolve("127.0.0.1") == "localhost"
+    assert resolver.resolve("127.0.0.1") == "localhost"
+    assert lookup.lookups == ["127.0.0.1"]
+
+
+def test_resolve_negative_caching():
+    lookup = FakeLookup({})
+    resolver = px_resolver.Resolver(lookup=lookup)
+
+    assert resolver.resolve("10.0.0.1") is None
+    assert resolver.resolve("10.0.0.1") is None
+    assert lookup.lookups == ["10.0.0.1"]
+
+
+def test_resolve_timeout():
+    lookup = FakeLookup({"10.0.0.1": "slow.example.com"})
+    lookup.release.clear()
+    resolver = px_resolver.Resolver(lookup=lookup)
+
+    # Show the raw address until the name arrives
+    assert resolver.resolve("10.0.0.1", timeout_seconds=0.05) is None
+    assert resolver.get("10.0.0.1") is None
+
+    lookup.release.set()
+    assert resolver.resolve("10.0.0.1") == "slow.example.com"
+    assert resolver.get("10.0.0.1") == "slow.example.com"
+    assert lookup.lookups == ["10.0.0.1"]
+
+
+def test_wait_is_concurrent():
+    addresses = ["10.0.0.{}".format(i) for i in range(8)]
+    lookup = FakeLookup({}, delay_seconds=0.2)
+    resolver = px_resolver.Resolver(workers=8, lookup=lookup)
+
+    t0 = time.time()
+    assert resolver.wait(addresses, timeout_seconds=5)
+    dt_seconds = time.time() - t0
+
+    assert sorted(lookup.lookups) == addresses
+
+    # Eight lookups in sequence would have taken 1.6s
+    assert dt_seconds < 1.0
+
+
+def test_lru_eviction():
+    lookup = FakeLookup({})
+    resolver = px_resolver.Resolver(cache_size=2, lookup=lookup)
+
+    resolver.resolve("10.0.0.1")
+    resolver.resolve("10.0.0.2")
+    resolver.resolve("10.0.0.1")  # Now 10.0.0.2 is the least recently used
+    resolver.resolve("10.0.0.3")  # Evicts 10.0.0.2
+
+    resolver.resolve("10.0.0.1")
+    resolver.resolve("10.0.0.2")
+    assert lookup.lookups == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.2"]
+
+
+def test_describe_without_waiting(monkeypatch):
+    lookup = FakeLookup({"127.0.0.1": "localhost"})
+    lookup.release.clear()
+    resolver = px_resolver.Resolver(lookup=lookup)
+    monkeypatch.setattr(px_resolver, "get_resolver", lambda: resolver)
+
+    file = px_file.PxFile(pid=0, filetype="IPv4")
+    file.name = "127.0.0.1:51786->127.0.0.1:5432"
+    assert file.describe(resolve_timeout_seconds=0) == "[IPv4] 127.0.0.1:51786->127.0.0.1:5432"
+
+    lookup.release.set()
+    px_file.prefetch_names([file], timeout_seconds=5)
+    assert file.describe(resolve_timeout_seconds=0) == "[IPv4] localhost:51786->localhost:5432"
+    assert lookup.lookups == ["127.0.0.1"]
@@ -0,0 +1,93 @@
+from px import px_file
+from px import px_socket_index
+
+from . import testutils
+
+
+TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:0277 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001
+   1: 0100007F:1F90 0100007F:C350 01 00000000:00000000 00:00000000 00000000  1000        0 1002
+   2: 0100007F:C350 0100007F:1F90 01 00000000:00000000 00:00000000 00000000  1000        0 1003
+   3: 0100007F:C351 08080808:01BB 01 00000000:00000000 00:00000000 00000000  1000        0 1004
+   4: 0100007F:C352 0100007F:1F90 06 00000000:00000000 03:00000000 00000000     0        0 0
+"""
+
+TCP6 = (
+    "  sl  local_address remote_address st tx_queue rx_queue tr tm->when retrnsmt uid inode\n"
+    "   0: 00000000000000000000000001000000:0277 00000000000000000000000000000000:0000 0A"
+    " 00000000:00000000 00:00000000 00000000     0        0 2001\n"
+)
+
+UDP = """\
+   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+  1: 00000000:0044 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 3001
+"""
+
+UNIX = """\
+Num       RefCount Protocol Flags    Type St Inode Path
+0000000000000000: 00000002 00000000 00010000 0001 01  4001 /run/some socket.sock
+0000000000000000: 00000003 00000000 00000000 0001 03  4002
+0000000000000000: 00000003 00000000 00000000 0002 03  4003
+"""
+
+
+def create_proc(tmpdir):
+    proc = tmpdir.mkdir("proc")
+    net = proc.mkdir("net")
+    net.join("tcp").write(TCP)
+    net.join("tcp6").write(TCP6)
+    net.join("udp").write(UDP)
+    # No udp6, should be fine
+    net.join("unix").write(UNIX)
+    return proc
+
+
+def test_socket_index(tmpdir):
+    index = px_socket_index.SocketIndex(str(create_proc(tmpdir)))
+    assert len(index) == 9
+
+    assert index.get("1001") == px_socket_index.SocketInfo("tcp", "*:631", None, "LISTEN")
+    assert index.get("1002") == px_socket_index.SocketInfo(
+        "tcp", "127.0.0.1:8080", "127.0.0.1:50000", "ESTABLISHED")
+    assert index.get("2001") == px_socket_index.SocketInfo("tcp6", "[::1]:631", None, "LISTEN")
+    assert index.get("3001") == px_socket_index.SocketInfo("udp", "*:68", None, None)
+    assert index.get("4001") == px_socket_index.SocketInfo(
+        "unix", "/run/some socket.sock", None, "STREAM")
+    assert index.get("4003") == px_socket_index.SocketInfo("unix", None, None, "DGRAM")
+    assert index.get("5000") is None
+    assert index.get(None) is None
+
+    # Local connections
+    assert index.get_peer_inode("1002") == "1003"
+    assert index.get_peer_inode("1003") == "1002"
+
+    # Remote connection, listening socket and not indexed
+    assert index.get_peer_inode("1004") is None
+    assert index.get_peer_inode("1001") is None
+    assert index.get_peer_inode("5000") is None
+
+
+def test_socket_index_no_proc(tmpdir):
+    index = px_socket_index.SocketIndex(str(tmpdir))
+    assert len(index) == 0
+
+
+def test_ipc_map_socket_join(tmpdir):
+    index = px_socket_index.SocketIndex(str(create_proc(tmpdir)))
+
+    files = []
+    for pid, inode in ((100, "1002"), (200, "1003"), (100, "1004")):
+        builder = px_file.PxFileBuilder()
+        builder.pid = pid
+        builder.inode = inode
+        px_file._describe_socket(builder, index.get(inode))
+        files.append(builder.build())
+
+    assert files[0].type == "IPv4"
+    assert files[2].name == "127.0.0.1:50001->8.8.8.8:443"
+
+    ipc_map = testutils.create_ipc_map(100, files, socket_index=index)
+    assert ipc_map._get_other_end_pids(files[0]) == [200]
+    assert ipc_map._get_other_end_pids(files[2]) == []
+    assert ipc_map.network_connections == set([files[2]])
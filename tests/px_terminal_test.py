@@ -41,6 +41,28 @@ def test_to_screen_lines_bounded():
     ]
 
 
+def test_to_screen_lines_max_rows():
+    procs = [
+        testutils.create_process(pid=1, commandline="/usr/bin/fluff 1234"),
+        testutils.create_process(pid=2, commandline="/usr/bin/fluff 1234", cputime="0:00.01"),
+        testutils.create_process(pid=123456, commandline="/usr/bin/longcommandname",
+                                 cputime="0:02.00", mempercent="5.0"),
+    ]
+    lines = px_terminal.to_screen_lines(procs, 50, 1, u"CPUTIME", max_rows=2)
+    assert len(lines) == 3
+
+    # Column widths come from the shown procs only, but the PID column is
+    # wide enough for all of them
+    assert lines[1].startswith(u"     1 fluff ")
+
+    # The highest CPU time is in a proc that isn't shown, so nothing shown is
+    # highlighted
+    assert u"\x1b[1m" not in lines[1]
+    assert u"\x1b[1m" not in lines[2]
+
+    assert len(px_terminal.to_screen_lines(procs, 50, 1, u"CPUTIME", max_rows=0)) == 1
+
+
 def test_crop_heading_lines():
     procs = [testutils.create_process(commandline="/usr/bin/fluff 1234")]
     assert px_terminal.to_screen_lines(procs, 10, None, None) == [
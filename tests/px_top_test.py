@@ -1,7 +1,12 @@
 import os
+import time
+import threading
+import datetime
 
 from px import px_top
+from px import px_poller
 from px import px_process
+from px import px_process_columns
 from px import px_terminal
 from px import px_launchcounter
 
@@ -43,6 +48,18 @@ def test_get_toplist():
     px_top.get_toplist(px_process.get_all(), px_process.get_all())
 
 
+def test_get_toplist_search_max_count():
+    current = [
+        testutils.create_process(pid=100, cputime="0:10.00", commandline="apa"),
+        testutils.create_process(pid=200, cputime="0:20.00", commandline="bepa"),
+        testutils.create_process(pid=300, cputime="0:30.00", commandline="cepa"),
+        testutils.create_process(pid=400, cputime="0:40.00", commandline="apa"),
+    ]
+
+    toplist = px_top.get_toplist([], current, search=u"apa", max_count=2)
+    assert [p.pid for p in toplist] == [400, 100]
+
+
 def test_get_command():
     pipe = os.pipe()
     read, write = pipe
@@ -51,6 +68,59 @@ def test_get_command():
     assert px_top.get_command(timeout_seconds=0, fd=read) == px_top.CMD_QUIT
 
 
+def test_keypress_latency_while_polling(monkeypatch):
+    """
+    Keypresses must be handled and drawn even while a poll is in progress.
+    """
+    poll_started = threading.Event()
+    release_poll = threading.Event()
+
+    def blocking_get_all(self):
+        poll_started.set()
+        release_poll.wait(10)
+        return []
+    monkeypatch.setattr(px_process.PxProcessSnapshotter, "get_all", blocking_get_all)
+    monkeypatch.setattr(px_top, "sort_order", px_top.SORT_ORDERS[0])
+
+    # Our own poll notification pipe, so that no earlier test's notifications
+    # get in the way
+    poll_complete_pipe = os.pipe()
+    monkeypatch.setattr(px_terminal, "POLL_COMPLETE_PIPE", poll_complete_pipe)
+
+    current = px_process.get_all()
+    launchcounter = px_launchcounter.Launchcounter()
+    poller = px_poller.PxPoller(poll_complete_pipe[1])
+    poller.start()
+    try:
+        assert poll_started.wait(10)
+
+        read, write = os.pipe()
+        t0 = time.time()
+        os.write(write, b'm')
+        key = px_terminal.getch(timeout_seconds=1, fd=read, include_poll_pipe=True)
+        getch_latency_seconds = time.time() - t0
+        assert key is not None
+        assert key.consume(u'm')
+
+        # The poll must still be running for this test to mean anything
+        assert poller.get_all_processes() is None
+
+        # Handling the key and redrawing doesn't wait for the poll either
+        os.write(write, b'm')
+        assert px_top.get_command(timeout_seconds=1, fd=read) == px_top.CMD_WHATEVER
+        toplist = px_top.get_toplist(current, current, px_top.sort_order)
+        px_top.get_screen_lines(toplist, launchcounter, 40, 100)
+        latency_seconds = time.time() - t0
+        assert poller.get_all_processes() is None
+    finally:
+        poller.stop()
+        release_poll.set()
+
+    assert getch_latency_seconds < 0.5
+    assert px_top.sort_order == px_top.SORT_ORDERS[1]
+    assert latency_seconds < 1.0
+
+
 def test_sigwinch_handler():
     # Args ignored at the time of writing this, fill in better values if needed
     px_terminal.sigwinch_handler(None, None)
@@ -93,6 +163,47 @@ def test_get_screen_lines_low_screen():
     assert u'CSI' in lines[-1].replace(CSI, u'CSI')
 
 
+def test_get_screen_lines_refresh_interval():
+    baseline = px_process.get_all()
+    launchcounter = px_launchcounter.Launchcounter()
+
+    lines = px_top.get_screen_lines(
+        baseline, launchcounter, 40, 100, refresh_interval_seconds=2.54)
+    assert any(u"refreshed every 2.5s" in line for line in lines)
+
+
+def test_get_toplist_recent_cpu():
+    baseline = [
+        testutils.create_process(pid=100, cputime="0:10.00", commandline="was busy"),
+        testutils.create_process(pid=200, cputime="0:01.00", commandline="is busy"),
+    ]
+    now = testutils.now()
+    previous = [
+        testutils.create_process(pid=100, cputime="0:20.00", commandline="was busy", now=now),
+        testutils.create_process(pid=200, cputime="0:02.00", commandline="is busy", now=now),
+    ]
+    # Two seconds later
+    later = now + datetime.timedelta(seconds=2)
+    current = [
+        testutils.create_process(pid=100, cputime="0:20.00", commandline="was busy", now=later),
+        testutils.create_process(pid=200, cputime="0:03.00", commandline="is busy", now=later),
+    ]
+
+    recent = px_top.get_toplist(baseline, current, px_process_columns.ORDER_CPU_PERCENT,
+                                previous=px_process_columns.PxProcessColumns(previous))
+    assert [p.pid for p in recent] == [200, 100]
+    assert recent[0].cpu_percent == 50.0
+    assert recent[1].cpu_percent == 0.0
+
+    since_start = px_top.get_toplist(baseline, current, px_process_columns.ORDER_CPU_TIME,
+                                     previous=px_process_columns.PxProcessColumns(previous))
+    assert [p.pid for p in since_start] == [100, 200]
+    assert since_start[0].cpu_time_seconds == 10.0
+
+    # CPU percentages are recent in this order as well
+    assert since_start[1].cpu_percent == 50.0
+
+
 def test_get_screen_lines_high_screen():
     baseline = px_process.get_all()
     launchcounter = px_launchcounter.Launchcounter()
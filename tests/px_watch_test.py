@@ -0,0 +1,183 @@
+import pytest
+
+from px import px_file
+from px import px_watch
+from px import px_process
+from px import px_terminal
+from px import px_socket_index
+
+from . import testutils
+
+import sys
+if sys.version_info.major >= 3:
+    # For mypy PEP-484 static typing validation
+    from typing import Set   # NOQA
+    from typing import List  # NOQA
+
+
+class FakeFiles(object):
+    """
+    Stands in for px_file.get_own_files() and px_file.get_peer_files().
+    """
+
+    def __init__(self, monkeypatch):
+        self.own_files = set()  # type: Set[px_file.PxFile]
+        self.peer_files = set()  # type: Set[px_file.PxFile]
+        self.peer_lookups = []  # type: List[Set[px_file.PxFile]]
+
+        monkeypatch.setattr(px_file, "get_own_files", self.get_own_files)
+        monkeypatch.setattr(px_file, "get_peer_files", self.get_peer_files)
+        monkeypatch.setattr(px_process, "pid_is_alive", lambda pid: True)
+        monkeypatch.setattr(px_process, "get_all", lambda: [
+            testutils.create_process(pid=pid) for pid in [100, 200, 300]])
+
+    def get_own_files(self, pid, backend=None, socket_index=None):
+        return set(self.own_files)
+
+    def get_peer_files(self, pid, own_files, backend=None, socket_index=None, workers=None):
+        self.peer_lookups.append(set(own_files))
+        return set(self.peer_files)
+
+
+def _create_watcher():
+    return px_watch.PxWatcher(testutils.create_process(pid=100), px_file.BACKEND_LSOF)
+
+
+def test_watch_incremental(monkeypatch):
+    fake = FakeFiles(monkeypatch)
+    stdin = testutils.create_file("REG", "/dev/null", None, 100, fd=0)
+    pipe = testutils.create_file("FIFO", "pipe", None, 100, inode="17", access="w", fd=1)
+    peer = testutils.create_file("FIFO", "pipe", None, 200, inode="17", access="r", fd=0)
+    fake.own_files = set([stdin, pipe])
+    fake.peer_files = set([peer])
+
+    watcher = _create_watcher()
+    watcher.refresh()
+    # Peers are only looked up for IPC fds
+    assert fake.peer_lookups == [set([pipe])]
+    assert watcher.fds[0] == "/dev/null"
+    assert watcher.fds[1] == "[FIFO] -> cupsd(200) (pipe)"
+    assert watcher.changed_fds == set()
+    assert watcher.closed_fds == {}
+
+    # Nothing new, no peer lookups
+    watcher.refresh()
+    assert len(fake.peer_lookups) == 1
+
+    # Opening a regular file doesn't need any peer lookups either
+    log = testutils.create_file("REG", "/tmp/log", None, 100, fd=3)
+    fake.own_files.add(log)
+    watcher.refresh()
+    assert len(fake.peer_lookups) == 1
+    assert watcher.changed_fds == set([3])
+
+    # Closing the pipe forgets about its peer
+    fake.own_files.remove(pipe)
+    watcher.refresh()
+    assert watcher.closed_fds == {1: "[FIFO] -> cupsd(200) (pipe)"}
+    assert watcher._peer_files == {}
+
+    # Closed fds are only shown as closed once
+    watcher.refresh()
+    assert watcher.closed_fds == {}
+
+
+def test_watch_new_ipc_fd(monkeypatch):
+    fake = FakeFiles(monkeypatch)
+    fake.own_files = set([testutils.create_file("REG", "/dev/null", None, 100, fd=0)])
+
+    watcher = _create_watcher()
+    watcher.refresh()
+    assert fake.peer_lookups == []
+
+    socket = testutils.create_file(
+        "IPv4", "localhost:33815->localhost:postgresql", None, 100, "u", fd=3)
+    fake.own_files.add(socket)
+    fake.peer_files = set([testutils.create_file(
+        "IPv4", "localhost:postgresql->localhost:33815", None, 300, "u", fd=4)])
+    watcher.refresh()
+
+    # Only the new fd is looked up
+    assert fake.peer_lookups == [set([socket])]
+    assert watcher.changed_fds == set([3])
+    assert watcher.fds[3] == \
+        "[IPv4] -> cupsd(300) (localhost:33815->localhost:postgresql)"
+
+
+def test_watch_reuses_socket_index(monkeypatch):
+    fake = FakeFiles(monkeypatch)
+    fake.own_files = set([testutils.create_file("REG", "/dev/null", None, 100, fd=0)])
+
+    loads = []  # type: List[str]
+    monkeypatch.setattr(px_socket_index, "SocketIndex", lambda: loads.append("load"))
+    monkeypatch.setattr(px_watch, "FULL_REFRESH_SECONDS", 3600.0)
+
+    watcher = px_watch.PxWatcher(testutils.create_process(pid=100), px_file.BACKEND_PROC)
+    watcher.refresh()
+    assert len(loads) == 1
+
+    # Same fds, same index
+    watcher.refresh()
+    watcher.refresh()
+    assert len(loads) == 1
+
+    # New fds may be sockets the index doesn't know about
+    fake.own_files.add(testutils.create_file("REG", "/tmp/log", None, 100, fd=3))
+    watcher.refresh()
+    assert len(loads) == 2
+
+    # Full refreshes always get a new index
+    monkeypatch.setattr(px_watch, "FULL_REFRESH_SECONDS", 0.0)
+    watcher.refresh()
+    assert len(loads) == 3
+
+
+def test_to_screen_lines(monkeypatch):
+    fake = FakeFiles(monkeypatch)
+    log = testutils.create_file("REG", "/tmp/log", None, 100, fd=3)
+    fake.own_files = set([log])
+
+    watcher = _create_watcher()
+    watcher.refresh()
+    fake.own_files = set([testutils.create_file("REG", "/tmp/other", None, 100, fd=4)])
+    watcher.refresh()
+
+    lines = px_watch.to_screen_lines(watcher)
+    assert "cupsd(100)" in lines[0]
+    assert lines[2:] == [
+        "File descriptors:",
+        "      0: <closed>",
+        "      1: <closed>",
+        "      2: <closed>",
+        px_terminal.red("      3: /tmp/log (closed)"),
+        px_terminal.green("      4: /tmp/other"),
+        "",
+        "Network connections:",
+        "",
+        "Inter Process Communication:",
+    ]
+
+
+def test_watch_failure_propagates(monkeypatch):
+    class FakeTty(object):
+        def isatty(self):
+            return True
+
+    class FakeFullscreen(object):
+        def __enter__(self):
+            return None
+
+        def __exit__(self, exception_type, exception_value, exception_traceback):
+            return False
+
+    def failing_loop(watcher):
+        raise ValueError("watch loop failed")
+
+    FakeFiles(monkeypatch)
+    monkeypatch.setattr(sys, "stdout", FakeTty())
+    monkeypatch.setattr(px_terminal, "fullscreen_display", FakeFullscreen)
+    monkeypatch.setattr(px_watch, "_watch_loop", failing_loop)
+
+    # px.main() reports this and exits with an error, it must not be swallowed
+    with pytest.raises(ValueError):
+        px_watch.watch(100)
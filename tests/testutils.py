@@ -15,6 +15,7 @@ if sys.version_info.major >= 3:
     from typing import MutableMapping  # NOQA
     from typing import Optional        # NOQA
     from typing import List            # NOQA
+    from px import px_socket_index     # NOQA
 
 # An example time string that can be produced by ps
 TIMESTRING = "Mon Mar  7 09:33:11 2016"
@@ -77,8 +78,12 @@ def create_file(filetype,     # type: str
     return file
 
 
-def create_ipc_map(pid, all_files, is_root=False):
-    # type: (int, List[px_file.PxFile], bool) -> px_ipc_map.IpcMap
+def create_ipc_map(pid,                # type: int
+                   all_files,          # type: List[px_file.PxFile]
+                   is_root=False,      # type: bool
+                   socket_index=None,  # type: Optional[px_socket_index.SocketIndex]
+                   ):
+    # type: (...) -> px_ipc_map.IpcMap
     """Wrapper around IpcMap() so that we can test it"""
     pid2process = {}  # type: MutableMapping[int, px_process.PxProcess]
     for file in all_files:
@@ -93,7 +98,7 @@ def create_ipc_map(pid, all_files, is_root=False):
 
     process = pid2process[pid]
 
-    return px_ipc_map.IpcMap(process, all_files, processes, is_root)
+    return px_ipc_map.IpcMap(process, all_files, processes, is_root, socket_index)
 
 
 def fake_callchain(*args):